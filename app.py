@@ -1,29 +1,22 @@
-from langchain import hub
-from langchain.chains import create_retrieval_chain
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.memory import ConversationBufferMemory
-
-from utils.data_processing import load_documents, split_documents
-from utils.history import get_session_history
-from utils.debug import log_time
-from utils.streamlit_cache import get_retriever, get_llm
-
-from openrouter import ChatOpenRouter
-from runpod import ChatRunpod
-from retriever import create_qa_chain, create_qa_tool, create_prompt_react_agent
-from chain_history import create_history_aware_retriever
+from dotenv import load_dotenv
+# Before the utils imports, settings from .env must be visible to them
+load_dotenv()
+
+from utils.history import SummaryBufferHistory
+from utils.embedding_cache import CachedEmbeddings
+from utils.micro_batch import MicroBatchEmbeddings
+from utils.streaming import res_generator, StreamTimer, AgentStream
+from utils.async_runtime import run, iterate
+from utils.tracing import trace_request
+from utils.session_store import issue_session_id, verify_session_id
+from utils.streamlit_cache import get_retriever, get_llm, get_answer_cache, get_speculation_stats, get_runner, get_session_history_fn, get_agent_stats, get_index_version, warm_up
 
 import streamlit as st
-from streamlit.runtime.scriptrunner.script_run_context import get_script_run_ctx
 from pprint import pp
 import os
 import time
 import argparse
 
-from dotenv import load_dotenv
-load_dotenv()
-
 DEBUG = os.getenv("DEBUG") != None
 
 parser = argparse.ArgumentParser(
@@ -35,7 +28,7 @@ parser.add_argument(
 	"-l", "--llm",
 	type=str,
 	default="openrouter",
-	choices=["runpod", "openrouter"],
+	choices=["runpod", "openrouter", "router"],
 	help="Chose what provider of the LLM the program will use",
 )
 
@@ -51,10 +44,42 @@ parser.add_argument(
 	action=argparse.BooleanOptionalAction
 )
 
+parser.add_argument(
+	"-s", "--speculative",
+	action=argparse.BooleanOptionalAction,
+	help="Retrieve context for the raw question while it is being reformulated",
+)
+
+parser.add_argument(
+	"--mmap",
+	action=argparse.BooleanOptionalAction,
+	default=True,
+	help="Serve the FAISS index memory-mapped with an on-disk docstore instead of unpickling it",
+)
+
+parser.add_argument(
+	"-i", "--index",
+	type=str,
+	default=None,
+	help="FAISS index spec, e.g. 'IVF1024,SQ8;nprobe=16' or 'HNSW32;ef_search=64' (default: flat)",
+)
+
+parser.add_argument(
+	"-q", "--qa-index",
+	action=argparse.BooleanOptionalAction,
+	help="Search the question-keyed Q/A index (one vector per question, whole pairs returned)",
+)
+
 args = parser.parse_args()
 
-ctx = get_script_run_ctx()
-user_session = ctx.session_id
+# Keep the session in the URL so a reload, restart or another replica resumes it.
+# Only IDs signed by this deployment are accepted, anything else starts a new session
+user_session = st.query_params.get("session")
+if not verify_session_id(user_session):
+	if not verify_session_id(st.session_state.get("session_id")):
+		st.session_state.session_id = issue_session_id()
+	user_session = st.session_state.session_id
+	st.query_params["session"] = user_session
 
 runpod_model_name = os.getenv("RUNPOD_MODEL_NAME")
 
@@ -66,68 +91,75 @@ if args.llm == "runpod":
 else:
 	model_name = args.model
 
-retriever = get_retriever()
-
-llm = get_llm(args.llm, model_name, args.agent)
-
-st.title(f"Doctor LLM")
-
-if args.agent:
-	tool_rag = create_qa_tool(retriever)
-	tools = [tool_rag]
-	prompt = create_prompt_react_agent()
+start = time.perf_counter()
+runner_with_history = get_runner(args.llm, model_name, args.agent, args.index, args.mmap, args.speculative, args.qa_index)
+session_history = get_session_history_fn(args.llm, model_name, args.agent)
+runner_seconds = time.perf_counter() - start
 
-	agent = create_react_agent(llm, tools, prompt)
+# Pay for the first model forward pass and index search at server start,
+# not on the first question
+warm_up_seconds = warm_up(args.index, args.mmap, args.qa_index)
 
-	runner = AgentExecutor(
-		agent=agent,
-		tools=tools,
-		max_iterations=100,
-		verbose=DEBUG,
-		handle_parsing_errors=True,
-	)
-else:
-	history_aware_retriever = create_history_aware_retriever(llm, retriever)
-	question_answer_chain = create_qa_chain(llm, retriever)
-
-	runner = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+retriever = get_retriever(args.index, args.mmap, args.qa_index)
+llm = get_llm(args.llm, model_name, args.agent)
 
-### Statefully manage chat history ###
-if "messages" not in st.session_state:
-	st.session_state.messages = {}
+if not args.agent:
+	answer_cache = get_answer_cache(args.llm, model_name)
+	# Answers generated from an index that has since been rebuilt are dropped
+	answer_cache.sync_version(get_index_version(args.qa_index))
 
-runner_with_history = RunnableWithMessageHistory(
-	runner,
-	get_session_history,
-	input_messages_key="input",
-	history_messages_key="chat_history",
-	output_messages_key="answer",
-)
+st.title(f"Doctor LLM")
 
-for message in get_session_history(user_session).messages:
+history = session_history(user_session)
+for message in getattr(history, "all_messages", history.messages):
 	with st.chat_message(message.type):
 		st.markdown(message.content)
 
-def res_generator(stream):
-	for chunk in stream:
-		if answer_chunk := chunk.get("answer"):
-			yield answer_chunk
-
 if user_inp := st.chat_input("Message..."):
 	st.chat_message("human").markdown(user_inp)
 
 	prompt_obj = {"input": user_inp}
 
-	config = {
-		"configurable": {"session_id": user_session}
-	}
+	with st.chat_message("ai"), trace_request(user_session) as trace:
+		config = {
+			"configurable": {"session_id": user_session},
+			"callbacks": [trace.handler] if trace is not None else [],
+		}
 
-	with st.chat_message("ai"):
-		# res = log_time(runner.invoke)(prompt_obj, config=config)
-		res = runner_with_history.invoke(prompt_obj, config=config)
 		if args.agent:
-			st.markdown(res["output"])
+			res = AgentStream(
+				lambda inp, config: run(runner_with_history.ainvoke(inp, config=config)),
+				prompt_obj,
+				config=config,
+			)
 		else:
-			st.markdown(res["answer"])
+			res = res_generator(iterate(runner_with_history.astream(prompt_obj, config=config)))
+
+		timer = StreamTimer(res)
+		answer = st.write_stream(timer)
 		if DEBUG:
-			pp(res)
+			st.caption(timer.report())
+			print(f"answer: {timer.report()}")
+			print(f"runner: {runner_seconds * 1000:.1f}ms, warm-up: {warm_up_seconds:.2f}s (once per process)")
+			embedding_function = retriever.vectorstore.embedding_function
+			if isinstance(embedding_function, CachedEmbeddings):
+				print(f"embedding cache: {embedding_function.stats()}")
+			batcher = getattr(embedding_function, "embeddings", embedding_function)
+			if isinstance(batcher, MicroBatchEmbeddings):
+				print(f"embedding batches: {batcher.stats()}")
+			if args.agent:
+				print(f"agent: {get_agent_stats().stats()}")
+			else:
+				print(f"answer cache: {answer_cache.stats()}")
+			budgeted = getattr(history, "inner", history)
+			if isinstance(budgeted, SummaryBufferHistory):
+				print(f"history: {budgeted.last_tokens_saved} tokens saved, {budgeted.tokens_saved} total")
+			if args.llm == "router":
+				pp(getattr(llm, "bound", llm).tracker.stats())
+			if args.llm == "runpod":
+				print(f"runpod: {getattr(llm, 'bound', llm).monitor.stats()}")
+			if args.speculative:
+				print(f"speculative retrieval: {get_speculation_stats().stats()}")
+			if trace is not None:
+				print(f"trace {trace.request_id}: {trace.summary()}")
+			pp(res.result if args.agent else answer)
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Set
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+# Batch questions must not end up in the chat sessions of the app
+os.environ.setdefault("SESSION_STORE", "memory")
+
+from utils.async_runtime import run
+from utils.rate_limit import TokenBucket, retry_with_backoff
+from utils.streamlit_cache import get_runner
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Batch",
+	description="Answer a file of questions with the app's RAG chain or agent, concurrently and resumably",
+)
+
+parser.add_argument("input", help="Questions: .txt (one per line), .csv (question column) or .jsonl (question and optional id)")
+parser.add_argument("output", help="JSONL file results are appended to, also read back to resume")
+parser.add_argument("-l", "--llm", type=str, default="openrouter", choices=["runpod", "openrouter", "router"])
+parser.add_argument("-m", "--model", type=str, default="openchat/openchat-7b:free")
+parser.add_argument("-a", "--agent", action=argparse.BooleanOptionalAction)
+parser.add_argument("-i", "--index", type=str, default=None, help="FAISS index spec (default: flat)")
+parser.add_argument("-q", "--qa-index", action=argparse.BooleanOptionalAction, help="Search the question-keyed Q/A index")
+parser.add_argument("-c", "--concurrency", type=int, default=8, help="Requests in flight at once")
+parser.add_argument("-r", "--rate", type=float, default=None, help="Requests per minute (default: BATCH_RATE_PER_MINUTE or 60)")
+parser.add_argument("--burst", type=float, default=None, help="Requests allowed at once after idling (default: concurrency)")
+parser.add_argument("--retries", type=int, default=5, help="Retries of a failed question, with exponential backoff")
+parser.add_argument(
+	"--answer-cache",
+	action=argparse.BooleanOptionalAction,
+	default=False,
+	help="Reuse the answer of a near-duplicate question from the semantic answer cache (default: off, every question is answered)",
+)
+
+def question_id(question: str) -> str:
+	return hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+
+def read_questions(path: str) -> List[Dict[str, str]]:
+	"""
+	Read the questions of a batch, each with a stable ID used to resume.
+
+	Parameters:
+	- path (str): A .txt, .csv or .jsonl file.
+
+	Returns:
+	- List[Dict[str, str]]: Items with `id` and `question`.
+	"""
+	with open(path, newline="", encoding="utf-8") as file:
+		if path.endswith(".jsonl"):
+			items = [json.loads(line) for line in file if line.strip()]
+		elif path.endswith(".csv"):
+			items = [{"question": row.get("question") or row.get("Question") or row.get("Q")} for row in csv.DictReader(file)]
+		else:
+			items = [{"question": line.strip()} for line in file if line.strip()]
+
+	return [
+		{"id": str(item["id"]) if item.get("id") is not None else question_id(item["question"]), "question": item["question"]}
+		for item in items
+		if item.get("question")
+	]
+
+def read_done(path: str) -> Set[str]:
+	"""
+	Return the IDs already answered in an output file, failed ones are tried again.
+	"""
+	if not os.path.exists(path):
+		return set()
+	done = set()
+	with open(path, encoding="utf-8") as file:
+		for line in file:
+			try:
+				result = json.loads(line)
+			except json.JSONDecodeError:
+				# Last line cut short by an interruption
+				continue
+			if result.get("error") is None:
+				done.add(result["id"])
+	return done
+
+async def answer_all(items: List[Dict[str, str]], runner: Any, args: argparse.Namespace) -> Dict[str, Any]:
+	rate = args.rate or float(os.getenv("BATCH_RATE_PER_MINUTE", 60))
+	bucket = TokenBucket(rate / 60, args.burst or args.concurrency)
+	semaphore = asyncio.Semaphore(args.concurrency)
+	output_key = "output" if args.agent else "answer"
+
+	latencies: List[float] = []
+	counts = {"answered": 0, "failed": 0, "retries": 0}
+	start = time.perf_counter()
+
+	with open(args.output, "a", encoding="utf-8") as out:
+
+		async def answer(item: Dict[str, str]) -> None:
+			async def attempt() -> Dict[str, Any]:
+				await bucket.acquire()
+				# A fresh session per question, answers do not depend on each other
+				config = {"configurable": {"session_id": f"batch-{item['id']}"}}
+				return await runner.ainvoke({"input": item["question"]}, config=config)
+
+			async with semaphore:
+				t0 = time.perf_counter()
+				result = {**item, "answer": None, "error": None}
+				try:
+					output, attempts = await retry_with_backoff(attempt, retries=args.retries)
+					result["answer"] = output[output_key]
+					counts["answered"] += 1
+				except Exception as e:
+					attempts = args.retries + 1
+					result["error"] = f"{type(e).__name__}: {e}"
+					counts["failed"] += 1
+				result["attempts"] = attempts
+				result["seconds"] = time.perf_counter() - t0
+				counts["retries"] += attempts - 1
+				latencies.append(result["seconds"])
+
+				# One line per question as it finishes, so nothing is lost on interruption
+				out.write(json.dumps(result) + "\n")
+				out.flush()
+
+				finished = counts["answered"] + counts["failed"]
+				if finished % 10 == 0 or finished == len(items):
+					elapsed = time.perf_counter() - start
+					print(f"{finished}/{len(items)} done, {counts['failed']} failed, {finished / elapsed:.2f} questions/sec")
+
+		await asyncio.gather(*(answer(item) for item in items))
+
+	elapsed = time.perf_counter() - start
+	return {
+		**counts,
+		"seconds": elapsed,
+		"questions_per_second": len(items) / elapsed if elapsed else 0.0,
+		"p50_s": float(np.percentile(latencies, 50)) if latencies else None,
+		"p95_s": float(np.percentile(latencies, 95)) if latencies else None,
+	}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	model_name = os.getenv("RUNPOD_MODEL_NAME") if args.llm == "runpod" else args.model
+	runner = get_runner(args.llm, model_name, bool(args.agent), args.index, True, False, bool(args.qa_index), args.answer_cache)
+
+	# Repeated questions are answered once
+	items = list({item["id"]: item for item in read_questions(args.input)}.values())
+	done = read_done(args.output)
+	todo = [item for item in items if item["id"] not in done]
+	print(f"{len(items)} questions, {len(done)} already answered, {len(todo)} to go")
+
+	if todo:
+		report = run(answer_all(todo, runner, args))
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in report.items()))
@@ -0,0 +1,70 @@
+import argparse
+import sys
+import time
+
+from runpod import ChatRunpod, KeepWarm
+from utils.stub_openai import start_stub_server
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Cold Start Check",
+	description="Replay idle gaps against a stub endpoint simulating Runpod cold starts, with and without keep-warm",
+)
+
+parser.add_argument("-n", "--requests", type=int, default=5, help="Number of user requests per run, at least 2")
+parser.add_argument("--gap", type=float, default=3.0, help="Seconds of idle time between user requests")
+parser.add_argument("--cold-start", type=float, default=2.0, help="Cold start duration of the stub in seconds")
+parser.add_argument("--idle-timeout", type=float, default=1.0, help="Idle seconds after which the stub goes cold")
+
+def replay(keep_warm: bool, args: argparse.Namespace) -> dict:
+	"""
+	Send user requests separated by idle gaps and check the latency they see.
+
+	The first request always hits a cold endpoint, so the check is on the
+	following ones: they must be warm with keep-warm and cold without. The
+	monitor must also count every cold start the stub went through, pings included.
+	"""
+	server = start_stub_server(cold_start=args.cold_start, idle_timeout=args.idle_timeout)
+	# A fresh endpoint URL per run gives each run its own monitor
+	llm = ChatRunpod(model_name="stub", openai_api_key="stub", openai_api_base=server.base_url)
+	llm.monitor.idle_timeout = args.idle_timeout
+	llm.monitor.cold_start_threshold = args.cold_start / 2
+
+	warmer = KeepWarm(llm, interval=args.idle_timeout / 2, window=args.gap * 2).start() if keep_warm else None
+
+	latencies = []
+	for _ in range(args.requests):
+		start = time.perf_counter()
+		llm.invoke("Hello")
+		latencies.append(time.perf_counter() - start)
+		time.sleep(args.gap)
+
+	if warmer is not None:
+		warmer.stop()
+		warmer.thread.join()
+	server.shutdown()
+
+	stats = llm.monitor.stats()
+	later_latency = max(latencies[1:])
+	later_cold = later_latency > args.cold_start / 2
+	return {
+		"keep_warm": keep_warm,
+		"ok": later_cold != keep_warm and stats["cold_starts"] == server.cold_starts,
+		"mean_latency": sum(latencies) / len(latencies),
+		"later_max_latency": later_latency,
+		"stub_cold_starts": server.cold_starts,
+		**stats,
+	}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	if args.requests < 2:
+		parser.error("--requests must be at least 2")
+
+	rows = [replay(keep_warm, args) for keep_warm in (False, True)]
+	rows[-1]["ok"] = rows[-1]["ok"] and rows[-1]["mean_latency"] < rows[0]["mean_latency"]
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if not all(row["ok"] for row in rows):
+		sys.exit(1)
@@ -0,0 +1,107 @@
+import argparse
+import json
+import multiprocessing as mp
+import random
+import resource
+import time
+
+import numpy as np
+
+from utils.data_processing import iter_qa_batches
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Embedding Benchmark",
+	description="Compare the PyTorch and ONNX embedding backends: load time, latency, throughput, memory and deviation",
+)
+
+parser.add_argument(
+	"backends",
+	nargs="*",
+	default=["torch", "onnx", "onnx-int8"],
+	help="Backends to compare: torch, onnx (float) and onnx-int8",
+)
+
+parser.add_argument("-n", "--queries", type=int, default=200, help="Number of dataset questions embedded one by one")
+parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of every backend")
+parser.add_argument("-b", "--batch-size", type=int, default=32, help="Batch size of the throughput run")
+parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the questions")
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def sample_texts(n: int, seed: int) -> list:
+	texts = [f"Q: {q}\nA: {a}" for rows in iter_qa_batches(10000) for _, q, a in rows if q and q != "Question"]
+	random.Random(seed).shuffle(texts)
+	return texts[:n]
+
+def run_backend(backend: str, texts: list, threads: int, batch_size: int, out: mp.Queue) -> None:
+	"""
+	Measure one backend in a fresh process so its load time and memory are its own.
+	"""
+	start = time.perf_counter()
+	if backend == "torch":
+		import torch
+		from utils.retriever import create_embedding_function
+		if threads:
+			torch.set_num_threads(threads)
+		embeddings = create_embedding_function(batch_size=batch_size)
+	else:
+		from utils.retriever import create_embedding_function
+		embeddings = create_embedding_function(
+			batch_size=batch_size,
+			backend="onnx",
+			threads=threads,
+			quantize=backend == "onnx-int8",
+		)
+	embeddings.embed_query("warm up")
+	load_seconds = time.perf_counter() - start
+
+	questions = [text.split("\nA: ")[0][3:] for text in texts]
+	latencies = []
+	for question in questions:
+		t0 = time.perf_counter()
+		embeddings.embed_query(question)
+		latencies.append(time.perf_counter() - t0)
+
+	t0 = time.perf_counter()
+	vectors = embeddings.embed_documents(texts)
+	batch_seconds = time.perf_counter() - t0
+
+	out.put({
+		"backend": backend,
+		"load_s": load_seconds,
+		"query_p50_ms": float(np.percentile(latencies, 50) * 1000),
+		"query_p99_ms": float(np.percentile(latencies, 99) * 1000),
+		"docs_per_second": len(texts) / batch_seconds,
+		# Peak resident memory of the process, in KiB on Linux
+		"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		"vectors": vectors,
+	})
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	texts = sample_texts(args.queries, args.seed)
+
+	ctx = mp.get_context("spawn")
+	rows = []
+	for backend in args.backends:
+		out = ctx.Queue()
+		process = ctx.Process(target=run_backend, args=(backend, texts, args.threads, args.batch_size, out))
+		process.start()
+		rows.append(out.get())
+		process.join()
+
+	reference = next((row["vectors"] for row in rows if row["backend"] == "torch"), None)
+	for row in rows:
+		vectors = np.asarray(row.pop("vectors"))
+		if reference is not None:
+			ref = np.asarray(reference)
+			similarity = (vectors * ref).sum(axis=1) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(ref, axis=1))
+			row["max_cosine_distance"] = float(1 - similarity.min())
+			# What the export check compares, it also catches a difference of scale
+			row["max_relative_l2"] = float((np.linalg.norm(vectors - ref, axis=1) / np.linalg.norm(ref, axis=1)).max())
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump({"texts": len(texts), "seed": args.seed, "threads": args.threads, "results": rows}, file, indent=2)
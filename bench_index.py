@@ -0,0 +1,86 @@
+import argparse
+import json
+import random
+import time
+
+import faiss
+import numpy as np
+
+from utils.data_processing import iter_qa_batches
+from utils.index_spec import IndexSpec
+from utils.retriever import create_embedding_function
+from retriever import create_or_load_vectorstore, load_or_build_ann_index
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Index Benchmark",
+	description="Compare FAISS index types against the flat index: recall@k, query latency and memory",
+)
+
+parser.add_argument(
+	"specs",
+	nargs="+",
+	help="Index specs to compare, e.g. 'IVF1024,Flat;nprobe=16' 'HNSW32;ef_search=64' 'IVF1024,PQ16'",
+)
+
+parser.add_argument("-k", type=int, default=4, help="Number of neighbours per query")
+parser.add_argument("-n", "--queries", type=int, default=1000, help="Number of dataset questions used as queries")
+parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the queries")
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def sample_questions(n: int, seed: int) -> list:
+	questions = [
+		question
+		for rows in iter_qa_batches(10000)
+		for _, question, _ in rows
+		if question and question != "Question"
+	]
+	random.Random(seed).shuffle(questions)
+	return questions[:n]
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int) -> tuple:
+	"""
+	Search every query on its own, as the app does, and time each search.
+	"""
+	ids = np.empty((len(queries), k), dtype=np.int64)
+	latencies = np.empty(len(queries))
+	for i, query in enumerate(queries):
+		start = time.perf_counter()
+		_, ids[i] = index.search(query[None, :], k)
+		latencies[i] = time.perf_counter() - start
+	return ids, latencies
+
+def report(name: str, index: faiss.Index, ids: np.ndarray, truth: np.ndarray, latencies: np.ndarray, k: int) -> dict:
+	recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, truth)])
+	return {
+		"index": name,
+		f"recall@{k}": float(recall),
+		"p50_ms": float(np.percentile(latencies, 50) * 1000),
+		"p99_ms": float(np.percentile(latencies, 99) * 1000),
+		"bytes_per_vector": faiss.serialize_index(index).nbytes / max(1, index.ntotal),
+	}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	embedding_function = create_embedding_function()
+	base = create_or_load_vectorstore(embedding_function)
+	queries = np.asarray(
+		embedding_function.embed_documents(sample_questions(args.queries, args.seed)),
+		dtype=np.float32,
+	)
+
+	truth, latencies = measure(base.index, queries, args.k)
+	rows = [report("Flat", base.index, truth, truth, latencies, args.k)]
+
+	for text in args.specs:
+		spec = IndexSpec.parse(text)
+		vectorstore = load_or_build_ann_index(embedding_function, spec, base=base)
+		ids, latencies = measure(vectorstore.index, queries, args.k)
+		rows.append(report(text, vectorstore.index, ids, truth, latencies, args.k))
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump({"k": args.k, "queries": len(queries), "seed": args.seed, "results": rows}, file, indent=2)
@@ -0,0 +1,85 @@
+import argparse
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+from utils.data_processing import iter_qa_batches
+from utils.micro_batch import MicroBatchEmbeddings
+from utils.retriever import create_embedding_function
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Micro-batch Benchmark",
+	description="Throughput and latency of query embeddings under concurrency, per micro-batch window",
+)
+
+parser.add_argument("-w", "--windows", type=float, nargs="+", default=[0, 1, 2, 5, 10], help="Batch windows to compare, in milliseconds")
+parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Simulated sessions querying at once")
+parser.add_argument("-n", "--queries", type=int, default=50, help="Queries sent by every session, one after the other")
+parser.add_argument("--max-batch", type=int, default=32, help="Largest batch of one forward pass")
+parser.add_argument("--backend", type=str, default="torch", choices=["torch", "onnx"])
+parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the questions")
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def sample_questions(n: int, seed: int) -> list:
+	questions = [q for rows in iter_qa_batches(10000) for _, q, _ in rows if q and q != "Question"]
+	random.Random(seed).shuffle(questions)
+	return questions[:n]
+
+def run_clients(embed, questions: list, concurrency: int, n: int) -> dict:
+	"""
+	Send `n` queries from each of `concurrency` threads and time every call.
+	"""
+	latencies = [[] for _ in range(concurrency)]
+	barrier = threading.Barrier(concurrency + 1)
+
+	def client(i: int) -> None:
+		barrier.wait()
+		for j in range(n):
+			# Distinct questions, so the batcher cannot merge duplicates
+			question = questions[(i * n + j) % len(questions)]
+			t0 = time.perf_counter()
+			embed(question)
+			latencies[i].append(time.perf_counter() - t0)
+
+	threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	barrier.wait()
+	start = time.perf_counter()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - start
+
+	flat = np.concatenate(latencies)
+	return {
+		"queries_per_second": len(flat) / elapsed,
+		"p50_ms": float(np.percentile(flat, 50) * 1000),
+		"p99_ms": float(np.percentile(flat, 99) * 1000),
+	}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	questions = sample_questions(max(args.concurrency) * args.queries, args.seed)
+
+	embeddings = create_embedding_function(backend=args.backend, batch_size=args.max_batch)
+	embeddings.embed_documents(questions[:args.max_batch])
+
+	rows = []
+	for concurrency in args.concurrency:
+		# One forward pass per query, the behaviour without micro-batching
+		rows.append({"concurrency": concurrency, "window_ms": "off", **run_clients(embeddings.embed_query, questions, concurrency, args.queries)})
+
+		for window in args.windows:
+			batcher = MicroBatchEmbeddings(embeddings, window=window / 1000, max_batch=args.max_batch)
+			result = run_clients(batcher.embed_query, questions, concurrency, args.queries)
+			rows.append({"concurrency": concurrency, "window_ms": window, **result, "mean_batch": batcher.stats()["mean_batch"]})
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump({"backend": args.backend, "queries": args.queries, "max_batch": args.max_batch, "seed": args.seed, "results": rows}, file, indent=2)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from utils.disk_store import INDEX_NAME, read_index_files, write_index_files
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Mmap Check",
+	description="Load time and private memory of the index exports served with --mmap, on random vectors",
+)
+
+parser.add_argument("-n", "--vectors", type=int, default=200_000, help="Number of vectors")
+parser.add_argument("-d", "--dim", type=int, default=384, help="Vector dimension (all-MiniLM-L6-v2: 384)")
+parser.add_argument("-q", "--queries", type=int, default=20, help="Queries checked against an in-memory flat index")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def rss_anon_mb() -> float:
+	"""
+	Private (anonymous) resident memory of the process. Pages of a memory-mapped
+	file are not counted, they live in the page cache shared by every process.
+	"""
+	with open("/proc/self/status", encoding="utf-8") as file:
+		for line in file:
+			if line.startswith("RssAnon:"):
+				return int(line.split()[1]) / 1024
+	return 0.0
+
+def measure(kind: str, path: str, queries: np.ndarray, expected: np.ndarray, out: mp.Queue) -> None:
+	"""
+	Load one export in a fresh process and measure it.
+	"""
+	before = rss_anon_mb()
+	start = time.perf_counter()
+	if kind == "read_index":
+		# Plain read of a FAISS file, what the pickled store costs
+		index = faiss.read_index(os.path.join(path, INDEX_NAME))
+	else:
+		index = read_index_files(path)
+	load_seconds = time.perf_counter() - start
+	loaded = rss_anon_mb()
+
+	t0 = time.perf_counter()
+	_, ids = index.search(queries, 10)
+	search_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+	out.put({
+		"kind": kind,
+		"load_ms": load_seconds * 1000,
+		"private_mb_after_load": loaded - before,
+		"private_mb_after_search": rss_anon_mb() - before,
+		"search_ms": search_ms,
+		"top1_match": float((ids[:, 0] == expected[:, 0]).mean()),
+	})
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	rng = np.random.default_rng(args.seed)
+	vectors = rng.standard_normal((args.vectors, args.dim), dtype=np.float32)
+	queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+	flat = faiss.IndexFlatL2(args.dim)
+	flat.add(vectors)
+	_, expected = flat.search(queries, 10)
+
+	ivf = faiss.index_factory(args.dim, "IVF256,Flat")
+	ivf.train(vectors[:50_000])
+	ivf.add(vectors)
+	ivf.nprobe = 256
+	del vectors
+
+	with tempfile.TemporaryDirectory() as tmp:
+		paths = {}
+		for kind, index in (("flat", flat), ("ivf", ivf)):
+			paths[kind] = os.path.join(tmp, kind)
+			os.makedirs(paths[kind])
+			write_index_files(index, paths[kind])
+		paths["read_index"] = os.path.join(tmp, "read_index")
+		os.makedirs(paths["read_index"])
+		faiss.write_index(flat, os.path.join(paths["read_index"], INDEX_NAME))
+		del flat, ivf
+
+		ctx = mp.get_context("spawn")
+		rows = []
+		for kind in ("read_index", "flat", "ivf"):
+			out = ctx.Queue()
+			process = ctx.Process(target=measure, args=(kind, paths[kind], queries, expected, out))
+			process.start()
+			rows.append(out.get())
+			process.join()
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump({"vectors": args.vectors, "dim": args.dim, "results": rows}, file, indent=2)
@@ -0,0 +1,145 @@
+import argparse
+import json
+import random
+import subprocess
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from utils.context_packing import pack_context
+from utils.data_processing import iter_qa_batches
+from utils.history import count_text_tokens
+from utils.index_spec import IndexSpec
+from utils.retriever import create_embedding_function
+from retriever import INDEX_PATH, QA_INDEX_PATH, create_or_load_vectorstore
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Retrieval Benchmark",
+	description="Measure retrieval quality and latency on the MASHQA questions, no LLM or network needed",
+)
+
+parser.add_argument("-k", type=int, nargs="+", default=[1, 4, 10], help="Cut-offs to report recall@k for")
+parser.add_argument("-n", "--queries", type=int, default=1000, help="Number of dataset questions used as queries")
+parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the queries")
+parser.add_argument("--warmup", type=int, default=10, help="Untimed queries run first")
+parser.add_argument("-i", "--index", type=str, default=None, help="FAISS index spec, flat when omitted")
+parser.add_argument("--mmap", action=argparse.BooleanOptionalAction, default=True, help="Search the memory-mapped export")
+parser.add_argument("-q", "--qa-index", action=argparse.BooleanOptionalAction, help="Search the question-keyed Q/A index")
+parser.add_argument("--pack", action=argparse.BooleanOptionalAction, help="Pack the context as the app does (see pack_context)")
+parser.add_argument("--fetch-k", type=int, default=20, help="Candidates searched before packing")
+parser.add_argument("--max-tokens", type=int, default=1000, help="Token budget of the packed context")
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def load_queries(n: int, seed: int) -> list:
+	"""
+	Sample labeled queries from the dataset.
+
+	Every dataset row is indexed as its own document, so the rows holding a
+	question are its relevant documents. Questions asked in several rows
+	count every one of them as relevant. Rows are matched by their stable
+	id, which survives incremental index updates.
+
+	Returns:
+	- list: (question, set of relevant row ids) pairs.
+	"""
+	rows = defaultdict(set)
+	for batch in iter_qa_batches(10000):
+		for row_id, question, _ in batch:
+			if question and question != "Question":
+				rows[question.strip()].add(row_id)
+
+	questions = sorted(rows)
+	random.Random(seed).shuffle(questions)
+	return [(question, rows[question]) for question in questions[:n]]
+
+def percentiles(seconds: list) -> dict:
+	ms = np.asarray(seconds) * 1000
+	return {f"p{p}_ms": float(np.percentile(ms, p)) for p in (50, 95, 99)}
+
+def git_commit() -> str:
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	random.seed(args.seed)
+	np.random.seed(args.seed)
+
+	# No cache, every query pays for its embedding as a new question would
+	embedding_function = create_embedding_function()
+	vectorstore = create_or_load_vectorstore(
+		embedding_function,
+		index_path=QA_INDEX_PATH if args.qa_index else INDEX_PATH,
+		index_spec=IndexSpec.parse(args.index) if args.index else None,
+		mmap=args.mmap,
+		qa=bool(args.qa_index),
+	)
+
+	queries = load_queries(args.queries, args.seed)
+	max_k = max(args.k)
+
+	for question, _ in queries[:args.warmup]:
+		vectorstore.similarity_search_by_vector(embedding_function.embed_query(question), k=max_k)
+
+	def search(vector: list) -> list:
+		if not args.pack:
+			return vectorstore.similarity_search_by_vector(vector, k=max_k)
+		candidates = vectorstore.similarity_search_with_score_by_vector(vector, k=args.fetch_k)
+		return pack_context(candidates, count_text_tokens, max_tokens=args.max_tokens, max_docs=max_k)
+
+	embed_seconds, search_seconds, context_tokens = [], [], []
+	hits = {k: 0 for k in args.k}
+	reciprocal_ranks = []
+
+	start = time.perf_counter()
+	for question, relevant in queries:
+		t0 = time.perf_counter()
+		vector = embedding_function.embed_query(question)
+		t1 = time.perf_counter()
+		docs = search(vector)
+		t2 = time.perf_counter()
+		embed_seconds.append(t1 - t0)
+		search_seconds.append(t2 - t1)
+		context_tokens.append(sum(count_text_tokens(doc.page_content) for doc in docs))
+
+		# Chunks of one row, or the question and summary of one pair, count once
+		rows = list(dict.fromkeys(doc.metadata.get("id") for doc in docs))
+		rank = next((i + 1 for i, row in enumerate(rows) if row in relevant), None)
+		reciprocal_ranks.append(1 / rank if rank else 0.0)
+		for k in args.k:
+			hits[k] += rank is not None and rank <= k
+	elapsed = time.perf_counter() - start
+
+	result = {
+		"commit": git_commit(),
+		"index": args.index or "Flat",
+		"qa_index": bool(args.qa_index),
+		"vectors": vectorstore.index.ntotal,
+		"mmap": args.mmap,
+		"queries": len(queries),
+		"seed": args.seed,
+		**{f"recall@{k}": hits[k] / len(queries) for k in sorted(args.k)},
+		f"mrr@{max_k}": float(np.mean(reciprocal_ranks)),
+		"pack": bool(args.pack),
+		"context_tokens_mean": float(np.mean(context_tokens)),
+		"queries_per_second": len(queries) / elapsed,
+		"total": percentiles([e + s for e, s in zip(embed_seconds, search_seconds)]),
+		"embed": percentiles(embed_seconds),
+		"search": percentiles(search_seconds),
+	}
+
+	for key, value in result.items():
+		if isinstance(value, dict):
+			value = "  ".join(f"{name}={ms:.3g}" for name, ms in value.items())
+		elif isinstance(value, float):
+			value = f"{value:.4g}"
+		print(f"{key}: {value}")
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump(result, file, indent=2)
@@ -0,0 +1,73 @@
+import argparse
+import json
+import random
+import time
+
+import faiss
+import numpy as np
+
+from utils.data_processing import iter_qa_batches
+from utils.retriever import create_embedding_function
+from utils.shards import ShardedVectorStore
+from retriever import create_or_load_vectorstore
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Shard Benchmark",
+	description="Search latency of N parallel shards against one monolithic index of the same total size",
+)
+
+parser.add_argument("-s", "--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="Shard counts to compare, each shard a copy of the MASHQA index")
+parser.add_argument("-n", "--queries", type=int, default=200, help="Number of dataset questions used as queries")
+parser.add_argument("-k", type=int, default=10, help="Results per query")
+parser.add_argument("--mmap", action=argparse.BooleanOptionalAction, default=True, help="Search the memory-mapped export")
+parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the queries")
+parser.add_argument("--json", type=str, default=None, help="Also write the report to this JSON file")
+
+def sample_questions(n: int, seed: int) -> list:
+	questions = [q for rows in iter_qa_batches(10000) for _, q, _ in rows if q and q != "Question"]
+	random.Random(seed).shuffle(questions)
+	return questions[:n]
+
+def time_queries(search, vectors: np.ndarray) -> dict:
+	search(vectors[0])
+	latencies = []
+	for vector in vectors:
+		t0 = time.perf_counter()
+		search(vector)
+		latencies.append(time.perf_counter() - t0)
+	ms = np.asarray(latencies) * 1000
+	return {"p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99))}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	embedding_function = create_embedding_function()
+	vectorstore = create_or_load_vectorstore(embedding_function, mmap=args.mmap)
+	# Embedded up front, only the search is timed
+	queries = np.asarray(embedding_function.embed_documents(sample_questions(args.queries, args.seed)), dtype=np.float32)
+	base = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+
+	rows = []
+	for n in args.shards:
+		# N equal corpora: the same index searched as N shards, merged and with documents fetched
+		sharded = ShardedVectorStore({f"shard{i}": vectorstore for i in range(n)}, embedding_function)
+		row = {"shards": n, "vectors": n * len(base)}
+		row.update({f"sharded_{key}": value for key, value in time_queries(
+			lambda vector: sharded.similarity_search_with_score_by_vector(vector.tolist(), k=args.k), queries
+		).items()})
+
+		# The same vectors in one flat index, search only
+		monolith = faiss.IndexFlatL2(base.shape[1])
+		monolith.add(np.tile(base, (n, 1)))
+		row.update({f"monolith_{key}": value for key, value in time_queries(
+			lambda vector: monolith.search(vector[None, :], args.k), queries
+		).items()})
+		rows.append(row)
+		sharded.executor.shutdown()
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as file:
+			json.dump({"queries": len(queries), "k": args.k, "mmap": args.mmap, "seed": args.seed, "results": rows}, file, indent=2)
@@ -1,25 +1,25 @@
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
 from langchain_openai import ChatOpenAI
 from langchain import chains
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable, RunnableBranch, RunnableConfig, RunnableLambda, RunnablePassthrough
 
 from openrouter import ChatOpenRouter
 from utils.debug import log_time
 
-@log_time
-def create_history_aware_retriever(
-	llm: ChatOpenAI, 
-	retriever: BaseRetriever
-) -> BaseRetriever:
+def create_contextualise_q_prompt() -> ChatPromptTemplate:
 	"""
-	Create a history-aware retriever that reformulates questions based on chat history.
-
-	Parameters:
-	- llm (ChatOpenAI): The language model used for question reformulation.
-	- retriever (BaseRetriever): The retriever instance used to fetch relevant documents.
+	Create the prompt asking the LLM to turn the latest question into a standalone question.
 
 	Returns:
-	- BaseRetriever: A history-aware retriever instance that reformulates questions based on the given chat history.
+	- ChatPromptTemplate: The prompt taking `chat_history` and `input`.
 	"""
 	contextualise_q_system_prompt = (
 		"Given a chat history and the latest user question "
@@ -28,12 +28,138 @@ def create_history_aware_retriever(
 		"without the chat history. Do NOT answer the question, "
 		"just reformulate it if needed and otherwise return it as is."
 	)
-	contextualise_q_prompt = ChatPromptTemplate.from_messages(
+	return ChatPromptTemplate.from_messages(
 		[
 			("system", contextualise_q_system_prompt),
 			MessagesPlaceholder("chat_history"),
 			("human", "{input}"),
 		]
 	)
-	return chains.create_history_aware_retriever(llm, retriever, contextualise_q_prompt)
 
+@log_time
+def create_standalone_question_chain(llm: ChatOpenAI) -> Runnable:
+	"""
+	Create a chain returning the standalone form of the latest question.
+
+	Without chat history the input is returned as is and no LLM call is made.
+
+	Parameters:
+	- llm (ChatOpenAI): The language model used for question reformulation.
+
+	Returns:
+	- Runnable: A runnable mapping `input` and `chat_history` to the standalone question.
+	"""
+	return RunnableBranch(
+		(lambda x: not x.get("chat_history", False), lambda x: x["input"]),
+		create_contextualise_q_prompt() | llm | StrOutputParser(),
+	).with_config(run_name="rewrite_question")
+
+@log_time
+def create_history_aware_retriever(
+	llm: ChatOpenAI, 
+	retriever: BaseRetriever
+) -> BaseRetriever:
+	"""
+	Create a history-aware retriever that reformulates questions based on chat history.
+
+	Parameters:
+	- llm (ChatOpenAI): The language model used for question reformulation.
+	- retriever (BaseRetriever): The retriever instance used to fetch relevant documents.
+
+	Returns:
+	- BaseRetriever: A history-aware retriever instance that reformulates questions based on the given chat history.
+	"""
+	return chains.create_history_aware_retriever(llm, retriever, create_contextualise_q_prompt())
+
+class SpeculationStats:
+	"""
+	Counters of speculative retrieval: how often the results retrieved for
+	the raw input could be reused and how much search time that saved.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.attempts = 0
+		self.hits = 0
+		self.saved_seconds = 0.0
+		self.wasted_seconds = 0.0
+
+	def record(self, hit: bool, seconds: float) -> None:
+		with self.lock:
+			self.attempts += 1
+			if hit:
+				self.hits += 1
+				self.saved_seconds += seconds
+			else:
+				self.wasted_seconds += seconds
+
+	def stats(self) -> Dict[str, float]:
+		"""
+		Return the speculation counters.
+
+		Returns:
+		- Dict[str, float]: Attempts, hits, hit rate and the search seconds saved or wasted.
+		"""
+		with self.lock:
+			return {
+				"attempts": self.attempts,
+				"hits": self.hits,
+				"hit_rate": self.hits / self.attempts if self.attempts else 0.0,
+				"saved_seconds": self.saved_seconds,
+				"wasted_seconds": self.wasted_seconds,
+			}
+
+@log_time
+def create_speculative_retrieval_chain(
+	llm: ChatOpenAI,
+	retriever: BaseRetriever,
+	embeddings: Embeddings,
+	threshold: float = 0.9,
+	stats: Optional[SpeculationStats] = None,
+) -> Runnable:
+	"""
+	Create a chain retrieving context for the raw input while the question is reformulated.
+
+	Once the standalone question is known, the speculative results are reused
+	if its embedding is at least `threshold` cosine-similar to the raw input,
+	otherwise the retriever is queried again with the standalone question.
+
+	Parameters:
+	- llm (ChatOpenAI): The language model used for question reformulation.
+	- retriever (BaseRetriever): The retriever instance used to fetch relevant documents.
+	- embeddings (Embeddings): Embedding function used to compare the raw and standalone questions.
+	- threshold (float): Minimum cosine similarity to reuse the speculative results.
+	- stats (Optional[SpeculationStats]): Counters updated on every follow-up question.
+
+	Returns:
+	- Runnable: A runnable adding `standalone_question` and `context` to its input.
+	"""
+	def speculate(x: dict, config: RunnableConfig) -> dict:
+		start = time.perf_counter()
+		docs = retriever.invoke(x["input"], config=config)
+		return {"docs": docs, "seconds": time.perf_counter() - start}
+
+	def resolve(x: dict, config: RunnableConfig) -> dict:
+		x = dict(x)
+		speculative = x.pop("speculative")
+		question = x["standalone_question"]
+
+		# Without history the input is the standalone question
+		if not x.get("chat_history"):
+			return {**x, "context": speculative["docs"]}
+
+		raw = np.asarray(embeddings.embed_query(x["input"]))
+		rewritten = np.asarray(embeddings.embed_query(question))
+		similarity = float(raw @ rewritten / (np.linalg.norm(raw) * np.linalg.norm(rewritten) or 1.0))
+
+		hit = similarity >= threshold
+		if stats is not None:
+			stats.record(hit, speculative["seconds"])
+		if hit:
+			return {**x, "context": speculative["docs"]}
+		return {**x, "context": retriever.invoke(question, config=config)}
+
+	return RunnablePassthrough.assign(
+		standalone_question=create_standalone_question_chain(llm),
+		speculative=RunnableLambda(speculate),
+	) | RunnableLambda(resolve)
@@ -0,0 +1,61 @@
+import argparse
+import sys
+import time
+
+from openrouter import ChatOpenRouter
+from router import ChatRouter
+from utils.stub_openai import start_stub_server
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Router Check",
+	description="Check failover and hedging of the router against local stub endpoints",
+)
+
+parser.add_argument("--slow", type=float, default=2.0, help="Delay of the slow stub in seconds")
+parser.add_argument("--hedge-delay", type=float, default=0.2, help="Seconds before the router hedges a backend it has no samples of")
+
+def stub_llm(**options) -> ChatOpenRouter:
+	server = start_stub_server(**options)
+	# The router does the failing over, the client must not retry on its own
+	return ChatOpenRouter(model_name="stub", openai_api_key="stub", openai_api_base=server.base_url, max_retries=0)
+
+def check(name: str, router: ChatRouter, stream: bool, expected: dict) -> dict:
+	"""
+	Send one request through a fresh router and compare its routing decision with `expected`.
+	"""
+	start = time.perf_counter()
+	if stream:
+		answer = "".join(chunk.content for chunk in router.stream("Hello"))
+	else:
+		answer = router.invoke("Hello").content
+	latency = time.perf_counter() - start
+
+	decision = router.tracker.stats()["decisions"][-1]
+	ok = bool(answer) and all(decision[key] == value for key, value in expected.items())
+	return {"check": name, "stream": stream, "ok": ok, "latency": latency, **{key: decision[key] for key in expected}}
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	rows = []
+	for stream in (False, True):
+		# Backends without samples are tried in order, so the first one is the primary
+		router = ChatRouter(
+			backends={"failing": stub_llm(error_rate=1.0), "healthy": stub_llm()},
+			default_hedge_delay=args.slow,
+		)
+		rows.append(check("failover", router, stream, {"winner": "healthy", "failed_over": True, "hedged": False}))
+
+		router = ChatRouter(
+			backends={"slow": stub_llm(delay=args.slow), "fast": stub_llm()},
+			default_hedge_delay=args.hedge_delay,
+			min_hedge_delay=args.hedge_delay,
+		)
+		rows.append(check("hedge", router, stream, {"winner": "fast", "failed_over": False, "hedged": True}))
+		rows[-1]["ok"] = rows[-1]["ok"] and rows[-1]["latency"] < args.slow
+
+	for row in rows:
+		print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+	if not all(row["ok"] for row in rows):
+		sys.exit(1)
@@ -1,67 +1,195 @@
+import argparse
 import json
 import os
-import csv
-import numpy as np
-import pandas as pd
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
-load_dotenv()
+from utils.data_processing import DATASET_PATH, row_id
+
+SCHEMA = pa.schema([
+	("id", pa.string()),
+	("question", pa.string()),
+	("answer", pa.string()),
+	("source", pa.string()),
+])
+
+def iter_json_array(file: TextIO, key: str = "data", chunk_size: int = 1 << 20) -> Iterator[dict]:
+	"""
+	Stream the items of the top-level array `key` of a JSON document.
+
+	Only one item plus a read chunk is held in memory, the document is never
+	loaded as a whole. MASHQA files are in the SQuAD format, where `data`
+	holds one item per article.
+
+	Parameters:
+	- file (TextIO): The open JSON file.
+	- key (str): Name of the top-level array.
+	- chunk_size (int): Number of characters read at a time.
+
+	Returns:
+	- Iterator[dict]: The decoded items.
+	"""
+	decoder = json.JSONDecoder()
+	start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+	name = getattr(file, "name", "<stream>")
+	buffer = ""
+	pos = 0
+	# Characters of the file before the start of the buffer
+	offset = 0
+	eof = False
+
+	def fill(size: int = chunk_size) -> bool:
+		nonlocal buffer, pos, offset, eof
+		chunk = file.read(size)
+		eof = not chunk
+		# Decoded items are dropped once per read, not once per item
+		buffer = buffer[pos:] + chunk
+		offset += pos
+		pos = 0
+		return not eof
+
+	while (match := start.search(buffer)) is None:
+		if not fill():
+			return
+	pos = match.end()
+
+	while True:
+		while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+			pos += 1
+		if pos == len(buffer):
+			if not fill():
+				raise ValueError(f"Unterminated '{key}' array in {name}")
+			continue
+		if buffer[pos] == "]":
+			return
+
+		try:
+			item, pos = decoder.raw_decode(buffer, pos)
+		except json.JSONDecodeError as e:
+			at = offset + e.pos
+			# The item continues in the next chunk if it stops at the end of the buffer, up to a
+			# cut \uXXXX\uXXXX escape or literal, or inside a string running to the end
+			if (len(buffer) - e.pos <= 12 or e.msg.startswith("Unterminated string")) and fill(max(chunk_size, len(buffer))):
+				# Doubling the read keeps decoding an item larger than a chunk linear
+				continue
+			raise ValueError(f"Malformed JSON in {name} at character {at}: {e.msg}") from e
+
+		yield item
+
+def extract_qa_pairs(json_path: str) -> List[Tuple[str, str]]:
+	"""
+	Extract the (question, answer) pairs of one MASHQA file.
+
+	Questions without an answer get an empty one.
+
+	Parameters:
+	- json_path (str): Path of the JSON file.
+
+	Returns:
+	- List[Tuple[str, str]]: The pairs in file order.
+	"""
+	pairs = []
+	with open(json_path, "r", encoding="utf-8") as file:
+		for item in iter_json_array(file):
+			for paragraph in item["paragraphs"]:
+				for qa in paragraph["qas"]:
+					answer = qa["answers"][0]["text"] if qa["answers"] else ""
+					pairs.append((qa["question"].strip(), answer.strip()))
+	return pairs
+
+def ingest(
+	input_folder: str,
+	output_path: str = DATASET_PATH,
+	workers: Optional[int] = None,
+	row_group_size: int = 10000,
+) -> int:
+	"""
+	Convert every MASHQA JSON file of a folder into one deduplicated Parquet dataset.
+
+	Files are parsed in parallel and written in sorted file order, so the
+	output is the same from run to run. Pairs whose question and answer only
+	differ in whitespace are kept once. The dataset is written next to
+	`output_path` and moved into place at the end.
 
-def process_qa_pairs(data):
-	qa_pairs = []
-	for item in data['data']:
-		for paragraph in item['paragraphs']:
-			for qa in paragraph['qas']:
-				question = qa['question']
-				answer = qa['answers'][0]['text'] if qa['answers'] else None
-				qa_pairs.append((question, answer))
-	return qa_pairs
+	Parameters:
+	- input_folder (str): Folder holding the MASHQA JSON files.
+	- output_path (str): Destination Parquet file.
+	- workers (Optional[int]): Number of parsing processes, one per CPU when None.
+	- row_group_size (int): Number of rows per Parquet row group.
 
-def convert_json_to_csv(json_filename, csv_filename):
-	# Open the JSON file for reading
-	with open(json_filename, 'r') as file:
-		# Load the JSON data
-		data = json.load(file)
+	Returns:
+	- int: Number of rows written.
+	"""
+	paths = sorted(
+		os.path.join(input_folder, filename)
+		for filename in os.listdir(input_folder)
+		if filename.endswith(".json")
+	)
+	if not paths:
+		raise FileNotFoundError(f"No JSON files in '{input_folder}'")
 
-	# Extract questions and answers using the optimized function
-	qa_pairs = process_qa_pairs(data)
+	tmp_path = output_path + ".tmp"
+	seen = set()
+	rows = duplicates = 0
+	batch = {name: [] for name in SCHEMA.names}
 
-	# Save to CSV
-	with open(csv_filename, 'w', newline='', encoding='utf-8') as csv_file:
-		csv_writer = csv.writer(csv_file)
-		csv_writer.writerow(['Question', 'Answer'])
-		csv_writer.writerows(qa_pairs)
+	def flush(writer: pq.ParquetWriter) -> None:
+		writer.write_table(pa.table(batch, schema=SCHEMA))
+		for column in batch.values():
+			column.clear()
 
-	print(f'CSV file "{csv_filename}" created successfully!')
+	with ProcessPoolExecutor(max_workers=workers) as pool, \
+			pq.ParquetWriter(tmp_path, SCHEMA, compression="zstd") as writer:
+		for path, pairs in zip(paths, pool.map(extract_qa_pairs, paths)):
+			for question, answer in pairs:
+				pair_id = row_id(question, answer)
+				if pair_id in seen:
+					duplicates += 1
+					continue
+				seen.add(pair_id)
 
-def merge_all_csv_files(input_folder, output_filename):
-	# Get a list of all CSV files in the input folder
-	csv_files = [f for f in os.listdir(input_folder) if f.endswith('.csv')]
+				batch["id"].append(pair_id)
+				batch["question"].append(question)
+				batch["answer"].append(answer)
+				batch["source"].append(os.path.basename(path))
+				rows += 1
+				if len(batch["id"]) == row_group_size:
+					flush(writer)
+			print(f"{os.path.basename(path)}: {len(pairs)} pairs")
 
-	# Ensure the output file does not exist yet
-	if os.path.exists(output_filename):
-		raise FileExistsError(f"The output file '{output_filename}' already exists. Please choose a different name.")
+		if batch["id"]:
+			flush(writer)
 
-	# Merge CSV files into a single DataFrame
-	dfs = [pd.read_csv(os.path.join(input_folder, csv_file)) for csv_file in csv_files]
-	merged_df = pd.concat(dfs, ignore_index=True)
+	os.replace(tmp_path, output_path)
+	print(f'Dataset "{output_path}" created: {rows} rows, {duplicates} duplicates dropped')
+	return rows
 
-	# Save the merged DataFrame to a new CSV file
-	merged_df.to_csv(output_filename, index=False, encoding='utf-8')
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Ingestion",
+	description="Convert the MASHQA JSON files into one deduplicated Parquet dataset",
+)
 
-	print(f'Merged CSV file "{output_filename}" created successfully!')
+parser.add_argument(
+	"input_folder",
+	nargs="?",
+	default=None,
+	help="Folder holding the MASHQA JSON files (default: the MASHQA_JSON_PATH environment variable)",
+)
 
-# Get the current working directory
-input_folder_path = os.getenv("DATASET_PATH")
+parser.add_argument("-o", "--output", type=str, default=DATASET_PATH, help="Destination Parquet file")
+parser.add_argument("-w", "--workers", type=int, default=None, help="Number of parsing processes (default: one per CPU)")
 
-# Function call with iteration over JSON files in the current working directory
-for filename in os.listdir(input_folder_path):
-	if filename.endswith('.json'):
-		json_filepath = os.path.join(input_folder_path, filename)
-		csv_filename = os.path.splitext(filename)[0] + '_output.csv'
-		csv_filepath = os.path.join(input_folder_path, csv_filename)
+if __name__ == "__main__":
+	load_dotenv()
+	args = parser.parse_args()
 
-		convert_json_to_csv(json_filepath, csv_filepath)
+	input_folder = args.input_folder or os.getenv("MASHQA_JSON_PATH")
+	if input_folder is None:
+		parser.error("input_folder is required when MASHQA_JSON_PATH is not set")
 
-output_merged_filename = 'mashqa_merged_output_all.csv'
-merge_all_csv_files(input_folder_path, output_merged_filename)
+	ingest(input_folder, args.output, args.workers)
@@ -1,5 +1,114 @@
+import argparse
+import os
+
+from utils.data_processing import DATASET_PATH
 from utils.retriever import create_embedding_function
-from retriever import create_or_load_vectorstore
+from utils.shards import SHARDS_PATH, load_shards
+from retriever import INDEX_PATH, QA_INDEX_PATH, create_or_load_vectorstore, build_vectorstore_streaming, build_qa_vectorstore
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Indexer",
+	description="Build or update the FAISS index of the MASHQA dataset",
+)
+
+parser.add_argument(
+	"-u", "--update",
+	action=argparse.BooleanOptionalAction,
+	help="Embed only new or changed chunks of an existing index and drop deleted ones",
+)
+
+parser.add_argument(
+	"-s", "--stream",
+	action=argparse.BooleanOptionalAction,
+	help="Stream the dataset in batches and embed them with a pool of worker processes",
+)
+
+parser.add_argument(
+	"-w", "--workers",
+	type=int,
+	default=1,
+	help="Number of embedding worker processes in stream mode",
+)
+
+parser.add_argument(
+	"-b", "--batch-size",
+	type=int,
+	default=256,
+	help="Number of dataset rows per batch in stream mode",
+)
+
+parser.add_argument(
+	"-d", "--device",
+	type=str,
+	default="cuda",
+	help="Device used to run the embedding model, e.g. cuda or cpu",
+)
+
+parser.add_argument(
+	"-c", "--embedding-cache",
+	type=str,
+	default=None,
+	help="SQLite file caching embeddings, reused across rebuilds and shared with the app",
+)
+
+parser.add_argument(
+	"-q", "--qa",
+	action=argparse.BooleanOptionalAction,
+	help=f"Build the question-keyed Q/A index in {QA_INDEX_PATH} (one vector per question) instead of the chunk index",
+)
+
+parser.add_argument(
+	"--answer-summaries",
+	action=argparse.BooleanOptionalAction,
+	default=None,
+	help="With --qa, also index a vector of each answer's leading sentences (default: keep what the index has)",
+)
+
+parser.add_argument(
+	"--shard",
+	type=str,
+	default=None,
+	help="Build the named shard of the shards file from its own dataset into its own index (default: the MASHQA index)",
+)
+
+parser.add_argument(
+	"--shards-file",
+	type=str,
+	default=os.getenv("SHARDS_PATH", SHARDS_PATH),
+	help="JSON file listing the shards, see `utils.shards.Shard`",
+)
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	if args.qa and args.stream:
+		parser.error("--qa does not support --stream")
+
+	dataset_path = DATASET_PATH
+	index_path = QA_INDEX_PATH if args.qa else INDEX_PATH
+	if args.shard:
+		shard = load_shards([args.shard], args.shards_file)[0]
+		dataset_path = shard.dataset_path
+		index_path = shard.path(args.qa)
+		print(f"Building shard '{shard.name}' from {dataset_path} into {index_path}")
 
-embedding_function = create_embedding_function(device="cuda")
-vectorstore = create_or_load_vectorstore(embedding_function)
+	embedding_function = create_embedding_function(device=args.device, cache_path=args.embedding_cache)
+	if args.qa:
+		vectorstore = build_qa_vectorstore(
+			embedding_function,
+			index_path=index_path,
+			batch_size=args.batch_size,
+			answer_summaries=args.answer_summaries,
+			dataset_path=dataset_path,
+		)
+	elif args.stream:
+		vectorstore = build_vectorstore_streaming(
+			embedding_function,
+			index_path=index_path,
+			batch_size=args.batch_size,
+			workers=args.workers,
+			device=args.device,
+			cache_path=args.embedding_cache,
+			dataset_path=dataset_path,
+		)
+	else:
+		vectorstore = create_or_load_vectorstore(embedding_function, index_path=index_path, update=args.update, dataset_path=dataset_path)
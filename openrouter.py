@@ -2,6 +2,8 @@ from langchain_openai import ChatOpenAI
 from typing import Optional
 import os
 
+from utils.http_clients import get_http_clients
+
 class ChatOpenRouter(ChatOpenAI):
 	openai_api_base: str
 	openai_api_key: str
@@ -15,6 +17,11 @@ class ChatOpenRouter(ChatOpenAI):
 		**kwargs
 	):
 
+		# Share one connection pool per provider across every instance
+		http_client, http_async_client = get_http_clients("openrouter")
+		kwargs.setdefault("http_client", http_client)
+		kwargs.setdefault("http_async_client", http_async_client)
+
 		openai_api_key = openai_api_key or os.getenv('OPENROUTER_API_KEY')
 		super().__init__(
 			openai_api_base=openai_api_base,
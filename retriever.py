@@ -1,7 +1,16 @@
 import os
 import pickle
+import shutil
+import time
+from collections import deque
+from operator import itemgetter
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Set, Tuple
 
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.tools import BaseTool
 from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
 from langchain_core.prompts.base import BasePromptTemplate
@@ -11,10 +20,24 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.tools.retriever import create_retriever_tool
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import Runnable, RunnableGenerator, RunnableLambda, RunnablePassthrough
 from langchain_community.vectorstores import FAISS
 
-from utils.data_processing import load_documents, split_documents
+from chain_history import SpeculationStats, create_speculative_retrieval_chain, create_standalone_question_chain
+from utils.answer_cache import AnswerCache
+from utils.data_processing import DATASET_PATH, load_documents, split_documents, iter_document_batches, iter_qa_batches, summarize_answer
+from utils.context_packing import pack_context
 from utils.debug import log_time
+from utils.history import count_text_tokens
+from utils.tracing import span
+from utils.disk_store import META_NAME, export_vectorstore, load_mmap_vectorstore
+from utils.embedding_pool import EmbeddingPool
+from utils.index_manifest import MANIFEST_NAME, document_id, load_manifest, save_manifest
+from utils.index_spec import IndexSpec, apply_search_params, build_ann_index
+
+INDEX_PATH = "faiss_index"
+QA_INDEX_PATH = "faiss_qa_index"
+CHECKPOINT_NAME = "checkpoint"
 
 @log_time
 def create_qa_chain(
@@ -51,6 +74,83 @@ def create_qa_chain(
 
 	return create_stuff_documents_chain(llm, qa_prompt)
 
+@log_time
+def create_rag_chain(
+	llm: ChatOpenAI,
+	retriever: BaseRetriever,
+	embeddings: Optional[Embeddings] = None,
+	answer_cache: Optional[AnswerCache] = None,
+	speculation_stats: Optional[SpeculationStats] = None,
+	speculation_threshold: float = 0.9,
+) -> Runnable:
+	"""
+	Create the history-aware retrieval QA chain, optionally behind a semantic answer cache.
+
+	The chain reformulates the question into a standalone one, retrieves the
+	context for it and answers with the QA chain. With an answer cache, the
+	standalone question embedding and the ids of the retrieved documents are
+	looked up first and the LLM is skipped on a hit; generated answers are
+	stored once fully streamed. The cache is shared by every session while
+	the answer prompt also sees the chat history, so only turns without
+	history are looked up or stored.
+
+	With `speculation_stats`, context is retrieved for the raw input while the
+	question is reformulated (see `create_speculative_retrieval_chain`).
+
+	Parameters:
+	- llm (ChatOpenAI): The language model used for reformulation and answers.
+	- retriever (BaseRetriever): The retriever instance used to fetch relevant context.
+	- embeddings (Optional[Embeddings]): Embedding function for the cache key and speculation, required with either.
+	- answer_cache (Optional[AnswerCache]): The semantic answer cache, None disables caching.
+	- speculation_stats (Optional[SpeculationStats]): Enables speculative retrieval and collects its counters.
+	- speculation_threshold (float): Minimum similarity of raw and standalone question to reuse speculative results.
+
+	Returns:
+	- Runnable: A chain mapping `input` and `chat_history` to `standalone_question`, `context` and `answer`.
+	"""
+	qa_chain = create_qa_chain(llm, retriever)
+
+	def answer(x: dict) -> Runnable:
+		# An answer shaped by one patient's earlier turns must not be served to another session
+		if answer_cache is None or x.get("chat_history"):
+			return qa_chain
+
+		question = x["standalone_question"]
+		question_vector = embeddings.embed_query(question)
+		doc_ids = frozenset(document_id(doc) for doc in x["context"])
+
+		cached = answer_cache.lookup(question_vector, doc_ids)
+		if cached is not None:
+			return RunnableLambda(lambda _: cached)
+
+		def store(chunks: Iterator[str]) -> Iterator[str]:
+			parts = []
+			for chunk in chunks:
+				parts.append(chunk)
+				yield chunk
+			answer_cache.store(question, question_vector, doc_ids, "".join(parts))
+
+		async def astore(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+			parts = []
+			async for chunk in chunks:
+				parts.append(chunk)
+				yield chunk
+			answer_cache.store(question, question_vector, doc_ids, "".join(parts))
+
+		return qa_chain | RunnableGenerator(store, astore)
+
+	if speculation_stats is not None:
+		context_chain = create_speculative_retrieval_chain(
+			llm, retriever, embeddings, speculation_threshold, speculation_stats,
+		)
+	else:
+		context_chain = (
+			RunnablePassthrough.assign(standalone_question=create_standalone_question_chain(llm))
+			.assign(context=itemgetter("standalone_question") | retriever)
+		)
+
+	return context_chain | RunnablePassthrough.assign(answer=RunnableLambda(answer))
+
 @log_time
 def create_qa_tool(retriever: BaseRetriever) -> BaseTool:
 	"""
@@ -124,30 +224,510 @@ def create_prompt_react_agent() -> BasePromptTemplate:
 	return ChatPromptTemplate.from_template(system_prompt)
 	
 
+def _recover_checkpoint(index_path: str) -> None:
+	"""
+	Finish moving a written checkpoint into place, after a crash while doing so.
+	"""
+	checkpoint_path = os.path.join(index_path, CHECKPOINT_NAME)
+	if not os.path.isdir(checkpoint_path):
+		return
+	# The manifest goes last, so it never marks a build complete before its index is in place
+	for name in ("index.faiss", "index.pkl", MANIFEST_NAME):
+		if os.path.exists(os.path.join(checkpoint_path, name)):
+			os.replace(os.path.join(checkpoint_path, name), os.path.join(index_path, name))
+	os.rmdir(checkpoint_path)
+
+def _save_checkpoint(vectorstore: FAISS, index_path: str, chunk_ids: Set[str], complete: bool) -> None:
+	"""
+	Write the index, docstore and manifest to a temporary folder and swap it in.
+
+	Renaming the finished folder to `checkpoint` is the commit point. A crash
+	before it leaves the previous checkpoint untouched, a crash after it is
+	completed by `_recover_checkpoint` on the next load, so the index and
+	docstore on disk always belong to the same checkpoint.
+	"""
+	tmp_path = os.path.join(index_path, CHECKPOINT_NAME + ".tmp")
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	vectorstore.save_local(tmp_path)
+	save_manifest(tmp_path, chunk_ids, complete)
+	os.replace(tmp_path, os.path.join(index_path, CHECKPOINT_NAME))
+	_recover_checkpoint(index_path)
+
+def _load_index(embedding_function: HuggingFaceEmbeddings, index_path: str) -> Optional[FAISS]:
+	"""
+	Load the flat index a build continues from, None when there is none yet.
+	"""
+	_recover_checkpoint(index_path)
+	if not os.path.exists(os.path.join(index_path, "index.faiss")):
+		return None
+	return FAISS.load_local(index_path, embedding_function, allow_dangerous_deserialization=True)
+
+@log_time
+def build_vectorstore(
+	embedding_function: HuggingFaceEmbeddings,
+	index_path: str = INDEX_PATH,
+	batch_size: int = 512,
+	checkpoint_every: int = 20,
+	dataset_path: str = DATASET_PATH,
+) -> FAISS:
+	"""
+	Build or incrementally update the FAISS vector store at the specified path.
+
+	Every chunk is identified by the hash of its content. Only chunks missing
+	from the index are embedded and chunks no longer in the dataset are
+	removed. The index is checkpointed every `checkpoint_every` batches, so an
+	interrupted build resumes from the last checkpoint.
+
+	Parameters:
+	- embedding_function (HuggingFaceEmbeddings): The embedding function to use with the FAISS index.
+	- index_path (str): FAISS index path.
+	- batch_size (int): Number of chunks embedded at once.
+	- checkpoint_every (int): Number of batches between two checkpoints.
+	- dataset_path (str): Dataset the chunks are read from.
+
+	Returns:
+	- FAISS: The up to date FAISS vector store instance.
+	"""
+	print("Loading Docs")
+	docs = load_documents(dataset_path)
+	print("Spliting Docs")
+	splits = split_documents(docs)
+	chunks = {document_id(doc): doc for doc in splits}
+
+	vectorstore = _load_index(embedding_function, index_path)
+	indexed = set(vectorstore.index_to_docstore_id.values()) if vectorstore is not None else set()
+	# Until the final checkpoint, a crash leaves an index that is resumed rather than served
+	save_manifest(index_path, indexed, complete=False)
+
+	removed = indexed - chunks.keys()
+	new_ids = [chunk_id for chunk_id in chunks if chunk_id not in indexed]
+	print(f"Building vectorstore: {len(new_ids)} new, {len(removed)} removed, {len(indexed) - len(removed)} unchanged")
+
+	if vectorstore is None and not new_ids:
+		raise ValueError("No documents to index")
+
+	if removed:
+		vectorstore.delete(list(removed))
+		indexed -= removed
+
+	for batch_number, start in enumerate(range(0, len(new_ids), batch_size), 1):
+		batch_ids = new_ids[start:start + batch_size]
+		batch = [chunks[chunk_id] for chunk_id in batch_ids]
+		if vectorstore is None:
+			vectorstore = FAISS.from_documents(batch, embedding_function, ids=batch_ids)
+		else:
+			vectorstore.add_documents(batch, ids=batch_ids)
+		indexed.update(batch_ids)
+		if batch_number % checkpoint_every == 0:
+			_save_checkpoint(vectorstore, index_path, indexed, complete=False)
+		print(f"Embedded {min(start + batch_size, len(new_ids))}/{len(new_ids)} chunks")
+
+	_save_checkpoint(vectorstore, index_path, indexed, complete=True)
+	return vectorstore
+
+@log_time
+def build_vectorstore_streaming(
+	embedding_function: HuggingFaceEmbeddings,
+	index_path: str = INDEX_PATH,
+	batch_size: int = 256,
+	workers: int = 1,
+	model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+	device: str = "cpu",
+	checkpoint_every: int = 20,
+	cache_path: Optional[str] = None,
+	dataset_path: str = DATASET_PATH,
+) -> FAISS:
+	"""
+	Build or update the FAISS vector store by streaming the dataset in batches.
+
+	Rows are read and split one batch at a time, embedded by a pool of worker
+	processes and added to the index as each batch comes back. At most two
+	batches per worker are in flight, so memory of the pipeline does not grow
+	with the corpus. Chunk ids, resuming and removal of deleted chunks work
+	the same as in `build_vectorstore`.
+
+	Parameters:
+	- embedding_function (HuggingFaceEmbeddings): The embedding function attached to the FAISS index for queries.
+	- index_path (str): FAISS index path.
+	- batch_size (int): Number of dataset rows per batch.
+	- workers (int): Number of embedding worker processes.
+	- model_name (str): Model name for embedding in the workers.
+	- device (str): device type for the workers' model.
+	- checkpoint_every (int): Number of batches between two checkpoints.
+	- cache_path (Optional[str]): SQLite embedding cache shared by the workers.
+	- dataset_path (str): Dataset the chunks are read from.
+
+	Returns:
+	- FAISS: The up to date FAISS vector store instance.
+	"""
+	vectorstore = _load_index(embedding_function, index_path)
+	indexed = set(vectorstore.index_to_docstore_id.values()) if vectorstore is not None else set()
+	# Until the final checkpoint, a crash leaves an index that is resumed rather than served
+	save_manifest(index_path, indexed, complete=False)
+
+	seen = set()
+	pending = deque()
+	added = 0
+	batches = 0
+	start_time = time.perf_counter()
+
+	def add_batch(ids: List[str], docs: List[Document], result: Any) -> None:
+		nonlocal vectorstore, added, batches
+		text_embeddings = list(zip([doc.page_content for doc in docs], result.get()))
+		metadatas = [doc.metadata for doc in docs]
+		if vectorstore is None:
+			vectorstore = FAISS.from_embeddings(text_embeddings, embedding_function, metadatas=metadatas, ids=ids)
+		else:
+			vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+		indexed.update(ids)
+
+		added += len(ids)
+		batches += 1
+		if batches % checkpoint_every == 0:
+			_save_checkpoint(vectorstore, index_path, indexed, complete=False)
+		elapsed = time.perf_counter() - start_time
+		print(f"Embedded {added} new chunks, {len(seen)} seen, {added / elapsed:.1f} docs/sec")
+
+	with EmbeddingPool(workers, model_name, device, cache_path=cache_path) as pool:
+		for rows in iter_document_batches(batch_size, dataset_path):
+			ids, docs = [], []
+			for doc in split_documents(rows):
+				chunk_id = document_id(doc)
+				if chunk_id in seen:
+					continue
+				seen.add(chunk_id)
+				if chunk_id not in indexed:
+					ids.append(chunk_id)
+					docs.append(doc)
+
+			if ids:
+				pending.append((ids, docs, pool.submit([doc.page_content for doc in docs])))
+			while len(pending) >= 2 * pool.workers:
+				add_batch(*pending.popleft())
+
+		while pending:
+			add_batch(*pending.popleft())
+
+	if vectorstore is None:
+		raise ValueError("No documents to index")
+
+	removed = indexed - seen
+	if removed:
+		vectorstore.delete(list(removed))
+		indexed -= removed
+	print(f"Building vectorstore: {added} new, {len(removed)} removed, {len(indexed) - added} unchanged")
+
+	_save_checkpoint(vectorstore, index_path, indexed, complete=True)
+	return vectorstore
+
+@log_time
+def build_qa_vectorstore(
+	embedding_function: HuggingFaceEmbeddings,
+	index_path: str = QA_INDEX_PATH,
+	batch_size: int = 512,
+	answer_summaries: Optional[bool] = None,
+	checkpoint_every: int = 20,
+	dataset_path: str = DATASET_PATH,
+) -> FAISS:
+	"""
+	Build or incrementally update a question-keyed vector store of the Q/A pairs.
+
+	Instead of splitting rows into overlapping chunks, every pair gets one
+	vector for its question and, with `answer_summaries`, one for the lead
+	of its answer. The stored document is always the whole pair, so every
+	hit is a complete question and answer. Pairs keep the content hash used
+	by chunk indexes, with a suffix per vector kind. Resuming and removal of
+	deleted pairs work the same as in `build_vectorstore`.
+
+	Parameters:
+	- embedding_function (HuggingFaceEmbeddings): The embedding function to use with the FAISS index.
+	- index_path (str): FAISS index path.
+	- batch_size (int): Number of dataset rows embedded at once.
+	- answer_summaries (Optional[bool]): Also index a vector of each answer's summary,
+	  when None keep doing what the existing index does (off for a new one).
+	- checkpoint_every (int): Number of batches between two checkpoints.
+	- dataset_path (str): Dataset the pairs are read from.
+
+	Returns:
+	- FAISS: The up to date FAISS vector store instance.
+	"""
+	vectorstore = _load_index(embedding_function, index_path)
+	indexed = set(vectorstore.index_to_docstore_id.values()) if vectorstore is not None else set()
+	# Until the final checkpoint, a crash leaves an index that is resumed rather than served
+	save_manifest(index_path, indexed, complete=False)
+
+	if answer_summaries is None:
+		answer_summaries = any(vector_id.endswith(":s") for vector_id in indexed)
+
+	seen = set()
+	added = 0
+	batches = 0
+	for rows in iter_qa_batches(batch_size, dataset_path):
+		ids, texts, docs = [], [], []
+		for row_id, question, answer in rows:
+			question, answer = question.strip(), answer.strip()
+			if not question:
+				continue
+			doc = Document(page_content=f"Q: {question}\nA: {answer}", metadata={"source": dataset_path, "id": row_id})
+			pair_id = document_id(doc)
+			doc.metadata["pair"] = pair_id
+
+			keys = [(f"{pair_id}:q", question)]
+			if answer_summaries and (summary := summarize_answer(answer)):
+				keys.append((f"{pair_id}:s", summary))
+			for vector_id, text in keys:
+				if vector_id in seen:
+					continue
+				seen.add(vector_id)
+				if vector_id not in indexed:
+					ids.append(vector_id)
+					texts.append(text)
+					docs.append(doc)
+
+		if not ids:
+			continue
+
+		# The vector is the question (or summary), the payload the whole pair
+		text_embeddings = list(zip([doc.page_content for doc in docs], embedding_function.embed_documents(texts)))
+		metadatas = [doc.metadata for doc in docs]
+		if vectorstore is None:
+			vectorstore = FAISS.from_embeddings(text_embeddings, embedding_function, metadatas=metadatas, ids=ids)
+		else:
+			vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+		indexed.update(ids)
+		added += len(ids)
+		batches += 1
+		if batches % checkpoint_every == 0:
+			_save_checkpoint(vectorstore, index_path, indexed, complete=False)
+		print(f"Embedded {added} new vectors, {len(seen)} seen")
+
+	if vectorstore is None:
+		raise ValueError("No documents to index")
+
+	removed = indexed - seen
+	if removed:
+		vectorstore.delete(list(removed))
+		indexed -= removed
+	print(f"Building Q/A vectorstore: {added} new, {len(removed)} removed, {len(indexed) - added} unchanged")
+
+	_save_checkpoint(vectorstore, index_path, indexed, complete=True)
+	return vectorstore
+
+def unique_pairs(items: List[Any], key: Callable[[Any], Document]) -> List[Any]:
+	"""
+	Keep the first item of each Q/A pair of a question-keyed index.
+
+	Parameters:
+	- items (List[Any]): Search results, best first.
+	- key (Callable[[Any], Document]): Returns the document of an item.
+
+	Returns:
+	- List[Any]: The items whose pair was not seen before, in order.
+	"""
+	pairs = set()
+	unique = []
+	for item in items:
+		doc = key(item)
+		pair = doc.metadata.get("pair", doc.page_content)
+		if pair not in pairs:
+			pairs.add(pair)
+			unique.append(item)
+	return unique
+
+class QAPairRetriever(VectorStoreRetriever):
+	"""
+	Retriever over a question-keyed index returning each Q/A pair at most once.
+
+	A pair matched by both its question and its answer summary would take
+	two of the k slots, so twice k vectors are searched and repeats dropped.
+	"""
+
+	def _unique(self, docs: List[Document]) -> List[Document]:
+		return unique_pairs(docs, key=lambda doc: doc)[:self.search_kwargs.get("k", 4)]
+
+	def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+		search_kwargs = {**self.search_kwargs, "k": 2 * self.search_kwargs.get("k", 4)}
+		return self._unique(self.vectorstore.similarity_search(query, **search_kwargs))
+
+	async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+		search_kwargs = {**self.search_kwargs, "k": 2 * self.search_kwargs.get("k", 4)}
+		return self._unique(await self.vectorstore.asimilarity_search(query, **search_kwargs))
+
+class PackedRetriever(VectorStoreRetriever):
+	"""
+	Retriever fetching `fetch_k` candidates and packing the best of them into
+	a token budget with `pack_context`: adaptive k by score gap, duplicate and
+	overlap removal and MMR-style diversity.
+
+	With `qa_pairs`, over a question-keyed index, candidates are first
+	deduplicated by Q/A pair like `QAPairRetriever` does, searching twice
+	`fetch_k` vectors so a pair matched twice does not cost a candidate.
+	"""
+
+	fetch_k: int = 20
+	max_tokens: int = 1000
+	lambda_mult: float = 0.7
+	max_score_gap: Optional[float] = 0.25
+	max_docs: int = 4
+	qa_pairs: bool = False
+
+	@property
+	def _search_k(self) -> int:
+		return 2 * self.fetch_k if self.qa_pairs else self.fetch_k
+
+	def _pack(self, candidates: List[Tuple[Document, float]]) -> List[Document]:
+		if self.qa_pairs:
+			candidates = unique_pairs(candidates, key=itemgetter(0))[:self.fetch_k]
+		with span("context_packing", candidates=len(candidates)) as attrs:
+			docs = pack_context(
+				candidates,
+				count_text_tokens,
+				max_tokens=self.max_tokens,
+				lambda_mult=self.lambda_mult,
+				max_score_gap=self.max_score_gap,
+				max_docs=self.max_docs,
+			)
+			if attrs is not None:
+				attrs["docs"] = len(docs)
+		return docs
+
+	def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+		return self._pack(self.vectorstore.similarity_search_with_score(query, k=self._search_k))
+
+	async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+		return self._pack(await self.vectorstore.asimilarity_search_with_score(query, k=self._search_k))
+
+def _is_fresh(path: str, index_path: str, name: str = "index.faiss") -> bool:
+	"""
+	Whether an index derived from the flat index at `index_path` is newer than it,
+	judged by the file `name` of the derived index.
+	"""
+	derived = os.path.join(path, name)
+	base = os.path.join(index_path, "index.faiss")
+	return os.path.exists(derived) and os.path.getmtime(derived) >= os.path.getmtime(base)
+
+@log_time
+def load_or_build_ann_index(
+	embedding_function: HuggingFaceEmbeddings,
+	index_spec: IndexSpec,
+	index_path: str = INDEX_PATH,
+	base: Optional[FAISS] = None,
+) -> FAISS:
+	"""
+	Load the index of the given type derived from the flat index, building it
+	again when it is missing or older than the flat index.
+
+	Derived indexes live in `<index_path>/ann/<spec slug>`, the flat index
+	stays the source of truth for incremental updates.
+
+	Parameters:
+	- embedding_function (HuggingFaceEmbeddings): The embedding function to use with the FAISS index.
+	- index_spec (IndexSpec): Type and search parameters of the index.
+	- index_path (str): Flat FAISS index path.
+	- base (Optional[FAISS]): The flat vector store when it is already loaded.
+
+	Returns:
+	- FAISS: The FAISS vector store over the derived index.
+	"""
+	ann_path = os.path.join(index_path, "ann", index_spec.slug)
+
+	if _is_fresh(ann_path, index_path):
+		vectorstore = FAISS.load_local(ann_path, embedding_function, allow_dangerous_deserialization=True)
+		apply_search_params(vectorstore.index, index_spec)
+		return vectorstore
+
+	if base is None:
+		base = FAISS.load_local(index_path, embedding_function, allow_dangerous_deserialization=True)
+	print(f"Building {index_spec.factory} index")
+	vectorstore = build_ann_index(base, index_spec)
+	vectorstore.save_local(ann_path)
+	return vectorstore
+
+@log_time
+def load_or_export_mmap(
+	embedding_function: HuggingFaceEmbeddings,
+	path: str,
+	index_path: str,
+	load: Callable[[], FAISS],
+) -> FAISS:
+	"""
+	Load the memory-mapped export of a vector store, exporting it first when
+	it is missing or older than the flat index.
+
+	Parameters:
+	- embedding_function (HuggingFaceEmbeddings): The embedding function to use with the FAISS index.
+	- path (str): Folder of the export.
+	- index_path (str): Flat FAISS index path, the source of truth.
+	- load (Callable[[], FAISS]): Loads the vector store to export.
+
+	Returns:
+	- FAISS: A read-only vector store over the memory-mapped index.
+	"""
+	# Exports of earlier versions have no META_NAME file and are written again
+	if not _is_fresh(path, index_path, META_NAME):
+		print(f"Exporting {path}")
+		export_vectorstore(load(), path)
+	return load_mmap_vectorstore(path, embedding_function)
+
 @log_time
 def create_or_load_vectorstore(
 	embedding_function: HuggingFaceEmbeddings,
-	index_path: str = 'faiss_index'
+	index_path: str = INDEX_PATH,
+	update: bool = False,
+	index_spec: Optional[IndexSpec] = None,
+	mmap: bool = False,
+	qa: bool = False,
+	dataset_path: str = DATASET_PATH,
 ) -> FAISS:
 	"""
 	Create a new FAISS vector store or load an existing one from the specified path.
 
+	An existing index is loaded as is, unless `update` is set or its manifest
+	shows an unfinished build, in which case it is brought up to date with
+	`build_vectorstore`. With a non flat `index_spec` the store is served
+	from an index of that type derived from the flat one.
+
+	With `mmap`, the store is served from an export with a memory-mapped
+	index and a SQLite docstore (see `utils.disk_store`). Loading it does not
+	unpickle anything and its cost does not grow with the corpus, the pickled
+	store is only read when the export has to be refreshed.
+
 	Parameters:
 	- embedding_function (HuggingFaceEmbeddings): The embedding function to use with the FAISS index.
 	- index_path (str): FAISS index path.
+	- update (bool): Re-read the dataset and embed only new or changed chunks.
+	- index_spec (Optional[IndexSpec]): Type of index to search, flat when None.
+	- mmap (bool): Serve a read-only memory-mapped export of the index.
+	- qa (bool): Build a question-keyed index with `build_qa_vectorstore` when one is needed.
+	- dataset_path (str): Dataset the index is built from when one is needed.
 
 	Returns:
 	- FAISS: The FAISS vector store instance.
 	"""
+	_recover_checkpoint(index_path)
+	manifest = load_manifest(index_path)
+	resume = manifest is not None and not manifest["complete"]
 
-	if os.path.exists(index_path):
-		vectorstore = FAISS.load_local(index_path, embedding_function, allow_dangerous_deserialization=True)
-	else:
-		print("Loading Docs")
-		docs = load_documents()
-		print("Spliting Docs")
-		splits = split_documents(docs)
-		print("Building vectorstore")
-		vectorstore = FAISS.from_documents(splits, embedding_function)
-		vectorstore.save_local(index_path)
-	return vectorstore
+	vectorstore = None
+	if not os.path.exists(index_path) or update or resume:
+		if qa:
+			vectorstore = build_qa_vectorstore(embedding_function, index_path, dataset_path=dataset_path)
+		else:
+			vectorstore = build_vectorstore(embedding_function, index_path, dataset_path=dataset_path)
+
+	def load() -> FAISS:
+		if index_spec is not None and not index_spec.is_flat:
+			return load_or_build_ann_index(embedding_function, index_spec, index_path, vectorstore)
+		if vectorstore is not None:
+			return vectorstore
+		return FAISS.load_local(index_path, embedding_function, allow_dangerous_deserialization=True)
+
+	if not mmap:
+		return load()
+
+	if index_spec is not None and not index_spec.is_flat:
+		mmap_path = os.path.join(index_path, "ann", index_spec.slug, "mmap")
+		vectorstore = load_or_export_mmap(embedding_function, mmap_path, index_path, load)
+		apply_search_params(vectorstore.index, index_spec)
+		return vectorstore
+	return load_or_export_mmap(embedding_function, os.path.join(index_path, "mmap"), index_path, load)
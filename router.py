@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import Field
+
+from utils.async_runtime import iterate, run
+
+# Inner backend calls must not report to the router's callbacks, a hedged
+# loser would otherwise stream its tokens to the caller as well
+_QUIET = {"callbacks": []}
+
+class LatencyTracker:
+	"""
+	Rolling latency and error statistics of the backends of a router.
+
+	Latencies are kept per backend and kind ("ttft" for streams, "total"
+	for whole responses) over the last `window` requests.
+	"""
+
+	def __init__(self, window: int = 100):
+		self.window = window
+		self.lock = threading.Lock()
+		self.latencies: Dict[Tuple[str, str], deque] = {}
+		self.outcomes: Dict[str, deque] = {}
+		self.counters: Dict[str, Counter] = {}
+		self.decisions: deque = deque(maxlen=window)
+
+	def _outcomes(self, name: str) -> deque:
+		return self.outcomes.setdefault(name, deque(maxlen=self.window))
+
+	def record(self, name: str, kind: str, latency: Optional[float], ok: bool) -> None:
+		with self.lock:
+			self._outcomes(name).append(ok)
+			self.counters.setdefault(name, Counter())["requests"] += 1
+			if ok:
+				self.latencies.setdefault((name, kind), deque(maxlen=self.window)).append(latency)
+			else:
+				self.counters[name]["errors"] += 1
+
+	def count(self, name: str, event: str) -> None:
+		with self.lock:
+			self.counters.setdefault(name, Counter())[event] += 1
+
+	def decide(self, decision: Dict[str, Any]) -> None:
+		with self.lock:
+			self.decisions.append(decision)
+
+	def percentile(self, name: str, kind: str, q: float) -> Optional[float]:
+		with self.lock:
+			samples = self.latencies.get((name, kind))
+			if not samples:
+				return None
+			return float(np.percentile(samples, q))
+
+	def error_rate(self, name: str) -> float:
+		with self.lock:
+			outcomes = self.outcomes.get(name)
+			if not outcomes:
+				return 0.0
+			return 1 - sum(outcomes) / len(outcomes)
+
+	def rank(self, names: List[str], kind: str) -> List[str]:
+		"""
+		Order backends by expected latency, discounted by their success rate.
+		Backends without samples come first so every backend gets measured.
+		"""
+		def score(name: str) -> float:
+			p50 = self.percentile(name, kind, 50)
+			if p50 is None:
+				return -1.0
+			return p50 / max(1e-3, 1 - self.error_rate(name))
+
+		return sorted(names, key=score)
+
+	def stats(self) -> Dict[str, Any]:
+		"""
+		Return per backend counters and latency percentiles, plus the recent routing decisions.
+
+		Returns:
+		- Dict[str, Any]: The statistics, latencies in seconds.
+		"""
+		backends = {}
+		for name in list(self.counters):
+			backends[name] = {
+				**self.counters[name],
+				"error_rate": self.error_rate(name),
+				**{
+					f"{kind}_p{q}": self.percentile(name, kind, q)
+					for kind in ("ttft", "total")
+					for q in (50, 95, 99)
+				},
+			}
+		with self.lock:
+			decisions = list(self.decisions)
+		return {"backends": backends, "decisions": decisions}
+
+class ChatRouter(BaseChatModel):
+	"""
+	Chat model routing each request to the fastest healthy backend, with hedging.
+
+	When the chosen backend has not answered (or, when streaming, not sent a
+	first token) by the `hedge_percentile` of its recent latencies, the same
+	request is sent to the next backend. The first response wins and the
+	other request is cancelled. A failing backend falls over to the next one
+	immediately.
+	"""
+
+	backends: Dict[str, BaseChatModel]
+	hedge_percentile: float = 95
+	min_hedge_delay: float = 0.25
+	default_hedge_delay: float = 3.0
+	tracker: LatencyTracker = Field(default_factory=LatencyTracker)
+
+	class Config:
+		arbitrary_types_allowed = True
+
+	@property
+	def _llm_type(self) -> str:
+		return "router"
+
+	def _hedge_delay(self, name: str, kind: str) -> float:
+		delay = self.tracker.percentile(name, kind, self.hedge_percentile)
+		if delay is None:
+			return self.default_hedge_delay
+		return max(self.min_hedge_delay, delay)
+
+	async def _race(
+		self,
+		kind: str,
+		start: Callable[[str], Awaitable[Any]],
+		discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+	) -> Tuple[str, Any]:
+		remaining = self.tracker.rank(list(self.backends), kind)
+		primary = remaining[0]
+		tasks: Dict[asyncio.Task, str] = {}
+		errors = []
+		started = time.perf_counter()
+		# A hedge races a slow backend, a failover replaces a failed one
+		hedged = False
+		failed_over = False
+
+		async def timed(name: str) -> Tuple[float, Any]:
+			begin = time.perf_counter()
+			result = await start(name)
+			return time.perf_counter() - begin, result
+
+		def launch(hedge: bool) -> None:
+			nonlocal hedged
+			name = remaining.pop(0)
+			if hedge:
+				hedged = True
+				self.tracker.count(name, "hedges")
+			tasks[asyncio.ensure_future(timed(name))] = name
+
+		launch(hedge=False)
+		while tasks:
+			timeout = self._hedge_delay(primary, kind) if remaining else None
+			done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+			if not done:
+				launch(hedge=True)
+				continue
+
+			winner = None
+			for task in done:
+				name = tasks.pop(task)
+				try:
+					latency, result = task.result()
+				except Exception as e:
+					self.tracker.record(name, kind, None, ok=False)
+					errors.append(e)
+					continue
+
+				self.tracker.record(name, kind, latency, ok=True)
+				if winner is None:
+					winner = (name, result)
+				elif discard is not None:
+					await discard(result)
+
+			if winner is not None:
+				for task, name in tasks.items():
+					task.cancel()
+					self.tracker.count(name, "cancelled")
+				self.tracker.count(winner[0], "wins")
+				self.tracker.decide({
+					"kind": kind,
+					"primary": primary,
+					"winner": winner[0],
+					"hedged": hedged,
+					"failed_over": failed_over,
+					"latency": time.perf_counter() - started,
+				})
+				return winner
+
+			if remaining and not tasks:
+				failed_over = True
+				launch(hedge=False)
+
+		raise errors[-1]
+
+	async def _agenerate(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> ChatResult:
+		async def start(name: str) -> BaseMessage:
+			return await self.backends[name].ainvoke(messages, config=_QUIET, stop=stop, **kwargs)
+
+		_, message = await self._race("total", start)
+		return ChatResult(generations=[ChatGeneration(message=message)])
+
+	def _generate(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> ChatResult:
+		return run(self._agenerate(messages, stop, **kwargs))
+
+	async def _astream(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> AsyncIterator[ChatGenerationChunk]:
+		async def start(name: str) -> Tuple[AsyncIterator, Any]:
+			stream = self.backends[name].astream(messages, config=_QUIET, stop=stop, **kwargs)
+			try:
+				first = await stream.__anext__()
+			except BaseException:
+				await stream.aclose()
+				raise
+			return stream, first
+
+		async def discard(result: Tuple[AsyncIterator, Any]) -> None:
+			await result[0].aclose()
+
+		_, (stream, first) = await self._race("ttft", start, discard)
+		try:
+			chunk = first
+			while True:
+				generation = ChatGenerationChunk(message=chunk)
+				if run_manager:
+					await run_manager.on_llm_new_token(generation.text, chunk=generation)
+				yield generation
+				try:
+					chunk = await stream.__anext__()
+				except StopAsyncIteration:
+					break
+		finally:
+			await stream.aclose()
+
+	def _stream(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> Iterator[ChatGenerationChunk]:
+		for generation in iterate(self._astream(messages, stop, **kwargs)):
+			if run_manager:
+				run_manager.on_llm_new_token(generation.text, chunk=generation)
+			yield generation
@@ -1,11 +1,153 @@
 from langchain_openai import ChatOpenAI
-from typing import Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import httpx
 import os
+import threading
+import time
+
+from utils.http_clients import get_http_clients
+
+class ColdStartMonitor:
+	"""
+	Track whether a Runpod serverless endpoint is likely warm and record its cold starts.
+
+	The endpoint's idle clock runs from the start of its last answered request,
+	user request or keep-warm ping, as Runpod's does, and the endpoint is not
+	considered idle while a request is in flight. Once it idled for
+	`idle_timeout` seconds, the time after which Runpod scales the worker down,
+	the endpoint is considered cold. Any request whose first token took longer
+	than `cold_start_threshold` seconds is counted as a cold start, whether or
+	not it was expected.
+	"""
+
+	def __init__(self, idle_timeout: float = 5.0, cold_start_threshold: float = 5.0):
+		self.idle_timeout = idle_timeout
+		self.cold_start_threshold = cold_start_threshold
+		self.lock = threading.Lock()
+		self.last_activity: Optional[float] = None
+		self.last_request: Optional[float] = None
+		self.in_flight = 0
+		self.cold_start_seconds: List[float] = []
+		self.user_cold_starts = 0
+		self.keep_warm_pings = 0
+
+	def _is_cold(self, now: float) -> bool:
+		return self.last_activity is None or now - self.last_activity > self.idle_timeout
+
+	def is_cold(self) -> bool:
+		with self.lock:
+			return self._is_cold(time.monotonic())
+
+	def begin(self, user: bool = True) -> Tuple[bool, float]:
+		"""
+		Mark the start of a request, `finish` must be called once it is over.
+
+		Parameters:
+		- user (bool): False for keep-warm pings, which do not extend the keep-warm window.
+
+		Returns:
+		- Tuple[bool, float]: Whether the endpoint is expected to be cold, and the start time.
+		"""
+		now = time.monotonic()
+		with self.lock:
+			# A request queued behind one still starting the worker waits for it as well
+			cold = self._is_cold(now)
+			self.in_flight += 1
+			if user:
+				self.last_request = now
+		return cold, now
+
+	def end(self, started: float, ok: bool, user: bool = True) -> None:
+		"""
+		Mark the first token or the failure of a request.
+
+		Parameters:
+		- started (float): Start time returned by `begin`.
+		- ok (bool): Whether the endpoint answered.
+		- user (bool): Value passed to `begin`.
+		"""
+		now = time.monotonic()
+		with self.lock:
+			if not ok:
+				return
+			self.last_activity = max(self.last_activity or started, started)
+			if now - started > self.cold_start_threshold:
+				self.cold_start_seconds.append(now - started)
+				if user:
+					self.user_cold_starts += 1
+
+	def finish(self) -> None:
+		"""
+		Mark the end of a request started with `begin`.
+		"""
+		with self.lock:
+			self.in_flight -= 1
+
+	def stats(self) -> Dict[str, Any]:
+		"""
+		Return the cold start metrics.
+
+		Returns:
+		- Dict[str, Any]: Cold start count (pings included) and count of user requests, total and max
+			duration in seconds, keep-warm pings and current state.
+		"""
+		with self.lock:
+			durations = list(self.cold_start_seconds)
+			user_cold_starts = self.user_cold_starts
+			pings = self.keep_warm_pings
+		return {
+			"cold": self.is_cold(),
+			"cold_starts": len(durations),
+			"user_cold_starts": user_cold_starts,
+			"cold_start_seconds_total": sum(durations),
+			"cold_start_seconds_max": max(durations, default=0.0),
+			"keep_warm_pings": pings,
+		}
+
+_monitors: Dict[str, ColdStartMonitor] = {}
+_monitors_lock = threading.Lock()
+
+def get_cold_start_monitor(openai_api_base: str) -> ColdStartMonitor:
+	"""
+	Return the monitor of an endpoint, shared by every client of that endpoint.
+
+	The idle timeout and cold start threshold are read from RUNPOD_IDLE_TIMEOUT
+	and RUNPOD_COLD_START_THRESHOLD (seconds, both default 5).
+
+	Parameters:
+	- openai_api_base (str): Base URL of the endpoint.
+
+	Returns:
+	- ColdStartMonitor: The endpoint monitor.
+	"""
+	with _monitors_lock:
+		if openai_api_base not in _monitors:
+			_monitors[openai_api_base] = ColdStartMonitor(
+				idle_timeout=float(os.getenv("RUNPOD_IDLE_TIMEOUT", 5)),
+				cold_start_threshold=float(os.getenv("RUNPOD_COLD_START_THRESHOLD", 5)),
+			)
+		return _monitors[openai_api_base]
 
 class ChatRunpod(ChatOpenAI):
+	"""
+	ChatOpenAI client of a Runpod serverless endpoint.
+
+	Requests sent while the endpoint is expected to be cold get the longer
+	`cold_*` timeouts, so a worker that is starting up is not cut off by the
+	budget of a warm request. Cold starts are recorded in the endpoint's
+	`ColdStartMonitor`.
+	"""
+
 	openai_api_base: str
 	openai_api_key: str
 	model_name: str
+	warm_connect_timeout: float = 10.0
+	warm_read_timeout: float = 60.0
+	cold_connect_timeout: float = 60.0
+	cold_read_timeout: float = 300.0
 
 	def __init__(
 		self,
@@ -15,6 +157,11 @@ class ChatRunpod(ChatOpenAI):
 		**kwargs
 	):
 
+		# Share one connection pool per provider across every instance
+		http_client, http_async_client = get_http_clients("runpod")
+		kwargs.setdefault("http_client", http_client)
+		kwargs.setdefault("http_async_client", http_async_client)
+
 		openai_api_key = openai_api_key or os.getenv('RUNPOD_API_KEY')
 		super().__init__(
 			openai_api_base=openai_api_base,
@@ -22,3 +169,184 @@ class ChatRunpod(ChatOpenAI):
 			model_name=model_name,
 			**kwargs,
 		)
+
+	@property
+	def monitor(self) -> ColdStartMonitor:
+		return get_cold_start_monitor(self.openai_api_base)
+
+	def _timeout(self, cold: bool) -> httpx.Timeout:
+		if cold:
+			return httpx.Timeout(self.cold_read_timeout, connect=self.cold_connect_timeout)
+		return httpx.Timeout(self.warm_read_timeout, connect=self.warm_connect_timeout)
+
+	def _generate(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> ChatResult:
+		cold, started = self.monitor.begin()
+		kwargs.setdefault("timeout", self._timeout(cold))
+		try:
+			result = super()._generate(messages, stop, run_manager, **kwargs)
+		except Exception:
+			self.monitor.end(started, ok=False)
+			raise
+		finally:
+			self.monitor.finish()
+		self.monitor.end(started, ok=True)
+		return result
+
+	async def _agenerate(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> ChatResult:
+		cold, started = self.monitor.begin()
+		kwargs.setdefault("timeout", self._timeout(cold))
+		try:
+			result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+		except Exception:
+			self.monitor.end(started, ok=False)
+			raise
+		finally:
+			self.monitor.finish()
+		self.monitor.end(started, ok=True)
+		return result
+
+	def _stream(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[CallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> Iterator[ChatGenerationChunk]:
+		cold, started = self.monitor.begin()
+		kwargs.setdefault("timeout", self._timeout(cold))
+		first = True
+		try:
+			for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+				if first:
+					self.monitor.end(started, ok=True)
+					first = False
+				yield chunk
+		except Exception:
+			if first:
+				self.monitor.end(started, ok=False)
+			raise
+		finally:
+			self.monitor.finish()
+
+	async def _astream(
+		self,
+		messages: List[BaseMessage],
+		stop: Optional[List[str]] = None,
+		run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+		**kwargs: Any,
+	) -> AsyncIterator[ChatGenerationChunk]:
+		cold, started = self.monitor.begin()
+		kwargs.setdefault("timeout", self._timeout(cold))
+		first = True
+		try:
+			async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+				if first:
+					self.monitor.end(started, ok=True)
+					first = False
+				yield chunk
+		except Exception:
+			if first:
+				self.monitor.end(started, ok=False)
+			raise
+		finally:
+			self.monitor.finish()
+
+	def ping(self) -> None:
+		"""
+		Send the smallest possible completion to keep or bring the worker up.
+		"""
+		cold, started = self.monitor.begin(user=False)
+		try:
+			self.client.create(
+				model=self.model_name,
+				messages=[{"role": "user", "content": "ping"}],
+				max_tokens=1,
+				timeout=self._timeout(cold),
+			)
+		except Exception:
+			self.monitor.end(started, ok=False, user=False)
+			raise
+		finally:
+			self.monitor.finish()
+		self.monitor.end(started, ok=True, user=False)
+		with self.monitor.lock:
+			self.monitor.keep_warm_pings += 1
+
+class KeepWarm:
+	"""
+	Background scheduler pinging a Runpod endpoint so its worker does not scale down.
+
+	Pings are only sent during the `window` seconds following the last user
+	request, so an unused app lets the endpoint scale to zero, and never while
+	a request is in flight. A ping is due once the endpoint has been idle for
+	`interval` seconds. It is checked every poll period, so `interval` plus
+	that period must stay below the endpoint's idle timeout.
+	"""
+
+	def __init__(self, llm: ChatRunpod, interval: float, window: float):
+		self.llm = llm
+		self.interval = interval
+		self.window = window
+		self.poll = min(1.0, interval / 4)
+		if interval + self.poll >= llm.monitor.idle_timeout:
+			raise ValueError(
+				f"keep-warm interval {interval}s plus poll period {self.poll}s must be below "
+				f"the idle timeout {llm.monitor.idle_timeout}s"
+			)
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self._run, name="runpod-keep-warm", daemon=True)
+
+	def start(self) -> "KeepWarm":
+		self.thread.start()
+		return self
+
+	def stop(self) -> None:
+		self.stopped.set()
+
+	def _due(self) -> bool:
+		monitor = self.llm.monitor
+		now = time.monotonic()
+		with monitor.lock:
+			if monitor.in_flight or monitor.last_request is None or now - monitor.last_request > self.window:
+				return False
+			return monitor.last_activity is None or now - monitor.last_activity >= self.interval
+
+	def _run(self) -> None:
+		while not self.stopped.wait(self.poll):
+			if not self._due():
+				continue
+			try:
+				self.llm.ping()
+			except Exception as e:
+				if os.getenv("DEBUG") != None:
+					print(f"keep-warm ping failed: {e}")
+
+def start_keep_warm(llm: ChatRunpod) -> Optional[KeepWarm]:
+	"""
+	Start a keep-warm scheduler for the endpoint if RUNPOD_KEEP_WARM_INTERVAL is set.
+
+	RUNPOD_KEEP_WARM_WINDOW (seconds, default 900) bounds how long after the
+	last user request pings keep being sent.
+
+	Parameters:
+	- llm (ChatRunpod): Client of the endpoint to keep warm.
+
+	Returns:
+	- Optional[KeepWarm]: The running scheduler, None when disabled.
+	"""
+	interval = float(os.getenv("RUNPOD_KEEP_WARM_INTERVAL", 0))
+	if interval <= 0:
+		return None
+	return KeepWarm(llm, interval, float(os.getenv("RUNPOD_KEEP_WARM_WINDOW", 900))).start()
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import uuid
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.async_runtime import get_event_loop, run
+from utils.rate_limit import ConcurrencyLimiter, Overloaded
+from utils.session_store import SessionStore
+from utils.streaming import FinalAnswerStreamHandler
+from utils.streamlit_cache import get_answer_cache, get_index_version, get_runner, get_session_store, warm_up
+from utils.tracing import trace_request
+
+parser = argparse.ArgumentParser(
+	prog="DoctorLLM Server",
+	description="Serve the app's RAG chain or agent over HTTP, with server-sent-event streaming",
+)
+
+parser.add_argument("--host", type=str, default="127.0.0.1")
+parser.add_argument("-p", "--port", type=int, default=8000)
+parser.add_argument("-l", "--llm", type=str, default="openrouter", choices=["runpod", "openrouter", "router"])
+parser.add_argument("-m", "--model", type=str, default="openchat/openchat-7b:free")
+parser.add_argument("-a", "--agent", action=argparse.BooleanOptionalAction)
+parser.add_argument("-s", "--speculative", action=argparse.BooleanOptionalAction, help="Retrieve for the raw question while it is reformulated")
+parser.add_argument("--mmap", action=argparse.BooleanOptionalAction, default=True, help="Serve the FAISS index memory-mapped")
+parser.add_argument("-i", "--index", type=str, default=None, help="FAISS index spec (default: flat)")
+parser.add_argument("-q", "--qa-index", action=argparse.BooleanOptionalAction, help="Search the question-keyed Q/A index")
+parser.add_argument("-c", "--concurrency", type=int, default=None, help="Requests answered at once (default: SERVER_MAX_CONCURRENCY or 16)")
+parser.add_argument("--max-queue", type=int, default=None, help="Requests waiting for a slot before new ones get 503 (default: SERVER_MAX_QUEUE or 64)")
+parser.add_argument("--timeout", type=float, default=None, help="Seconds a request may take (default: SERVER_REQUEST_TIMEOUT or 120)")
+
+SESSION_ID = re.compile(r"^[\w-]{1,128}$")
+_DONE = object()
+
+class _LoopQueue:
+	"""
+	Queue-like `put` handing items to an asyncio queue from any thread.
+	"""
+
+	def __init__(self, queue: asyncio.Queue):
+		self.queue = queue
+		self.loop = asyncio.get_running_loop()
+
+	def put(self, item: Any) -> None:
+		self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+@asynccontextmanager
+async def deadline(seconds: Optional[float]) -> AsyncIterator[None]:
+	"""
+	Cancel the block after `seconds` and raise TimeoutError, as `asyncio.timeout`
+	does on Python 3.11+.
+
+	Parameters:
+	- seconds (Optional[float]): Time the block may take, None for no limit.
+	"""
+	if seconds is None:
+		yield
+		return
+
+	task = asyncio.current_task()
+	expired = False
+
+	def expire() -> None:
+		nonlocal expired
+		expired = True
+		task.cancel()
+
+	handle = asyncio.get_running_loop().call_later(seconds, expire)
+	try:
+		yield
+	except asyncio.CancelledError:
+		if expired:
+			raise TimeoutError from None
+		raise
+	finally:
+		handle.cancel()
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+	"""
+	Encode one server-sent event, its data as a single JSON line.
+
+	Parameters:
+	- event (str): The event name.
+	- data (Dict[str, Any]): The event payload.
+
+	Returns:
+	- bytes: The encoded event.
+	"""
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+class ChatServer:
+	"""
+	HTTP endpoints answering chat messages with one shared runner.
+
+	The runner, retriever, embedding model and LLM clients are built once
+	for the process and serve every request. At most `concurrency` requests
+	are answered at once and `max_queue` more wait for a slot, anything
+	beyond gets 503 with a Retry-After header. A session answers one
+	message at a time, a second concurrent message of the same session gets
+	409, since it would read a history missing the first turn.
+
+	Endpoints:
+	- POST /sessions: Create a session, returns its `session_id`.
+	- GET /sessions/{session_id}/messages: The messages of a session, empty
+	  for a session that has none yet. Reading does not create the session.
+	- POST /chat: Answer `input` in `session_id` (a new session when omitted), as JSON.
+	- POST /chat/stream: The same as server-sent events: `session`, `token`
+	  for every chunk of the answer, then `done` with the answer and its
+	  sources, or `error`.
+	- GET /health: Limiter counters.
+	"""
+
+	def __init__(
+		self,
+		runner: Any,
+		session_store: SessionStore,
+		agent: bool = False,
+		concurrency: int = 16,
+		max_queue: int = 64,
+		timeout: Optional[float] = 120.0,
+	):
+		self.runner = runner
+		self.session_store = session_store
+		self.agent = agent
+		self.limiter = ConcurrencyLimiter(concurrency, max_queue)
+		self.timeout = timeout
+		self.busy: Set[str] = set()
+
+	def app(self) -> web.Application:
+		app = web.Application()
+		app.add_routes([
+			web.post("/sessions", self.create_session),
+			web.get("/sessions/{session_id}/messages", self.messages),
+			web.post("/chat", self.chat),
+			web.post("/chat/stream", self.chat_stream),
+			web.get("/health", self.health),
+		])
+		return app
+
+	async def create_session(self, request: web.Request) -> web.Response:
+		return web.json_response({"session_id": uuid.uuid4().hex})
+
+	async def messages(self, request: web.Request) -> web.Response:
+		session_id = request.match_info["session_id"]
+		if not SESSION_ID.match(session_id):
+			raise web.HTTPBadRequest(text="invalid session_id")
+		messages = self.session_store.messages(session_id) or []
+		return web.json_response({
+			"session_id": session_id,
+			"messages": [{"type": message.type, "content": message.content} for message in messages],
+		})
+
+	async def health(self, request: web.Request) -> web.Response:
+		return web.json_response({"status": "ok", **self.limiter.stats(), "sessions_busy": len(self.busy)})
+
+	async def _read_message(self, request: web.Request) -> Tuple[str, str]:
+		try:
+			body = await request.json()
+		except json.JSONDecodeError:
+			raise web.HTTPBadRequest(text="body must be JSON")
+		question = body.get("input") if isinstance(body, dict) else None
+		if not isinstance(question, str) or not question.strip():
+			raise web.HTTPBadRequest(text="missing input")
+		session_id = body.get("session_id") or uuid.uuid4().hex
+		if not isinstance(session_id, str) or not SESSION_ID.match(session_id):
+			raise web.HTTPBadRequest(text="invalid session_id")
+		return session_id, question
+
+	def _claim(self, session_id: str) -> None:
+		if session_id in self.busy:
+			raise web.HTTPConflict(text="session is answering another message")
+		self.busy.add(session_id)
+
+	async def _answer(self, question: str, config: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+		"""
+		Run the runner and yield ("token", text) for every answer chunk, then ("done", payload).
+		"""
+		inp = {"input": question}
+		if not self.agent:
+			answer, sources = [], []
+			async with aclosing(self.runner.astream(inp, config=config)) as chunks:
+				async for chunk in chunks:
+					if "context" in chunk:
+						sources = [doc.metadata for doc in chunk["context"]]
+					if text := chunk.get("answer"):
+						answer.append(text)
+						yield "token", text
+			yield "done", {"answer": "".join(answer), "sources": sources}
+			return
+
+		# Forward the tokens after "Final Answer:" as the agent generates them
+		queue: asyncio.Queue = asyncio.Queue()
+		handler = FinalAnswerStreamHandler(_LoopQueue(queue))
+		config = {**config, "callbacks": [*config.get("callbacks", []), handler]}
+		task = asyncio.ensure_future(self.runner.ainvoke(inp, config=config))
+		task.add_done_callback(lambda _: queue.put_nowait(_DONE))
+		try:
+			while (token := await queue.get()) is not _DONE:
+				yield "token", token
+			result = await task
+		finally:
+			task.cancel()
+
+		if not handler.streamed:
+			yield "token", result["output"]
+		yield "done", {"answer": result["output"], "sources": []}
+
+	async def _run(self, session_id: str, question: str) -> AsyncIterator[Tuple[str, Any]]:
+		"""
+		Answer a message within the concurrency limit, releasing the session when closed.
+		"""
+		try:
+			async with self.limiter.slot():
+				with trace_request(session_id) as trace:
+					config = {
+						"configurable": {"session_id": session_id},
+						"callbacks": [trace.handler] if trace is not None else [],
+					}
+					async with aclosing(self._answer(question, config)) as events:
+						async for event in events:
+							yield event
+		finally:
+			self.busy.discard(session_id)
+
+	async def chat(self, request: web.Request) -> web.Response:
+		session_id, question = await self._read_message(request)
+		self._claim(session_id)
+		result = None
+		try:
+			async with deadline(self.timeout), aclosing(self._run(session_id, question)) as events:
+				async for event, data in events:
+					if event == "done":
+						result = data
+		except Overloaded as e:
+			raise web.HTTPServiceUnavailable(text=str(e), headers={"Retry-After": "1"})
+		except TimeoutError:
+			raise web.HTTPGatewayTimeout(text="answer took too long")
+		return web.json_response({"session_id": session_id, **result})
+
+	async def chat_stream(self, request: web.Request) -> web.StreamResponse:
+		session_id, question = await self._read_message(request)
+		self._claim(session_id)
+		response: Optional[web.StreamResponse] = None
+		try:
+			async with deadline(self.timeout), aclosing(self._run(session_id, question)) as events:
+				async for event, data in events:
+					# Headers go out with the first event, so an overloaded server still answers 503
+					if response is None:
+						response = web.StreamResponse(headers={
+							"Content-Type": "text/event-stream",
+							"Cache-Control": "no-cache",
+							"X-Accel-Buffering": "no",
+						})
+						await response.prepare(request)
+						await response.write(sse_event("session", {"session_id": session_id}))
+					# Waits for the client to read, a slow client slows its own answer down
+					await response.write(sse_event(event, {"text": data} if event == "token" else data))
+		except Overloaded as e:
+			raise web.HTTPServiceUnavailable(text=str(e), headers={"Retry-After": "1"})
+		except ConnectionResetError:
+			# Client went away, the run was cancelled on leaving the block
+			pass
+		except Exception as e:
+			if response is None:
+				if isinstance(e, TimeoutError):
+					raise web.HTTPGatewayTimeout(text="answer took too long")
+				raise
+			error = "answer took too long" if isinstance(e, TimeoutError) else f"{type(e).__name__}: {e}"
+			await response.write(sse_event("error", {"error": error}))
+		return response
+
+async def serve(app: web.Application, host: str, port: int) -> web.AppRunner:
+	"""
+	Start serving an application on the current event loop.
+
+	Parameters:
+	- app (web.Application): The application.
+	- host (str): Interface to listen on.
+	- port (int): Port to listen on.
+
+	Returns:
+	- web.AppRunner: The runner, cleaned up to stop serving.
+	"""
+	runner = web.AppRunner(app)
+	await runner.setup()
+	await web.TCPSite(runner, host, port).start()
+	return runner
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	model_name = os.getenv("RUNPOD_MODEL_NAME") if args.llm == "runpod" else args.model
+	runner = get_runner(args.llm, model_name, bool(args.agent), args.index, args.mmap, bool(args.speculative), bool(args.qa_index))
+	warm_up_seconds = warm_up(args.index, args.mmap, bool(args.qa_index))
+	if not args.agent:
+		get_answer_cache(args.llm, model_name).sync_version(get_index_version(bool(args.qa_index)))
+
+	server = ChatServer(
+		runner,
+		get_session_store(),
+		agent=bool(args.agent),
+		concurrency=args.concurrency or int(os.getenv("SERVER_MAX_CONCURRENCY", 16)),
+		max_queue=args.max_queue if args.max_queue is not None else int(os.getenv("SERVER_MAX_QUEUE", 64)),
+		timeout=args.timeout or float(os.getenv("SERVER_REQUEST_TIMEOUT", 120)) or None,
+	)
+
+	# The LLM clients' connection pools are bound to the async runtime loop, serve on it too
+	get_event_loop()
+	site = run(serve(server.app(), args.host, args.port))
+	print(f"Serving on http://{args.host}:{args.port} (warm-up {warm_up_seconds:.2f}s)")
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		run(site.cleanup())
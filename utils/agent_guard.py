@@ -0,0 +1,261 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.documents import Document
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+
+from utils.embedding_cache import normalize_text
+from utils.history import count_text_tokens
+
+LOOP_HINT = (
+	"\n\nYou already searched for this and the result above did not change. "
+	"Do not call the tool again, answer now with 'Final Answer:'."
+)
+
+def tool_key(action: AgentAction) -> Tuple[str, str]:
+	"""
+	Key of a tool call, the same for inputs that only differ in case, spacing or punctuation.
+	"""
+	text = normalize_text(str(action.tool_input))
+	return action.tool, re.sub(r"[^\w\s]", "", text).strip()
+
+class ToolMemo:
+	"""
+	Tool results of the most recent `max_sessions` sessions, by normalized call.
+	"""
+
+	def __init__(self, max_sessions: int = 1000):
+		self.max_sessions = max_sessions
+		self.lock = threading.Lock()
+		self.sessions: OrderedDict = OrderedDict()
+
+	def session(self, session_id: Optional[str]) -> Dict[Tuple[str, str], str]:
+		"""
+		Return the result cache of a session, a throwaway one without session ID.
+		"""
+		if session_id is None:
+			return {}
+		with self.lock:
+			if session_id not in self.sessions:
+				self.sessions[session_id] = {}
+				while len(self.sessions) > self.max_sessions:
+					self.sessions.popitem(last=False)
+			self.sessions.move_to_end(session_id)
+			return self.sessions[session_id]
+
+class AgentStats:
+	"""
+	Counters of the guarded agent: iterations, tool calls, cache hits and aborts.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.turns = 0
+		self.iterations = 0
+		self.tool_calls = 0
+		self.turn_hits = 0
+		self.session_hits = 0
+		self.aborts: Counter = Counter()
+
+	def record(self, turn: "Turn") -> None:
+		with self.lock:
+			self.turns += 1
+			self.iterations += turn.iterations
+			self.tool_calls += turn.tool_calls
+			self.turn_hits += turn.turn_hits
+			self.session_hits += turn.session_hits
+			if turn.stop_reason is not None:
+				self.aborts[turn.stop_reason] += 1
+
+	def stats(self) -> Dict[str, Any]:
+		"""
+		Return the agent counters.
+
+		Returns:
+		- Dict[str, Any]: Turns, iterations, tool calls, cache hits within a turn and from earlier turns, aborts by reason.
+		"""
+		with self.lock:
+			return {
+				"turns": self.turns,
+				"iterations": self.iterations,
+				"tool_calls": self.tool_calls,
+				"turn_hits": self.turn_hits,
+				"session_hits": self.session_hits,
+				"aborts": dict(self.aborts),
+			}
+
+class Turn:
+	"""
+	State of one agent turn.
+	"""
+
+	def __init__(self, session_memo: Dict[Tuple[str, str], str]):
+		self.session_memo = session_memo
+		self.memo: Dict[Tuple[str, str], str] = {}
+		self.calls: Counter = Counter()
+		self.observations: List[str] = []
+		self.iterations = 0
+		self.tool_calls = 0
+		self.turn_hits = 0
+		self.session_hits = 0
+		self.tokens = 0
+		self.stop_reason: Optional[str] = None
+
+_turn: ContextVar[Optional[Turn]] = ContextVar("agent_turn", default=None)
+
+class GuardedAgentExecutor(AgentExecutor):
+	"""
+	AgentExecutor memoizing tool results and bounding every turn.
+
+	- Tool results are reused by normalized input within a turn and across
+	  the turns of a session (`session_id` input key).
+	- A call repeated within a turn gets its cached result and a hint to
+	  answer, and after `max_repeats` repeats the turn is stopped.
+	- A turn is stopped once it ran `max_turn_seconds` or once thoughts,
+	  actions and observations added `max_turn_tokens` tokens to the prompt.
+
+	A stopped turn is answered by `fallback`, e.g. the QA chain, from the
+	observations gathered so far (as `context` documents) instead of the
+	executor's "Agent stopped" message.
+	"""
+
+	memo: Any = None
+	stats: Optional[AgentStats] = None
+	fallback: Optional[Runnable] = None
+	max_turn_seconds: Optional[float] = 60.0
+	max_turn_tokens: Optional[int] = 4000
+	max_repeats: int = 2
+
+	def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+		turn = _turn.get()
+		if turn is not None:
+			turn.iterations = iterations
+			if turn.stop_reason is not None:
+				return False
+			if self.max_turn_seconds is not None and time_elapsed >= self.max_turn_seconds:
+				turn.stop_reason = "time"
+				return False
+			if self.max_iterations is not None and iterations >= self.max_iterations:
+				turn.stop_reason = "iterations"
+				return False
+		return super()._should_continue(iterations, time_elapsed)
+
+	def _lookup(self, turn: Turn, action: AgentAction) -> Optional[AgentStep]:
+		if action.tool == "_Exception":
+			return None
+
+		key = tool_key(action)
+		turn.calls[key] += 1
+		if key in turn.memo:
+			turn.turn_hits += 1
+			if turn.calls[key] > self.max_repeats:
+				turn.stop_reason = "loop"
+			return AgentStep(action=action, observation=turn.memo[key] + LOOP_HINT)
+		if key in turn.session_memo:
+			turn.session_hits += 1
+			turn.memo[key] = turn.session_memo[key]
+			return AgentStep(action=action, observation=turn.memo[key])
+		return None
+
+	def _record(self, turn: Turn, step: AgentStep) -> AgentStep:
+		observation = str(step.observation)
+		if step.action.tool != "_Exception":
+			turn.tool_calls += 1
+			turn.memo[tool_key(step.action)] = observation
+			turn.session_memo[tool_key(step.action)] = observation
+		return step
+
+	def _account(self, turn: Turn, step: AgentStep) -> AgentStep:
+		turn.observations.append(str(step.observation))
+		turn.tokens += count_text_tokens(step.action.log) + count_text_tokens(str(step.observation))
+		if self.max_turn_tokens is not None and turn.tokens >= self.max_turn_tokens and turn.stop_reason is None:
+			turn.stop_reason = "tokens"
+		return step
+
+	def _perform_agent_action(
+		self,
+		name_to_tool_map: Dict[str, BaseTool],
+		color_mapping: Dict[str, str],
+		agent_action: AgentAction,
+		run_manager: Optional[CallbackManagerForChainRun] = None,
+	) -> AgentStep:
+		turn = _turn.get()
+		if turn is None:
+			return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+		step = self._lookup(turn, agent_action) or self._record(
+			turn, super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+		)
+		return self._account(turn, step)
+
+	async def _aperform_agent_action(
+		self,
+		name_to_tool_map: Dict[str, BaseTool],
+		color_mapping: Dict[str, str],
+		agent_action: AgentAction,
+		run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+	) -> AgentStep:
+		turn = _turn.get()
+		if turn is None:
+			return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+		step = self._lookup(turn, agent_action)
+		if step is None:
+			step = self._record(
+				turn, await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+			)
+		return self._account(turn, step)
+
+	def _start(self, inputs: Dict[str, Any]) -> Turn:
+		session_memo = self.memo.session(inputs.get("session_id")) if self.memo is not None else {}
+		return Turn(session_memo)
+
+	def _fallback_input(self, inputs: Dict[str, Any], turn: Turn) -> Dict[str, Any]:
+		return {
+			"input": inputs["input"],
+			"chat_history": inputs.get("chat_history", []),
+			"context": [Document(page_content=observation) for observation in dict.fromkeys(turn.observations)],
+		}
+
+	def _finish(self, turn: Turn) -> None:
+		if self.stats is not None:
+			self.stats.record(turn)
+
+	def _call(self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+		turn = self._start(inputs)
+		token = _turn.set(turn)
+		try:
+			outputs = super()._call(inputs, run_manager)
+		finally:
+			_turn.reset(token)
+
+		if turn.stop_reason is not None and self.fallback is not None:
+			outputs["output"] = self.fallback.invoke(
+				self._fallback_input(inputs, turn),
+				config={"callbacks": run_manager.get_child() if run_manager else None},
+			)
+		self._finish(turn)
+		return outputs
+
+	async def _acall(self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None) -> Dict[str, Any]:
+		turn = self._start(inputs)
+		token = _turn.set(turn)
+		try:
+			outputs = await super()._acall(inputs, run_manager)
+		finally:
+			_turn.reset(token)
+
+		if turn.stop_reason is not None and self.fallback is not None:
+			outputs["output"] = await self.fallback.ainvoke(
+				self._fallback_input(inputs, turn),
+				config={"callbacks": run_manager.get_child() if run_manager else None},
+			)
+		self._finish(turn)
+		return outputs
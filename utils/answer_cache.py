@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+class AnswerCache:
+	"""
+	Semantic cache of generated answers.
+
+	An entry matches a request when both were answered from the same set of
+	retrieved documents and the cosine similarity of their standalone
+	questions reaches `threshold`. Entries expire after `ttl` seconds and the
+	least recently used ones are evicted beyond `max_size` entries. The whole
+	cache is dropped when the index version changes.
+	"""
+
+	def __init__(
+		self,
+		threshold: float = 0.95,
+		ttl: Optional[float] = 3600,
+		max_size: int = 1024,
+		version: Any = None,
+	):
+		self.threshold = threshold
+		self.ttl = ttl
+		self.max_size = max_size
+		self.version = version
+		# (doc ids, question) -> (unit question vector, answer, created at)
+		self.entries: OrderedDict = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.invalidations = 0
+
+	@staticmethod
+	def _unit(vector: Iterable[float]) -> np.ndarray:
+		vector = np.asarray(vector, dtype=np.float32)
+		norm = np.linalg.norm(vector)
+		return vector / norm if norm else vector
+
+	def _expired(self, created: float, now: float) -> bool:
+		return self.ttl is not None and now - created > self.ttl
+
+	def sync_version(self, version: Any) -> None:
+		"""
+		Drop every entry if the index the answers came from has changed.
+
+		Parameters:
+		- version (Any): Current version of the index.
+		"""
+		with self.lock:
+			if version != self.version:
+				if self.entries:
+					self.invalidations += 1
+				self.entries.clear()
+				self.version = version
+
+	def lookup(self, question_vector: List[float], doc_ids: FrozenSet[str]) -> Optional[str]:
+		"""
+		Find a cached answer for a question over the given documents.
+
+		Parameters:
+		- question_vector (List[float]): Embedding of the standalone question.
+		- doc_ids (FrozenSet[str]): Ids of the retrieved documents.
+
+		Returns:
+		- Optional[str]: The cached answer, or None on a miss.
+		"""
+		query = self._unit(question_vector)
+		now = time.monotonic()
+		best_key, best_score = None, self.threshold
+
+		with self.lock:
+			for key, (vector, _, created) in list(self.entries.items()):
+				if self._expired(created, now):
+					del self.entries[key]
+					continue
+				if key[0] != doc_ids:
+					continue
+				score = float(vector @ query)
+				if score >= best_score:
+					best_key, best_score = key, score
+
+			if best_key is None:
+				self.misses += 1
+				return None
+
+			self.hits += 1
+			self.entries.move_to_end(best_key)
+			return self.entries[best_key][1]
+
+	def store(self, question: str, question_vector: List[float], doc_ids: FrozenSet[str], answer: str) -> None:
+		"""
+		Cache the answer of a question over the given documents.
+
+		Parameters:
+		- question (str): The standalone question.
+		- question_vector (List[float]): Embedding of the standalone question.
+		- doc_ids (FrozenSet[str]): Ids of the retrieved documents.
+		- answer (str): The generated answer.
+		"""
+		with self.lock:
+			key = (doc_ids, question)
+			self.entries[key] = (self._unit(question_vector), answer, time.monotonic())
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+	def stats(self) -> Dict[str, int]:
+		"""
+		Return the cache counters.
+
+		Returns:
+		- Dict[str, int]: Hits, misses, invalidations and current size.
+		"""
+		with self.lock:
+			return {
+				"hits": self.hits,
+				"misses": self.misses,
+				"invalidations": self.invalidations,
+				"size": len(self.entries),
+			}
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+_END = object()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+	"""
+	Return the process-wide event loop, starting its thread on first use.
+
+	Every async request of every session runs on this one loop, so pooled
+	async HTTP connections stay bound to the loop that opened them.
+
+	Returns:
+	- asyncio.AbstractEventLoop: The running background event loop.
+	"""
+	global _loop
+	with _lock:
+		if _loop is None:
+			loop = asyncio.new_event_loop()
+			threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+			_loop = loop
+	return _loop
+
+def run(coro: Awaitable[T]) -> T:
+	"""
+	Run a coroutine on the background loop and wait for its result.
+
+	Parameters:
+	- coro (Awaitable[T]): The coroutine to run.
+
+	Returns:
+	- T: The result of the coroutine.
+	"""
+	return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+async def _next(aiter: AsyncIterator[T]) -> Any:
+	try:
+		return await aiter.__anext__()
+	except StopAsyncIteration:
+		return _END
+
+def iterate(agen: AsyncIterator[T]) -> Iterator[T]:
+	"""
+	Consume an async iterator from synchronous code, one item at a time.
+
+	Parameters:
+	- agen (AsyncIterator[T]): The async iterator, e.g. from `Runnable.astream`.
+
+	Returns:
+	- Iterator[T]: A synchronous iterator over the same items.
+	"""
+	aiter = agen.__aiter__()
+	try:
+		while (item := run(_next(aiter))) is not _END:
+			yield item
+	finally:
+		if hasattr(aiter, "aclose"):
+			run(aiter.aclose())
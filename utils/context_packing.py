@@ -0,0 +1,129 @@
+import re
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.documents import Document
+
+def shingles(text: str, size: int = 5) -> Set[str]:
+	"""
+	Return the word n-grams of a text, used to compare documents without embedding them.
+
+	Parameters:
+	- text (str): The text.
+	- size (int): Number of words per n-gram.
+
+	Returns:
+	- Set[str]: The lower cased n-grams, the whole text for shorter ones.
+	"""
+	words = re.findall(r"\w+", text.lower())
+	if len(words) <= size:
+		return {" ".join(words)}
+	return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+	if not a or not b:
+		return 0.0
+	return len(a & b) / len(a | b)
+
+def trim_overlap(other: str, text: str, min_overlap: int = 20, max_overlap: int = 400) -> str:
+	"""
+	Drop the part of `text` that repeats the start or the end of `other`, as
+	consecutive chunks of a splitter with overlap do.
+
+	Parameters:
+	- other (str): Text already in the context.
+	- text (str): Text to add.
+	- min_overlap (int): Shortest repeated run worth trimming, in characters.
+	- max_overlap (int): Longest repeated run looked for, in characters.
+
+	Returns:
+	- str: `text` without the repeated part.
+	"""
+	for size in range(min(len(other), len(text), max_overlap), min_overlap - 1, -1):
+		if other.endswith(text[:size]):
+			return text[size:].lstrip()
+		if other.startswith(text[-size:]):
+			return text[:-size].rstrip()
+	return text
+
+def pack_context(
+	candidates: Sequence[Tuple[Document, float]],
+	count_tokens: Callable[[str], int],
+	max_tokens: int = 1500,
+	lambda_mult: float = 0.7,
+	max_score_gap: Optional[float] = 0.25,
+	duplicate_threshold: float = 0.8,
+	min_docs: int = 1,
+	max_docs: int = 4,
+) -> List[Document]:
+	"""
+	Choose the documents put into the prompt out of the retrieved candidates.
+
+	1. Candidates further than `max_score_gap` from the best hit are dropped,
+	   so a clear best match is not padded with weak ones (adaptive k).
+	2. Near duplicates, by word 5-gram Jaccard similarity, are dropped.
+	3. The rest is picked greedily MMR-style: relevance traded against the
+	   similarity to what was already picked, weighted by `lambda_mult`.
+	4. Text repeating the start or end of an already picked chunk of the
+	   same row is trimmed, and documents are added while they fit in `max_tokens`.
+
+	Similarity between documents is lexical, so no document is embedded
+	again and any index type works.
+
+	Parameters:
+	- candidates (Sequence[Tuple[Document, float]]): Documents with their distance, best first.
+	- count_tokens (Callable[[str], int]): Token counter of the prompt's tokenizer.
+	- max_tokens (int): Token budget of the packed context.
+	- lambda_mult (float): 1 ranks by relevance only, 0 by diversity only.
+	- max_score_gap (Optional[float]): Largest distance to the best hit kept, None keeps all.
+	- duplicate_threshold (float): Similarity from which a document is a duplicate.
+	- min_docs (int): Documents kept even over the budget.
+	- max_docs (int): Most documents packed.
+
+	Returns:
+	- List[Document]: The packed documents, in selection order.
+	"""
+	if not candidates:
+		return []
+
+	best = candidates[0][1]
+	if max_score_gap is not None:
+		candidates = [(doc, score) for doc, score in candidates if score - best <= max_score_gap]
+
+	scores = [score for _, score in candidates]
+	spread = (max(scores) - min(scores)) or 1.0
+	pool = [
+		(doc, (max(scores) - score) / spread, shingles(doc.page_content))
+		for doc, score in candidates
+	]
+
+	unique = []
+	for item in pool:
+		if all(jaccard(item[2], kept[2]) < duplicate_threshold for kept in unique):
+			unique.append(item)
+
+	packed: List[Document] = []
+	picked: List[Set[str]] = []
+	tokens = 0
+	while unique and len(packed) < max_docs:
+		index = max(
+			range(len(unique)),
+			key=lambda i: lambda_mult * unique[i][1]
+			- (1 - lambda_mult) * max((jaccard(unique[i][2], s) for s in picked), default=0.0),
+		)
+		doc, _, doc_shingles = unique.pop(index)
+
+		text = doc.page_content
+		for other in packed:
+			if other.metadata.get("id") is not None and other.metadata.get("id") == doc.metadata.get("id"):
+				text = trim_overlap(other.page_content, text)
+		if not text:
+			continue
+
+		cost = count_tokens(text)
+		if tokens + cost > max_tokens and len(packed) >= min_docs:
+			continue
+		tokens += cost
+		picked.append(doc_shingles)
+		packed.append(Document(page_content=text, metadata=doc.metadata) if text != doc.page_content else doc)
+
+	return packed
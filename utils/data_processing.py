@@ -1,29 +1,124 @@
 import bs4
-# from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
+import csv
+import hashlib
+import re
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from typing import List
+from typing import Iterator, List, Tuple
 
 from utils.debug import log_time
 
+# Written by `python data.py`, see `data.ingest`
+DATASET_PATH = "./mashqa.parquet"
+# Merged CSV of earlier versions, still readable by the functions below
+CSV_DATASET_PATH = "./mashqa_merged_output_all.csv"
+CSV_ARGS = {
+	"delimiter": ",",
+	"quotechar": '"',
+	"fieldnames": ["Q", "A"],
+}
+
+def row_id(question: str, answer: str) -> str:
+	"""
+	Return the stable ID of a pair, the same whatever file or position it comes from.
+	"""
+	key = " ".join(question.split()) + "\x00" + " ".join(answer.split())
+	return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def iter_qa_batches(batch_size: int, file_path: str = DATASET_PATH) -> Iterator[List[Tuple[str, str, str]]]:
+	"""
+	Stream the (id, question, answer) triples of the dataset in batches.
+
+	Parquet datasets are read one record batch at a time, with the `id`
+	column written by `data.py`. CSV files of the old pipeline are still
+	accepted, their ids are computed the same way. An id does not change
+	when rows are added or removed around it, unlike a row number.
+
+	Parameters:
+	- batch_size (int): Number of rows per batch.
+	- file_path (str): Path of the Parquet dataset or of a merged CSV.
+
+	Returns:
+	- Iterator[List[Tuple[str, str, str]]]: Batches of rows.
+	"""
+	if file_path.endswith(".csv"):
+		batch = []
+		with open(file_path, newline="", encoding="utf-8") as csv_file:
+			for row in csv.DictReader(csv_file, **CSV_ARGS):
+				question, answer = row["Q"] or "", row["A"] or ""
+				batch.append((row_id(question, answer), question, answer))
+				if len(batch) == batch_size:
+					yield batch
+					batch = []
+		if batch:
+			yield batch
+		return
+
+	# Only the indexer and benchmarks read the dataset, keep pyarrow out of the app startup
+	import pyarrow.parquet as pq
+
+	for record_batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=["id", "question", "answer"]):
+		columns = record_batch.to_pydict()
+		yield list(zip(columns["id"], columns["question"], columns["answer"]))
+
+def iter_document_batches(batch_size: int, file_path: str = DATASET_PATH) -> Iterator[List[Document]]:
+	"""
+	Stream the dataset in fixed-size batches of documents.
+
+	Rows are turned into documents the same way `CSVLoader` did, so chunks
+	keep the same content hash whichever format the dataset is in. The row
+	id is kept in `metadata["id"]`. Only one batch is held in memory at a time.
+
+	Parameters:
+	- batch_size (int): Number of rows per batch.
+	- file_path (str): Path of the Parquet dataset or of a merged CSV.
+
+	Returns:
+	- Iterator[List[Document]]: Batches of loaded documents.
+	"""
+	for rows in iter_qa_batches(batch_size, file_path):
+		yield [
+			Document(
+				page_content=f"Q: {question.strip()}\nA: {answer.strip()}",
+				metadata={"source": file_path, "id": pair_id},
+			)
+			for pair_id, question, answer in rows
+		]
+
+def summarize_answer(answer: str, max_chars: int = 300) -> str:
+	"""
+	Cut an answer down to its leading sentences, the part that states it.
+
+	MASHQA answers open with the direct answer and go on with details, so
+	the lead is a cheap extractive summary that needs no model.
+
+	Parameters:
+	- answer (str): The full answer.
+	- max_chars (int): Length the summary stays under, unless the first sentence is longer.
+
+	Returns:
+	- str: The summary, empty for an empty answer.
+	"""
+	summary = ""
+	for sentence in re.split(r"(?<=[.!?])\s+", answer.strip()):
+		if summary and len(summary) + len(sentence) + 1 > max_chars:
+			break
+		summary = f"{summary} {sentence}".strip()
+	return summary
+
 @log_time
-def load_documents() -> List[str]:
+def load_documents(file_path: str = DATASET_PATH) -> List[Document]:
 	"""
 	Load documents for processing.
 
+	Parameters:
+	- file_path (str): Path of the Parquet dataset or of a merged CSV.
+
 	Returns:
-	- List[str]: A list of loaded document texts.
-	"""
-	loader = CSVLoader(
-		file_path="./mashqa_merged_output_all.csv",
-		csv_args={
-			"delimiter": ",",
-			"quotechar": '"',
-			"fieldnames": ["Q", "A"],
-		},
-	)
-	return loader.load()
+	- List[Document]: A list of loaded documents.
+	"""
+	return [doc for batch in iter_document_batches(4096, file_path) for doc in batch]
 
 @log_time
 def split_documents(docs: List[str]) -> List[str]:
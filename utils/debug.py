@@ -1,10 +1,24 @@
 import os
 import time
+from functools import wraps
 from typing import Callable, Any
 
+from dotenv import load_dotenv
+
+from utils.tracing import span, tracing_enabled
+
+# DEBUG and tracing are read when a function is decorated, which happens at import
+# time, so .env must already be loaded even if the entry point loads it later
+load_dotenv()
+
 def log_time(func: Callable) -> Callable:
 	"""
-	A decorator that logs the time a function takes to execute.
+	A decorator that times a function as a span of the current trace and,
+	in DEBUG mode, prints how long it took.
+
+	DEBUG and tracing are read once, when the function is decorated. With
+	both off the function is returned unwrapped and costs nothing per call.
+	Outside a trace the span is a no-op.
 
 	Args:
 		func (Callable): The function to be wrapped and timed.
@@ -12,9 +26,14 @@ def log_time(func: Callable) -> Callable:
 	Returns:
 		Callable: The wrapped function with added logging.
 	"""
+	debug = os.getenv('DEBUG') != None
+	if not debug and not tracing_enabled():
+		return func
+
+	@wraps(func)
 	def wrapper(*args: Any, **kwargs: Any) -> Any:
 		"""
-		Wrapper for functions to log execution time if in DEBUG mode.
+		Wrapper for functions to record and log execution time.
 
 		Args:
 			*args (Any): Positional arguments for the function.
@@ -23,14 +42,12 @@ def log_time(func: Callable) -> Callable:
 		Returns:
 			Any: The result of the function execution.
 		"""
-		if os.getenv('DEBUG') == None:
-			return func(*args, **kwargs)
-
-		start_time = time.time()
-		result = func(*args, **kwargs)
-		end_time = time.time()
-		duration = end_time - start_time 
-		print(f"{func.__name__} took {duration:.2f} seconds")
+		start_time = time.perf_counter()
+		with span(func.__name__):
+			result = func(*args, **kwargs)
+		duration = time.perf_counter() - start_time
+		if debug:
+			print(f"{func.__name__} took {duration:.2f} seconds")
 		return result
 
 	return wrapper
@@ -0,0 +1,237 @@
+import json
+import operator
+import os
+import shutil
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterator, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+DOCS_NAME = "docs.sqlite"
+INDEX_NAME = "index.faiss"
+VECTORS_NAME = "vectors.npy"
+NORMS_NAME = "norms.npy"
+# Written last by an export, also what its freshness is checked against
+META_NAME = "export.json"
+
+class SQLiteDocstore(Docstore):
+	"""
+	Read-only docstore fetching documents from SQLite by their position in the index.
+
+	Nothing is loaded up front, each search reads one row, so opening the
+	store costs the same whatever the corpus size and the pages are shared
+	with every other process reading the same file.
+	"""
+
+	def __init__(self, path: str):
+		self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+		self.lock = threading.Lock()
+
+	def search(self, search: Union[int, str]) -> Union[str, Document]:
+		with self.lock:
+			row = self.db.execute(
+				"SELECT content, metadata FROM docs WHERE pos = ?", (int(search),)
+			).fetchone()
+		if row is None:
+			return f"ID {search} not found."
+		return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+	def add(self, texts: Dict[str, Document]) -> None:
+		raise NotImplementedError("SQLiteDocstore is read-only, rebuild the index instead")
+
+	def delete(self, ids: list) -> None:
+		raise NotImplementedError("SQLiteDocstore is read-only, rebuild the index instead")
+
+class PositionIds(Mapping):
+	"""
+	Mapping from index position to docstore id for `SQLiteDocstore`, where
+	the id is the position itself, so no mapping has to be loaded.
+	"""
+
+	def __init__(self, size: int):
+		self.size = size
+
+	def __getitem__(self, key: int) -> int:
+		# FAISS hands out numpy integers
+		try:
+			pos = operator.index(key)
+		except TypeError:
+			raise KeyError(key)
+		if not 0 <= pos < self.size:
+			raise KeyError(key)
+		return pos
+
+	def __iter__(self) -> Iterator[int]:
+		return iter(range(self.size))
+
+	def __len__(self) -> int:
+		return self.size
+
+class MmapFlatIndex:
+	"""
+	Exact search over vectors memory-mapped from a .npy file, standing in
+	for `faiss.IndexFlat` in a read-only vector store.
+
+	FAISS 1.8 reads flat and HNSW indexes into private memory even when
+	asked to mmap them, only IVF inverted lists are really mapped. Here the
+	vectors stay in the page cache: opening costs the same whatever the
+	corpus size and every process shares the same pages. Distances are the
+	ones FAISS returns, squared L2 or inner product.
+	"""
+
+	block_size = 65536
+
+	def __init__(self, path: str, metric_type: int = faiss.METRIC_L2):
+		self.xb = np.load(os.path.join(path, VECTORS_NAME), mmap_mode="r")
+		self.norms = np.load(os.path.join(path, NORMS_NAME), mmap_mode="r")
+		self.ntotal, self.d = self.xb.shape
+		self.metric_type = metric_type
+
+	def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+		x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+		largest = self.metric_type == faiss.METRIC_INNER_PRODUCT
+		# Missing results are padded with -1 as FAISS does
+		distances = np.full((len(x), k), -np.inf if largest else np.inf, dtype=np.float32)
+		ids = np.full((len(x), k), -1, dtype=np.int64)
+		query_norms = (x * x).sum(axis=1, keepdims=True)
+
+		for start in range(0, self.ntotal, self.block_size):
+			block = self.xb[start:start + self.block_size]
+			scores = x @ block.T
+			if not largest:
+				scores = self.norms[start:start + len(block)][None, :] - 2 * scores + query_norms
+			candidates = np.concatenate([distances, scores], axis=1)
+			candidate_ids = np.concatenate([ids, np.broadcast_to(np.arange(start, start + len(block)), scores.shape)], axis=1)
+			top = np.argpartition(-candidates if largest else candidates, k - 1, axis=1)[:, :k]
+			distances = np.take_along_axis(candidates, top, axis=1)
+			ids = np.take_along_axis(candidate_ids, top, axis=1)
+
+		order = np.argsort(-distances if largest else distances, axis=1)
+		return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+	def reconstruct(self, i: int) -> np.ndarray:
+		return np.array(self.xb[i])
+
+	def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+		return np.array(self.xb[i0:i0 + n])
+
+def write_index_files(index: faiss.Index, path: str, chunk_size: int = 65536) -> str:
+	"""
+	Write an index in the form `read_index_files` serves without loading it.
+
+	Flat indexes are written as a .npy matrix of vectors plus their squared
+	norms, IVF indexes as a FAISS file whose inverted lists FAISS maps.
+	Other types are written as a FAISS file that is read into memory.
+
+	Parameters:
+	- index (faiss.Index): The index.
+	- path (str): Destination folder.
+	- chunk_size (int): Vectors copied at a time.
+
+	Returns:
+	- str: How the index is served, "flat", "ivf" or "memory".
+	"""
+	index = faiss.downcast_index(index)
+	if isinstance(index, faiss.IndexFlat):
+		vectors = np.lib.format.open_memmap(
+			os.path.join(path, VECTORS_NAME), mode="w+", dtype=np.float32, shape=(index.ntotal, index.d)
+		)
+		norms = np.lib.format.open_memmap(os.path.join(path, NORMS_NAME), mode="w+", dtype=np.float32, shape=(index.ntotal,))
+		for start in range(0, index.ntotal, chunk_size):
+			chunk = index.reconstruct_n(start, min(chunk_size, index.ntotal - start))
+			vectors[start:start + len(chunk)] = chunk
+			norms[start:start + len(chunk)] = (chunk * chunk).sum(axis=1)
+		vectors.flush()
+		norms.flush()
+		kind = "flat"
+	else:
+		faiss.write_index(index, os.path.join(path, INDEX_NAME))
+		kind = "ivf" if faiss.try_extract_index_ivf(index) is not None else "memory"
+
+	with open(os.path.join(path, META_NAME), "w", encoding="utf-8") as file:
+		json.dump({"kind": kind, "metric_type": int(index.metric_type)}, file)
+	return kind
+
+def read_index_files(path: str) -> Union[faiss.Index, MmapFlatIndex]:
+	"""
+	Open an index written by `write_index_files`, memory-mapped where possible.
+
+	Parameters:
+	- path (str): Folder of the index files.
+
+	Returns:
+	- Union[faiss.Index, MmapFlatIndex]: The read-only index.
+	"""
+	with open(os.path.join(path, META_NAME), "r", encoding="utf-8") as file:
+		meta = json.load(file)
+
+	match meta["kind"]:
+		case "flat":
+			return MmapFlatIndex(path, meta["metric_type"])
+		case "ivf":
+			return faiss.read_index(os.path.join(path, INDEX_NAME), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+		case _:
+			return faiss.read_index(os.path.join(path, INDEX_NAME))
+
+def export_vectorstore(vectorstore: FAISS, path: str) -> None:
+	"""
+	Write a vector store as raw index files plus a SQLite docstore, without pickle.
+
+	The export is written next to `path` and moved into place at the end,
+	so readers never see a half written store.
+
+	Parameters:
+	- vectorstore (FAISS): The vector store to export.
+	- path (str): Destination folder.
+	"""
+	tmp_path = path + ".tmp"
+	shutil.rmtree(tmp_path, ignore_errors=True)
+	os.makedirs(tmp_path)
+
+	db = sqlite3.connect(os.path.join(tmp_path, DOCS_NAME))
+	db.execute("CREATE TABLE docs (pos INTEGER PRIMARY KEY, doc_id TEXT, content TEXT, metadata TEXT)")
+
+	def rows() -> Iterator[tuple]:
+		for pos, doc_id in vectorstore.index_to_docstore_id.items():
+			doc = vectorstore.docstore.search(doc_id)
+			yield pos, doc_id, doc.page_content, json.dumps(doc.metadata)
+
+	db.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows())
+	db.commit()
+	db.close()
+
+	kind = write_index_files(vectorstore.index, tmp_path)
+	if kind == "memory":
+		print(f"{path}: this index type cannot be memory-mapped, it is read into memory")
+
+	shutil.rmtree(path, ignore_errors=True)
+	os.replace(tmp_path, path)
+
+def load_mmap_vectorstore(path: str, embedding_function: Embeddings) -> FAISS:
+	"""
+	Open an exported vector store with the index memory-mapped read-only.
+
+	Flat and IVF indexes are mapped, other types (e.g. HNSW) are read into
+	memory, see `write_index_files`.
+
+	Parameters:
+	- path (str): Folder written by `export_vectorstore`.
+	- embedding_function (Embeddings): The embedding function to use with the FAISS index.
+
+	Returns:
+	- FAISS: A read-only FAISS vector store.
+	"""
+	index = read_index_files(path)
+	return FAISS(
+		embedding_function,
+		index,
+		SQLiteDocstore(os.path.join(path, DOCS_NAME)),
+		PositionIds(index.ntotal),
+	)
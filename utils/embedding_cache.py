@@ -0,0 +1,165 @@
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def normalize_text(text: str) -> str:
+	"""
+	Normalize a text into its cache key.
+
+	all-MiniLM-L6-v2 uses an uncased tokenizer that also ignores runs of
+	whitespace, so this does not change the embedding of the text.
+
+	Parameters:
+	- text (str): The text to normalize.
+
+	Returns:
+	- str: The lower cased text with whitespace collapsed.
+	"""
+	return re.sub(r"\s+", " ", text).strip().lower()
+
+class CachedEmbeddings(Embeddings):
+	"""
+	Embeddings wrapper caching vectors by normalized text.
+
+	Vectors are kept in a bounded in-memory LRU and, when `cache_path` is
+	given, in a SQLite file that several processes can share. Counters of
+	hits and misses are available through `stats()`.
+	"""
+
+	def __init__(
+		self,
+		embeddings: Embeddings,
+		namespace: str,
+		max_size: int = 1024,
+		cache_path: Optional[str] = None,
+		normalize: bool = True,
+	):
+		self.embeddings = embeddings
+		self.namespace = namespace
+		self.max_size = max_size
+		self.normalize = normalize
+		self.memory: OrderedDict = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+
+		self.db = None
+		if cache_path is not None:
+			self.db = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute(
+				"CREATE TABLE IF NOT EXISTS embeddings ("
+				"namespace TEXT, key TEXT, vector BLOB, PRIMARY KEY (namespace, key))"
+			)
+			self.db.commit()
+
+	def _key(self, text: str) -> str:
+		return normalize_text(text) if self.normalize else text
+
+	def _remember(self, key: str, vector: List[float]) -> None:
+		self.memory[key] = vector
+		self.memory.move_to_end(key)
+		while len(self.memory) > self.max_size:
+			self.memory.popitem(last=False)
+
+	def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+		found = {}
+		missing = []
+		for key in keys:
+			if key in self.memory:
+				self.memory.move_to_end(key)
+				found[key] = self.memory[key]
+			else:
+				missing.append(key)
+		self.hits += len(keys) - len(missing)
+
+		if self.db is not None and missing:
+			for start in range(0, len(missing), 500):
+				chunk = missing[start:start + 500]
+				rows = self.db.execute(
+					f"SELECT key, vector FROM embeddings WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+					[self.namespace, *chunk],
+				).fetchall()
+				for key, blob in rows:
+					vector = np.frombuffer(blob, dtype=np.float32).tolist()
+					found[key] = vector
+					self._remember(key, vector)
+				self.disk_hits += len(rows)
+		return found
+
+	def _store(self, vectors: Dict[str, List[float]]) -> None:
+		for key, vector in vectors.items():
+			self._remember(key, vector)
+
+		if self.db is not None and vectors:
+			self.db.executemany(
+				"INSERT OR REPLACE INTO embeddings (namespace, key, vector) VALUES (?, ?, ?)",
+				[
+					(self.namespace, key, np.asarray(vector, dtype=np.float32).tobytes())
+					for key, vector in vectors.items()
+				],
+			)
+			self.db.commit()
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		keys = [self._key(text) for text in texts]
+		with self.lock:
+			found = self._lookup(list(dict.fromkeys(keys)))
+
+		missing = {key: text for key, text in zip(keys, texts) if key not in found}
+		if missing:
+			computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+			with self.lock:
+				self.misses += len(computed)
+				self._store(computed)
+			found.update(computed)
+
+		return [found[key] for key in keys]
+
+	def embed_query(self, text: str) -> List[float]:
+		key = self._key(text)
+		with self.lock:
+			found = self._lookup([key])
+		if key in found:
+			return found[key]
+
+		vector = self.embeddings.embed_query(text)
+		with self.lock:
+			self.misses += 1
+			self._store({key: vector})
+		return vector
+
+	async def aembed_query(self, text: str) -> List[float]:
+		key = self._key(text)
+		with self.lock:
+			found = self._lookup([key])
+		if key in found:
+			return found[key]
+
+		# Misses await the wrapped embeddings, e.g. the micro-batcher, without holding an executor thread
+		vector = await self.embeddings.aembed_query(text)
+		with self.lock:
+			self.misses += 1
+			self._store({key: vector})
+		return vector
+
+	def stats(self) -> Dict[str, int]:
+		"""
+		Return the cache counters.
+
+		Returns:
+		- Dict[str, int]: Memory hits, disk hits, misses and current LRU size.
+		"""
+		with self.lock:
+			return {
+				"hits": self.hits,
+				"disk_hits": self.disk_hits,
+				"misses": self.misses,
+				"size": len(self.memory),
+			}
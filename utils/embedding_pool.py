@@ -0,0 +1,92 @@
+import multiprocessing as mp
+import os
+from typing import Any, List, Optional
+
+from utils.retriever import create_embedding_function
+
+# Embedding model of the current worker process, set by `_init_worker`
+_embedding_function = None
+
+def _init_worker(model_name: str, device: str, threads: int, batch_size: int, cache_path: Optional[str]) -> None:
+	global _embedding_function
+	import torch
+
+	# Keep workers from oversubscribing the cores with their own thread pools
+	torch.set_num_threads(threads)
+	_embedding_function = create_embedding_function(model_name, device, batch_size, cache_path=cache_path)
+
+def _embed(texts: List[str]) -> List[List[float]]:
+	return _embedding_function.embed_documents(texts)
+
+class _Ready:
+	"""
+	Result of a batch embedded in the calling process, mirroring `AsyncResult.get`.
+	"""
+
+	def __init__(self, value: Any):
+		self.value = value
+
+	def get(self) -> Any:
+		return self.value
+
+class EmbeddingPool:
+	"""
+	Pool of worker processes, each holding its own copy of the embedding model.
+
+	With a single worker the texts are embedded in the calling process and
+	no pool is started. With `cache_path` all workers share one persistent
+	embedding cache.
+	"""
+
+	def __init__(
+		self,
+		workers: int = 1,
+		model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+		device: str = "cpu",
+		threads_per_worker: Optional[int] = None,
+		batch_size: int = 32,
+		cache_path: Optional[str] = None,
+	):
+		self.workers = max(1, workers)
+		self.pool = None
+		threads = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+
+		if self.workers == 1:
+			_init_worker(model_name, device, threads, batch_size, cache_path)
+		else:
+			# spawn, torch does not survive a fork once its thread pool is started
+			ctx = mp.get_context("spawn")
+			self.pool = ctx.Pool(
+				self.workers,
+				initializer=_init_worker,
+				initargs=(model_name, device, threads, batch_size, cache_path),
+			)
+
+	def submit(self, texts: List[str]) -> Any:
+		"""
+		Queue a batch of texts for embedding.
+
+		Parameters:
+		- texts (List[str]): Texts to embed.
+
+		Returns:
+		- Any: An object whose `get()` returns the embeddings of the batch.
+		"""
+		if self.pool is None:
+			return _Ready(_embed(texts))
+		return self.pool.apply_async(_embed, (texts,))
+
+	def close(self, terminate: bool = False) -> None:
+		if self.pool is not None:
+			if terminate:
+				self.pool.terminate()
+			else:
+				self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	def __enter__(self) -> "EmbeddingPool":
+		return self
+
+	def __exit__(self, exc_type: Any, *exc: Any) -> None:
+		self.close(terminate=exc_type is not None)
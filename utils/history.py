@@ -1,19 +1,244 @@
 import streamlit as st
+import os
+import threading
+from functools import lru_cache
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.chat_message_histories import ChatMessageHistory
+from typing import Callable, List, Optional, Sequence, Tuple
 
-def get_session_history(session_id: str) -> BaseChatMessageHistory:
+from utils.session_store import HistoryFactory, MemorySessionStore, SessionStore
+from utils.tracing import span
+
+@lru_cache(maxsize=1)
+def _encoding():
+	try:
+		import tiktoken
+		return tiktoken.get_encoding("cl100k_base")
+	except Exception:
+		# No tokenizer available (e.g. offline), fall back to an estimate
+		return None
+
+def count_text_tokens(text: str) -> int:
+	"""
+	Approximate the number of tokens of a text, see `count_tokens`.
+
+	Parameters:
+	- text (str): The text to count.
+
+	Returns:
+	- int: Token count.
+	"""
+	encoding = _encoding()
+	return len(encoding.encode(text)) if encoding is not None else len(text) // 4
+
+def count_tokens(message: BaseMessage) -> int:
+	"""
+	Approximate the number of prompt tokens of a message.
+
+	The models served through OpenRouter and Runpod have their own
+	tokenizers, cl100k_base is close enough for budgeting.
+
+	Parameters:
+	- message (BaseMessage): The message to count.
+
+	Returns:
+	- int: Token count including a small per message overhead.
+	"""
+	text = message.content if isinstance(message.content, str) else str(message.content)
+	return count_text_tokens(text) + 4
+
+class SummaryBufferHistory(BaseChatMessageHistory):
+	"""
+	Chat history kept under a token budget.
+
+	Recent messages are kept verbatim. Once they exceed `max_tokens`, the
+	oldest ones are folded into a running summary by the LLM, one batch at
+	a time, so every turn only summarizes the messages that just fell out of
+	the budget. The summary is written on a background thread, so the turn
+	that triggers it is not delayed; until it is done, prompts keep those
+	messages verbatim. `messages` returns the summary followed by the recent
+	messages. `all_messages` keeps the full conversation for display.
+	Restored messages of an earlier run are summarized right away, and until
+	then only the most recent of them that fit the budget are returned.
+
+	`last_tokens_saved` is what the summary saves in each prompt, and
+	`tokens_saved` adds it up once per answered turn.
+	"""
+
+	summary_prompt = ChatPromptTemplate.from_messages(
+		[
+			(
+				"system",
+				"Progressively summarize the conversation between a user and a medical "
+				"assistant. Extend the current summary with the new lines, keeping "
+				"symptoms, conditions, advice and open questions. Return only the new summary.",
+			),
+			("human", "Current summary:\n{summary}\n\nNew lines:\n{new_lines}\n\nNew summary:"),
+		]
+	)
+
+	def __init__(
+		self,
+		llm: BaseChatModel,
+		max_tokens: int = 1000,
+		min_recent: int = 2,
+		token_counter: Callable[[BaseMessage], int] = count_tokens,
+	):
+		self.llm = llm
+		self.max_tokens = max_tokens
+		self.min_recent = min_recent
+		self.token_counter = token_counter
+		self.lock = threading.Lock()
+		self.all_messages: List[BaseMessage] = []
+		self.token_counts: List[int] = []
+		self.summary = ""
+		self.summary_tokens = 0
+		# Number of leading messages of all_messages folded into the summary
+		self.summarized = 0
+		# Number of leading messages of all_messages added by restore
+		self.restored = 0
+		self.summarizing = False
+		# Bumped by clear, a summary of a cleared history is dropped
+		self.generation = 0
+		self.last_tokens_saved = 0
+		self.tokens_saved = 0
+
+	@property
+	def messages(self) -> List[BaseMessage]:
+		with self.lock:
+			start = self.summarized
+			if start < self.restored:
+				# Restored messages can be a whole consultation, never send more than the budget of them
+				start = min(self._fit_start(), self.restored)
+			recent = self.all_messages[start:]
+			if not self.summary:
+				return list(recent)
+			return [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"), *recent]
+
+	def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+		with self.lock:
+			# The turn being stored was answered with the current summary
+			self.tokens_saved += self.last_tokens_saved
+			self.all_messages.extend(messages)
+			self.token_counts.extend(self.token_counter(message) for message in messages)
+			batch = self._next_batch()
+		if batch is not None:
+			threading.Thread(target=self._summarize, args=batch, name="history-summary", daemon=True).start()
+
+	def restore(self, messages: Sequence[BaseMessage]) -> None:
+		"""
+		Add messages of an earlier run and start summarizing those over the budget.
+
+		Parameters:
+		- messages (Sequence[BaseMessage]): Messages read back from a session store.
+		"""
+		with self.lock:
+			self.all_messages.extend(messages)
+			self.token_counts.extend(self.token_counter(message) for message in messages)
+			self.restored = len(self.all_messages)
+			batch = self._next_batch()
+		if batch is not None:
+			threading.Thread(target=self._summarize, args=batch, name="history-summary", daemon=True).start()
+
+	def _fit_start(self) -> int:
+		"""
+		Index of the oldest message of the most recent ones fitting `max_tokens`,
+		keeping at least `min_recent`. Called with the lock held.
+		"""
+		start = self.summarized
+		recent_tokens = sum(self.token_counts[start:])
+		while recent_tokens > self.max_tokens and len(self.all_messages) - start > self.min_recent:
+			recent_tokens -= self.token_counts[start]
+			start += 1
+		return start
+
+	def _next_batch(self) -> Optional[Tuple[int, int, str, List[BaseMessage]]]:
+		"""
+		Claim the messages that fell out of the budget, None when they all fit
+		or a summary is already being written. A batch holds about `max_tokens`
+		at most, the rest is claimed once it is summarized. Called with the lock held.
+		"""
+		if self.summarizing:
+			return None
+
+		end = self.summarized
+		fit_start = self._fit_start()
+		batch_tokens = 0
+		while end < fit_start and batch_tokens < self.max_tokens:
+			batch_tokens += self.token_counts[end]
+			end += 1
+
+		if end == self.summarized:
+			return None
+		self.summarizing = True
+		return self.generation, end, self.summary, self.all_messages[self.summarized:end]
+
+	def _summarize(self, generation: int, end: int, summary: str, messages: List[BaseMessage]) -> None:
+		while True:
+			# The LLM call runs without the lock, reads of the history never wait for it
+			try:
+				summary = self.llm.invoke(self.summary_prompt.format_messages(
+					summary=summary or "(empty)",
+					new_lines=get_buffer_string(messages),
+				)).content
+			except Exception as e:
+				# Keep the messages verbatim and try again on the next turn
+				if os.getenv("DEBUG") != None:
+					print(f"history summarization failed: {e}")
+				summary = None
+
+			with self.lock:
+				if generation != self.generation:
+					return
+				self.summarizing = False
+				if summary is None:
+					return
+				self.summary = summary
+				self.summary_tokens = self.token_counter(SystemMessage(content=summary))
+				self.summarized = end
+				self.last_tokens_saved = max(0, sum(self.token_counts[:end]) - self.summary_tokens)
+				# Messages still over the budget, e.g. a long restored conversation
+				batch = self._next_batch()
+			if batch is None:
+				return
+			generation, end, summary, messages = batch
+
+	def clear(self) -> None:
+		with self.lock:
+			self.all_messages = []
+			self.token_counts = []
+			self.summary = ""
+			self.summary_tokens = 0
+			self.summarized = 0
+			self.restored = 0
+			self.summarizing = False
+			self.generation += 1
+			self.last_tokens_saved = 0
+
+def get_session_history(
+	session_id: str,
+	store: Optional[SessionStore] = None,
+	history_factory: HistoryFactory = ChatMessageHistory,
+) -> BaseChatMessageHistory:
 	"""
-	Get the chat history for the given session ID from the Streamlit session state.
+	Get the chat history for the given session ID from a session store.
 
 	Parameters:
 	- session_id (str): The session ID to retrieve the chat history for.
+	- store (Optional[SessionStore]): Backend holding the histories, the Streamlit
+	  session state when None (only usable from the script thread).
+	- history_factory (HistoryFactory): Creates the history of a new session.
 
 	Returns:
 	- BaseChatMessageHistory: The chat message history instance.
 	"""
-	if session_id not in st.session_state.messages:
-		st.session_state.messages[session_id] = ChatMessageHistory()
-
-	return st.session_state.messages[session_id]
+	if store is None:
+		if "messages" not in st.session_state:
+			st.session_state.messages = {}
+		store = MemorySessionStore(st.session_state.messages)
 
+	with span("history_load"):
+		return store.get(session_id, history_factory)
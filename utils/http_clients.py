@@ -0,0 +1,40 @@
+import importlib.util
+import os
+import threading
+from typing import Dict, Tuple
+
+import httpx
+
+_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+_lock = threading.Lock()
+
+def _limits() -> httpx.Limits:
+	return httpx.Limits(
+		max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+		max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+		keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60)),
+	)
+
+def get_http_clients(provider: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+	"""
+	Return the connection-pooled HTTP clients shared by every LLM of a provider.
+
+	Clients keep connections alive between requests and sessions so only the
+	first request to a provider pays for TCP and TLS setup. HTTP/2 is used
+	when the `h2` package is installed. Pool limits are read from
+	HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE and HTTP_KEEPALIVE_EXPIRY.
+
+	Parameters:
+	- provider (str): Name of the provider, one pair of clients per name.
+
+	Returns:
+	- Tuple[httpx.Client, httpx.AsyncClient]: The sync and async clients.
+	"""
+	with _lock:
+		if provider not in _clients:
+			http2 = importlib.util.find_spec("h2") is not None
+			_clients[provider] = (
+				httpx.Client(http2=http2, limits=_limits()),
+				httpx.AsyncClient(http2=http2, limits=_limits()),
+			)
+		return _clients[provider]
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from typing import Iterable, Optional
+
+from langchain_core.documents import Document
+
+MANIFEST_NAME = "manifest.json"
+
+def document_id(doc: Document) -> str:
+	"""
+	Compute the stable id of a chunk from its content.
+
+	The id only depends on the text, so a chunk keeps its id when rows
+	are inserted or removed around it in the dataset.
+
+	Parameters:
+	- doc (Document): The chunk to hash.
+
+	Returns:
+	- str: Hex encoded sha256 of the chunk text.
+	"""
+	return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+def load_manifest(index_path: str) -> Optional[dict]:
+	"""
+	Load the manifest stored next to a FAISS index.
+
+	Parameters:
+	- index_path (str): FAISS index path.
+
+	Returns:
+	- Optional[dict]: The manifest, or None if the index has none.
+	"""
+	manifest_path = os.path.join(index_path, MANIFEST_NAME)
+	if not os.path.exists(manifest_path):
+		return None
+
+	with open(manifest_path, "r", encoding="utf-8") as file:
+		return json.load(file)
+
+def save_manifest(index_path: str, chunk_ids: Iterable[str], complete: bool) -> None:
+	"""
+	Atomically write the manifest of a FAISS index.
+
+	Parameters:
+	- index_path (str): FAISS index path.
+	- chunk_ids (Iterable[str]): Content hashes of every chunk stored in the index.
+	- complete (bool): Whether the build finished, False marks a checkpoint.
+	"""
+	os.makedirs(index_path, exist_ok=True)
+	manifest_path = os.path.join(index_path, MANIFEST_NAME)
+	tmp_path = manifest_path + ".tmp"
+
+	with open(tmp_path, "w", encoding="utf-8") as file:
+		json.dump({"complete": complete, "chunks": sorted(chunk_ids)}, file)
+	os.replace(tmp_path, manifest_path)
+
+def index_version(index_path: str) -> Optional[tuple]:
+	"""
+	Cheap fingerprint of the FAISS index on disk, changing whenever it is rewritten.
+
+	Parameters:
+	- index_path (str): FAISS index path.
+
+	Returns:
+	- Optional[tuple]: Modification time and size of the index file, None if there is no index.
+	"""
+	try:
+		stat = os.stat(os.path.join(index_path, "index.faiss"))
+	except FileNotFoundError:
+		return None
+	return (stat.st_mtime_ns, stat.st_size)
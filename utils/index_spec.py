@@ -0,0 +1,107 @@
+import re
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+@dataclass(frozen=True)
+class IndexSpec:
+	"""
+	Description of the FAISS index type backing the vector store.
+
+	`factory` is a FAISS `index_factory` string, for example `Flat`,
+	`IVF1024,Flat`, `HNSW32`, `IVF1024,PQ16` or `SQ8`. Search parameters
+	left as None keep the FAISS defaults.
+	"""
+	factory: str = "Flat"
+	nprobe: Optional[int] = None
+	ef_search: Optional[int] = None
+	train_size: int = 100_000
+	seed: int = 0
+
+	@classmethod
+	def parse(cls, text: str) -> "IndexSpec":
+		"""
+		Parse a spec written as `<factory>[;key=value...]`,
+		e.g. `IVF1024,SQ8;nprobe=16` or `HNSW32;ef_search=64`.
+
+		Parameters:
+		- text (str): The spec string.
+
+		Returns:
+		- IndexSpec: The parsed spec.
+
+		Raises:
+		- ValueError: If a parameter is unknown or not an integer.
+		"""
+		factory, *params = [part.strip() for part in text.split(";")]
+		spec = cls(factory=factory or "Flat")
+		for param in params:
+			key, _, value = param.partition("=")
+			key = key.strip()
+			if key not in ("nprobe", "ef_search", "train_size", "seed"):
+				raise ValueError(f"Unknown index parameter '{key}' in '{text}'")
+			spec = replace(spec, **{key: int(value)})
+		return spec
+
+	@property
+	def is_flat(self) -> bool:
+		return self.factory == "Flat"
+
+	@property
+	def slug(self) -> str:
+		"""
+		Folder name of the index built for this spec. Search parameters are
+		not part of it since they do not change what is stored.
+		"""
+		return re.sub(r"[^A-Za-z0-9]+", "_", self.factory).strip("_")
+
+def apply_search_params(index: faiss.Index, spec: IndexSpec) -> None:
+	"""
+	Set the search time parameters of the spec on a FAISS index.
+
+	Parameters:
+	- index (faiss.Index): The index to tune.
+	- spec (IndexSpec): The spec holding the parameters.
+	"""
+	params = faiss.ParameterSpace()
+	if spec.nprobe is not None:
+		params.set_index_parameter(index, "nprobe", spec.nprobe)
+	if spec.ef_search is not None:
+		params.set_index_parameter(index, "efSearch", spec.ef_search)
+
+def build_ann_index(base: FAISS, spec: IndexSpec) -> FAISS:
+	"""
+	Build an index of the given type from the vectors of a flat vector store.
+
+	Vectors are reconstructed from the flat index instead of being embedded
+	again, and the docstore and id mapping are shared with it since the
+	vectors keep their positions.
+
+	Parameters:
+	- base (FAISS): The flat vector store holding every vector.
+	- spec (IndexSpec): Type of the index to build.
+
+	Returns:
+	- FAISS: A vector store over the new index.
+	"""
+	vectors = base.index.reconstruct_n(0, base.index.ntotal)
+	index = faiss.index_factory(base.index.d, spec.factory, base.index.metric_type)
+
+	if not index.is_trained:
+		rng = np.random.default_rng(spec.seed)
+		size = min(spec.train_size, len(vectors))
+		index.train(vectors[rng.choice(len(vectors), size, replace=False)])
+
+	index.add(vectors)
+	apply_search_params(index, spec)
+
+	return FAISS(
+		base.embedding_function,
+		index,
+		base.docstore,
+		dict(base.index_to_docstore_id),
+		distance_strategy=base.distance_strategy,
+	)
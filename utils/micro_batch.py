@@ -0,0 +1,119 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+class MicroBatchEmbeddings(Embeddings):
+	"""
+	Embeddings wrapper running concurrent `embed_query` calls as one batch.
+
+	Queries go to a single worker thread. It takes the first waiting query,
+	collects more for up to `window` seconds or until `max_batch` are
+	waiting, embeds them with one `embed_documents` call and hands each
+	caller its own vector. Queries arriving during a forward pass are
+	picked up by the next one, so even with `window=0` a loaded server
+	batches its backlog, while a lone query waits at most `window`.
+
+	`embed_documents` calls are already batched and go straight to the
+	wrapped embeddings.
+	"""
+
+	def __init__(self, embeddings: Embeddings, window: float = 0.002, max_batch: int = 32):
+		self.embeddings = embeddings
+		self.window = window
+		self.max_batch = max_batch
+		self.requests: queue.SimpleQueue = queue.SimpleQueue()
+		self.lock = threading.Lock()
+		self.worker: Optional[threading.Thread] = None
+		self.batches = 0
+		self.queries = 0
+		self.largest_batch = 0
+
+	def _start(self) -> None:
+		with self.lock:
+			if self.worker is None:
+				self.worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+				self.worker.start()
+
+	def _collect(self) -> List[Tuple[str, Future]]:
+		batch = [self.requests.get()]
+		deadline = time.monotonic() + self.window
+		while len(batch) < self.max_batch:
+			timeout = deadline - time.monotonic()
+			try:
+				batch.append(self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait())
+			except queue.Empty:
+				break
+		return batch
+
+	def _run(self) -> None:
+		while True:
+			# Callers cancelled while waiting (timeouts, hedges) are dropped, their
+			# future can no longer take a result. Running ones cannot be cancelled
+			batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+			if not batch:
+				continue
+			try:
+				self._embed(batch)
+			except Exception as e:
+				# Never let the worker die, every later query would wait forever
+				for _, future in batch:
+					if not future.done():
+						future.set_exception(e)
+
+	def _embed(self, batch: List[Tuple[str, Future]]) -> None:
+		# The same question asked by several sessions is embedded once
+		texts = list(dict.fromkeys(text for text, _ in batch))
+		vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+
+		for text, future in batch:
+			future.set_result(vectors[text])
+		with self.lock:
+			self.batches += 1
+			self.queries += len(batch)
+			self.largest_batch = max(self.largest_batch, len(batch))
+
+	def submit(self, text: str) -> Future:
+		"""
+		Queue a query for the next batch.
+
+		Parameters:
+		- text (str): The query.
+
+		Returns:
+		- Future: Resolves to the query vector.
+		"""
+		if self.worker is None:
+			self._start()
+		future: Future = Future()
+		self.requests.put((text, future))
+		return future
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		return self.embeddings.embed_documents(texts)
+
+	def embed_query(self, text: str) -> List[float]:
+		return self.submit(text).result()
+
+	async def aembed_query(self, text: str) -> List[float]:
+		# Wait on the loop instead of holding an executor thread
+		return await asyncio.wrap_future(self.submit(text))
+
+	def stats(self) -> Dict[str, float]:
+		"""
+		Return the batching counters.
+
+		Returns:
+		- Dict[str, float]: Batches run, queries embedded, mean and largest batch size.
+		"""
+		with self.lock:
+			return {
+				"batches": self.batches,
+				"queries": self.queries,
+				"mean_batch": self.queries / self.batches if self.batches else 0.0,
+				"largest_batch": self.largest_batch,
+			}
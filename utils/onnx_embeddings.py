@@ -0,0 +1,228 @@
+import json
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ONNX_DIR = "onnx_models"
+MODEL_FILE = "model.onnx"
+# Settings of the sentence-transformers pipeline done in numpy, written with the export
+CONFIG_FILE = "embedding.json"
+
+def onnx_model_path(model_name: str, quantize: bool = True, root: str = ONNX_DIR) -> str:
+	"""
+	Return the folder of the ONNX export of a model.
+
+	Parameters:
+	- model_name (str): Hugging Face name of the sentence-transformers model.
+	- quantize (bool): The int8 export instead of the float one.
+	- root (str): Folder holding every export.
+
+	Returns:
+	- str: Folder with the model file and its tokenizer.
+	"""
+	return os.path.join(root, model_name.replace("/", "--") + ("-int8" if quantize else ""))
+
+def export_onnx_model(model_name: str, path: str, quantize: bool = True, max_length: int = 256) -> str:
+	"""
+	Export the transformer of a sentence-transformers model to ONNX, optionally int8-quantized.
+
+	Only the transformer is exported, pooling and normalization are done by
+	`OnnxEmbeddings` in numpy. Whether the model normalizes its vectors is
+	recorded next to the export, so both backends agree in scale. Needs
+	torch and sentence-transformers for the export and onnxruntime for
+	quantization.
+
+	Parameters:
+	- model_name (str): Hugging Face name of the model.
+	- path (str): Destination folder.
+	- quantize (bool): Quantize the weights to int8 (dynamic quantization).
+	- max_length (int): Longest sequence the export is traced with.
+
+	Returns:
+	- str: Path of the exported model file.
+	"""
+	import torch
+	from sentence_transformers import SentenceTransformer
+	from sentence_transformers.models import Normalize
+
+	os.makedirs(path, exist_ok=True)
+	pipeline = SentenceTransformer(model_name, device="cpu")
+	tokenizer = pipeline.tokenizer
+	model = pipeline[0].auto_model.eval()
+	tokenizer.save_pretrained(path)
+	with open(os.path.join(path, CONFIG_FILE), "w", encoding="utf-8") as file:
+		json.dump({"normalize": any(isinstance(module, Normalize) for module in pipeline)}, file)
+
+	sample = tokenizer(["an example sentence"], return_tensors="pt", max_length=max_length, truncation=True)
+	names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+	float_file = os.path.join(path, "model.float.onnx" if quantize else MODEL_FILE)
+
+	with torch.no_grad():
+		torch.onnx.export(
+			model,
+			tuple(sample[name] for name in names),
+			float_file,
+			input_names=names,
+			output_names=["last_hidden_state"],
+			dynamic_axes={name: {0: "batch", 1: "sequence"} for name in [*names, "last_hidden_state"]},
+			opset_version=14,
+		)
+
+	if not quantize:
+		return float_file
+
+	from onnxruntime.quantization import QuantType, quantize_dynamic
+
+	model_file = os.path.join(path, MODEL_FILE)
+	quantize_dynamic(float_file, model_file, weight_type=QuantType.QInt8)
+	os.remove(float_file)
+	return model_file
+
+class OnnxEmbeddings(Embeddings):
+	"""
+	Sentence-transformers embeddings computed with onnxruntime on CPU.
+
+	Produces the same mean-pooled vectors as the PyTorch model, L2-normalized
+	when the model has a Normalize layer, within the error of the export (see
+	`max_deviation`). Texts are sorted by length before batching so little
+	time goes into padding.
+	"""
+
+	def __init__(
+		self,
+		path: str,
+		threads: Optional[int] = None,
+		batch_size: int = 32,
+		max_length: int = 256,
+	):
+		import onnxruntime as ort
+		from tokenizers import Tokenizer
+
+		options = ort.SessionOptions()
+		options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+		if threads:
+			options.intra_op_num_threads = threads
+			options.inter_op_num_threads = 1
+
+		self.session = ort.InferenceSession(
+			os.path.join(path, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+		)
+		self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+		self.batch_size = batch_size
+
+		# Exports of earlier versions have no config and were always normalized
+		config_path = os.path.join(path, CONFIG_FILE)
+		self.normalize = True
+		if os.path.exists(config_path):
+			with open(config_path, "r", encoding="utf-8") as file:
+				self.normalize = json.load(file)["normalize"]
+
+		self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+		self.tokenizer.enable_truncation(max_length)
+		self.tokenizer.enable_padding()
+
+	def _embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+		encodings = self.tokenizer.encode_batch(list(texts))
+		mask = np.asarray([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+		inputs = {
+			"input_ids": np.asarray([encoding.ids for encoding in encodings], dtype=np.int64),
+			"attention_mask": mask,
+			"token_type_ids": np.asarray([encoding.type_ids for encoding in encodings], dtype=np.int64),
+		}
+		hidden = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+
+		weights = mask[:, :, None].astype(np.float32)
+		pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+		if not self.normalize:
+			return pooled
+		return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		if not texts:
+			return []
+
+		order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+		vectors = np.empty((len(texts), 0), dtype=np.float32)
+		for start in range(0, len(texts), self.batch_size):
+			batch = order[start:start + self.batch_size]
+			embedded = self._embed_batch([texts[i] for i in batch])
+			if vectors.shape[1] == 0:
+				vectors = np.empty((len(texts), embedded.shape[1]), dtype=np.float32)
+			vectors[batch] = embedded
+		return vectors.tolist()
+
+	def embed_query(self, text: str) -> List[float]:
+		return self.embed_documents([text])[0]
+
+def max_deviation(embeddings: Embeddings, reference: Embeddings, texts: List[str]) -> float:
+	"""
+	Return the largest L2 distance between the vectors of two embedding functions,
+	relative to the length of the reference vector.
+
+	Unlike a cosine distance it also catches vectors differing in scale, which
+	would break an L2 index. For unit vectors it is sqrt(2 * cosine distance).
+
+	Parameters:
+	- embeddings (Embeddings): The embedding function checked.
+	- reference (Embeddings): The one the index was built with.
+	- texts (List[str]): Texts to compare on.
+
+	Returns:
+	- float: The largest relative L2 distance over the texts.
+	"""
+	a = np.asarray(embeddings.embed_documents(texts))
+	b = np.asarray(reference.embed_documents(texts))
+	return float((np.linalg.norm(a - b, axis=1) / np.linalg.norm(b, axis=1)).max())
+
+def load_or_export_onnx(
+	model_name: str,
+	quantize: bool = True,
+	tolerance: float = 0.15,
+	reference: Optional[Embeddings] = None,
+	check_texts: Optional[List[str]] = None,
+) -> str:
+	"""
+	Return the folder of the ONNX export of a model, exporting it first if needed.
+
+	A new export is compared with the PyTorch model on `check_texts` and
+	rejected when a vector deviates by more than `tolerance` in relative L2
+	distance, since vectors of the index were computed with PyTorch.
+
+	Parameters:
+	- model_name (str): Hugging Face name of the model.
+	- quantize (bool): Use the int8 export.
+	- tolerance (float): Largest relative L2 distance to the PyTorch vectors accepted
+	  (0.15 is a cosine distance of about 0.011 for unit vectors).
+	- reference (Optional[Embeddings]): The PyTorch embedding function, loaded when None.
+	- check_texts (Optional[List[str]]): Texts compared, a few medical questions when None.
+
+	Returns:
+	- str: The export folder.
+	"""
+	path = onnx_model_path(model_name, quantize)
+	if os.path.exists(os.path.join(path, MODEL_FILE)):
+		return path
+
+	print(f"Exporting {model_name} to {path}")
+	export_onnx_model(model_name, path, quantize)
+
+	if reference is None:
+		from langchain_huggingface import HuggingFaceEmbeddings
+		reference = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": "cpu"})
+	check_texts = check_texts or [
+		"What are the symptoms of the flu?",
+		"Can I take ibuprofen while pregnant?",
+		"How long does it take to recover from a broken wrist and when can I drive again?",
+		"Q: Is high blood pressure hereditary?\nA: Yes, it can run in families, but lifestyle matters too.",
+	]
+
+	deviation = max_deviation(OnnxEmbeddings(path), reference, check_texts)
+	print(f"ONNX export deviates by at most {deviation:.5f} in relative L2 distance")
+	if deviation > tolerance:
+		os.remove(os.path.join(path, MODEL_FILE))
+		raise ValueError(
+			f"ONNX export of {model_name} deviates by {deviation:.5f} from PyTorch, over the tolerance of {tolerance}"
+		)
+	return path
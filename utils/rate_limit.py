@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+class TokenBucket:
+	"""
+	Async token bucket allowing `rate` acquisitions per second on average,
+	with bursts of up to `capacity`.
+
+	Waiters are served in arrival order, so a burst of requests is spread
+	evenly over time instead of stampeding when tokens come back.
+	"""
+
+	def __init__(self, rate: float, capacity: Optional[float] = None):
+		self.rate = rate
+		self.capacity = capacity if capacity is not None else max(1.0, rate)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self.lock = asyncio.Lock()
+
+	def _refill(self) -> None:
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	async def acquire(self, tokens: float = 1.0) -> None:
+		"""
+		Wait until `tokens` are available and take them.
+
+		Parameters:
+		- tokens (float): Number of tokens taken, e.g. 1 per request.
+		"""
+		async with self.lock:
+			self._refill()
+			if self.tokens < tokens:
+				await asyncio.sleep((tokens - self.tokens) / self.rate)
+				self._refill()
+			self.tokens -= tokens
+
+async def retry_with_backoff(
+	call: Callable[[], Awaitable[T]],
+	retries: int = 5,
+	base_delay: float = 1.0,
+	max_delay: float = 60.0,
+) -> Tuple[T, int]:
+	"""
+	Await `call`, retrying failures with exponential backoff and full jitter.
+
+	Parameters:
+	- call (Callable[[], Awaitable[T]]): Starts one attempt.
+	- retries (int): Retries after the first attempt.
+	- base_delay (float): Upper bound of the first delay, in seconds.
+	- max_delay (float): Upper bound of any delay, in seconds.
+
+	Returns:
+	- Tuple[T, int]: The result and the number of attempts it took.
+	"""
+	for attempt in range(retries + 1):
+		try:
+			return await call(), attempt + 1
+		except Exception:
+			if attempt == retries:
+				raise
+			await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+class Overloaded(Exception):
+	"""
+	Raised when a request arrives while every slot and every queue place is taken.
+	"""
+
+class ConcurrencyLimiter:
+	"""
+	Async limit of `max_active` requests running at once, with at most
+	`max_waiting` more queued for a slot.
+
+	Requests beyond the queue are rejected right away with `Overloaded`
+	instead of piling up, so a server under load answers "busy" quickly
+	and the requests it accepts keep a bounded latency.
+	"""
+
+	def __init__(self, max_active: int, max_waiting: int = 0):
+		self.max_active = max_active
+		self.max_waiting = max_waiting
+		self.semaphore = asyncio.Semaphore(max_active)
+		self.active = 0
+		self.waiting = 0
+		self.rejected = 0
+
+	@asynccontextmanager
+	async def slot(self) -> AsyncIterator[None]:
+		"""
+		Hold a slot for the body, waiting in the queue if none is free.
+
+		Raises:
+		- Overloaded: If no slot is free and the queue is full.
+		"""
+		if self.semaphore.locked() and self.waiting >= self.max_waiting:
+			self.rejected += 1
+			raise Overloaded(f"{self.active} requests running and {self.waiting} waiting")
+
+		self.waiting += 1
+		try:
+			await self.semaphore.acquire()
+		finally:
+			self.waiting -= 1
+
+		self.active += 1
+		try:
+			yield
+		finally:
+			self.active -= 1
+			self.semaphore.release()
+
+	def stats(self) -> Dict[str, int]:
+		"""
+		Return the limiter counters.
+
+		Returns:
+		- Dict[str, int]: Running, waiting and rejected requests and the limits.
+		"""
+		return {
+			"active": self.active,
+			"waiting": self.waiting,
+			"rejected": self.rejected,
+			"max_active": self.max_active,
+			"max_waiting": self.max_waiting,
+		}
@@ -1,26 +1,74 @@
 import os
+from typing import Optional
 
 from langchain import chains
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 
+from utils.embedding_cache import CachedEmbeddings
+from utils.micro_batch import MicroBatchEmbeddings
+from utils.onnx_embeddings import OnnxEmbeddings, load_or_export_onnx
+
 def create_embedding_function(
 	model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
 	device: str = "cpu",
-) -> HuggingFaceEmbeddings:
+	batch_size: int = 32,
+	cache_size: int = 0,
+	cache_path: Optional[str] = None,
+	backend: str = "torch",
+	threads: Optional[int] = None,
+	quantize: bool = True,
+	max_batch: int = 1,
+	batch_window: float = 0.002,
+) -> Embeddings:
 	"""
 	Create the embedding function used with the FAISS index.
 
 	Parameters:
 	- model_name (str): Model name for embedding 
 	- device (str): device type for model
+	- batch_size (int): Number of texts per forward pass when embedding documents
+	- cache_size (int): Number of vectors kept in an in-memory LRU cache, 0 disables it
+	- cache_path (Optional[str]): SQLite file persisting the cache across processes
+	- backend (str): "torch" for sentence-transformers, "onnx" for onnxruntime on CPU (see `utils.onnx_embeddings`)
+	- threads (Optional[int]): Intra-op threads of the onnx backend, onnxruntime's default when None
+	- quantize (bool): Use the int8 model with the onnx backend
+	- max_batch (int): Concurrent queries embedded in one forward pass, 1 disables micro-batching (see `MicroBatchEmbeddings`)
+	- batch_window (float): Seconds a query waits for others to batch with
 
 	Returns:
-	- HuggingFaceEmbeddings: The embedding function instance.
+	- Embeddings: The embedding function instance, wrapped in `CachedEmbeddings` when caching.
 	"""
-	return HuggingFaceEmbeddings(
-		model_name=model_name,
-		model_kwargs={'device': device},
-		encode_kwargs={'normalize_embeddings': False},
-	)
+	match backend:
+		case "torch":
+			namespace = model_name
+			embeddings = HuggingFaceEmbeddings(
+				model_name=model_name,
+				model_kwargs={'device': device},
+				encode_kwargs={'normalize_embeddings': False, 'batch_size': batch_size},
+			)
+		case "onnx":
+			# Vectors differ slightly from PyTorch ones, never share cached vectors with them
+			namespace = f"{model_name}:onnx{'-int8' if quantize else ''}"
+			embeddings = OnnxEmbeddings(
+				load_or_export_onnx(model_name, quantize),
+				threads=threads,
+				batch_size=batch_size,
+			)
+		case _:
+			raise NotImplementedError(f"Unknown embedding backend '{backend}'")
+
+	if max_batch > 1:
+		# Below the cache, so only cache misses wait for a batch
+		embeddings = MicroBatchEmbeddings(embeddings, window=batch_window, max_batch=max_batch)
+
+	if cache_size > 0 or cache_path is not None:
+		embeddings = CachedEmbeddings(
+			embeddings,
+			namespace=namespace,
+			max_size=cache_size,
+			cache_path=cache_path,
+		)
+	return embeddings
@@ -0,0 +1,329 @@
+import abc
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+HistoryFactory = Callable[[], BaseChatMessageHistory]
+
+# Used when SESSION_SECRET is not set, IDs then only verify in this process
+_PROCESS_SECRET = secrets.token_bytes(32)
+_SESSION_UUID = re.compile(r"^[0-9a-f]{32}$")
+
+def _sign(value: str) -> str:
+	secret = os.getenv("SESSION_SECRET")
+	key = secret.encode("utf-8") if secret else _PROCESS_SECRET
+	return hmac.new(key, value.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def issue_session_id() -> str:
+	"""
+	Create a new session ID signed with SESSION_SECRET.
+
+	The ID is a random uuid4 followed by its HMAC, so only IDs issued by a
+	replica sharing the secret verify, and a visitor cannot pick one.
+
+	Returns:
+	- str: The signed session ID, `<uuid4 hex>.<hmac hex>`.
+	"""
+	session_id = uuid.uuid4().hex
+	return f"{session_id}.{_sign(session_id)}"
+
+def verify_session_id(session_id: Optional[str]) -> bool:
+	"""
+	Check that a session ID was issued by `issue_session_id`.
+
+	Parameters:
+	- session_id (Optional[str]): The ID to check, e.g. read from a URL.
+
+	Returns:
+	- bool: Whether the ID is well formed and its signature matches.
+	"""
+	if not session_id:
+		return False
+	value, _, signature = session_id.partition(".")
+	return bool(_SESSION_UUID.match(value)) and hmac.compare_digest(signature, _sign(value))
+
+class SessionStore(abc.ABC):
+	"""
+	Backend holding the chat history of every session.
+	"""
+
+	@abc.abstractmethod
+	def get(self, session_id: str, history_factory: HistoryFactory) -> BaseChatMessageHistory:
+		"""
+		Return the history of a session, creating it with `history_factory` if needed.
+
+		Parameters:
+		- session_id (str): The session ID.
+		- history_factory (HistoryFactory): Creates the in-memory history of a session.
+
+		Returns:
+		- BaseChatMessageHistory: The chat message history instance.
+		"""
+
+	@abc.abstractmethod
+	def messages(self, session_id: str) -> Optional[List[BaseMessage]]:
+		"""
+		Return every message of a session without creating it.
+
+		Parameters:
+		- session_id (str): The session ID.
+
+		Returns:
+		- Optional[List[BaseMessage]]: The messages, summarized ones included, None for an unknown session.
+		"""
+
+class MemorySessionStore(SessionStore):
+	"""
+	Keep histories in a dict, lost when the process exits.
+	"""
+
+	def __init__(self, histories: Optional[Dict[str, BaseChatMessageHistory]] = None):
+		self.histories = histories if histories is not None else {}
+
+	def get(self, session_id: str, history_factory: HistoryFactory) -> BaseChatMessageHistory:
+		if session_id not in self.histories:
+			self.histories[session_id] = history_factory()
+		return self.histories[session_id]
+
+	def messages(self, session_id: str) -> Optional[List[BaseMessage]]:
+		history = self.histories.get(session_id)
+		if history is None:
+			return None
+		return getattr(history, "all_messages", history.messages)
+
+class PersistentHistory(BaseChatMessageHistory):
+	"""
+	History delegating to an in-memory history and appending new messages to a store.
+	"""
+
+	def __init__(self, store: "SQLiteSessionStore", session_id: str, inner: BaseChatMessageHistory):
+		self.store = store
+		self.session_id = session_id
+		self.inner = inner
+		self.ids: Set[str] = set()
+		self.last_rowid = 0
+		self.last_access = time.time()
+
+	@property
+	def messages(self) -> List[BaseMessage]:
+		return self.inner.messages
+
+	@property
+	def all_messages(self) -> List[BaseMessage]:
+		return getattr(self.inner, "all_messages", self.inner.messages)
+
+	def restore(self, rows: Sequence[Tuple[int, str, BaseMessage]]) -> None:
+		"""
+		Add messages read back from the store, skipping the ones already known.
+		"""
+		new = [message for rowid, msg_id, message in rows if msg_id not in self.ids]
+		self.ids.update(msg_id for _, msg_id, _ in rows)
+		self.last_rowid = max([self.last_rowid, *(rowid for rowid, _, _ in rows)])
+		if new:
+			# Restored messages must not trigger work such as summarization
+			getattr(self.inner, "restore", self.inner.add_messages)(new)
+
+	def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+		ids = [uuid.uuid4().hex for _ in messages]
+		self.ids.update(ids)
+		self.inner.add_messages(messages)
+		self.store.append(self.session_id, list(zip(ids, messages)))
+
+	def clear(self) -> None:
+		self.inner.clear()
+		self.ids.clear()
+		self.store.delete(self.session_id)
+
+class SQLiteSessionStore(SessionStore):
+	"""
+	Persist histories in an append-only SQLite table shared by every process.
+
+	Hot sessions are kept in an LRU of `max_sessions` histories and loaded
+	lazily on a miss. On every access only the messages appended since, e.g.
+	by another replica, are read. Writes are queued and flushed by a
+	background thread in one transaction every `flush_interval` seconds, so
+	a turn never waits for the disk. Sessions idle for more than `ttl`
+	seconds are deleted.
+	"""
+
+	def __init__(
+		self,
+		path: str = "sessions.db",
+		max_sessions: int = 1000,
+		ttl: float = 7 * 24 * 3600,
+		flush_interval: float = 0.2,
+		max_batch: int = 500,
+	):
+		self.path = path
+		self.max_sessions = max_sessions
+		self.ttl = ttl
+		self.flush_interval = flush_interval
+		self.max_batch = max_batch
+		self.lock = threading.Lock()
+		self.histories: OrderedDict = OrderedDict()
+		self.pending: queue.Queue = queue.Queue()
+		self.last_expiry = 0.0
+
+		self.db = self._connect()
+		self.db.executescript(
+			"CREATE TABLE IF NOT EXISTS messages ("
+			" session_id TEXT NOT NULL, msg_id TEXT NOT NULL UNIQUE, created REAL NOT NULL, data TEXT NOT NULL);"
+			"CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id);"
+			"CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_active REAL NOT NULL);"
+			"CREATE INDEX IF NOT EXISTS sessions_active ON sessions (last_active);"
+		)
+		self.db.commit()
+
+		self.stopped = threading.Event()
+		self.writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+		self.writer.start()
+		atexit.register(self.close)
+
+	def _connect(self) -> sqlite3.Connection:
+		db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+		db.execute("PRAGMA journal_mode=WAL")
+		db.execute("PRAGMA synchronous=NORMAL")
+		return db
+
+	def _read(self, session_id: str, after: int) -> List[Tuple[int, str, BaseMessage]]:
+		with self.lock:
+			rows = self.db.execute(
+				"SELECT rowid, msg_id, data FROM messages WHERE session_id = ? AND rowid > ? ORDER BY rowid",
+				(session_id, after),
+			).fetchall()
+		return [
+			(rowid, msg_id, messages_from_dict([json.loads(data)])[0])
+			for rowid, msg_id, data in rows
+		]
+
+	def get(self, session_id: str, history_factory: HistoryFactory) -> BaseChatMessageHistory:
+		with self.lock:
+			history = self.histories.get(session_id)
+			if history is not None:
+				self.histories.move_to_end(session_id)
+			else:
+				history = PersistentHistory(self, session_id, history_factory())
+				self.histories[session_id] = history
+				while len(self.histories) > self.max_sessions:
+					self.histories.popitem(last=False)
+
+		history.restore(self._read(session_id, history.last_rowid))
+		history.last_access = time.time()
+		return history
+
+	def messages(self, session_id: str) -> Optional[List[BaseMessage]]:
+		with self.lock:
+			history = self.histories.get(session_id)
+		if history is None:
+			# Not loaded into the LRU, a read must not evict a hot session
+			rows = self._read(session_id, 0)
+			return [message for _, _, message in rows] if rows else None
+		history.restore(self._read(session_id, history.last_rowid))
+		return history.all_messages
+
+	def append(self, session_id: str, messages: List[Tuple[str, BaseMessage]]) -> None:
+		"""
+		Queue messages of a session for the next batched write.
+
+		Parameters:
+		- session_id (str): The session ID.
+		- messages (List[Tuple[str, BaseMessage]]): Messages with their unique IDs.
+		"""
+		now = time.time()
+		for msg_id, message in messages:
+			self.pending.put((session_id, msg_id, now, json.dumps(message_to_dict(message))))
+
+	def delete(self, session_id: str) -> None:
+		self.flush()
+		with self.lock:
+			self.histories.pop(session_id, None)
+			self.db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+			self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+			self.db.commit()
+
+	def flush(self) -> None:
+		"""
+		Write every queued message now.
+		"""
+		batch = []
+		while True:
+			try:
+				batch.append(self.pending.get_nowait())
+			except queue.Empty:
+				break
+			if len(batch) >= self.max_batch:
+				self._write(batch)
+				batch = []
+		if batch:
+			self._write(batch)
+
+	def _write(self, batch: List[Tuple[str, str, float, str]]) -> None:
+		last_active = {}
+		for session_id, _, created, _ in batch:
+			last_active[session_id] = max(created, last_active.get(session_id, 0.0))
+
+		try:
+			self._insert(batch, last_active)
+		except sqlite3.Error:
+			with self.lock:
+				self.db.rollback()
+			# Requeue so the messages go out with the next flush, inserts are idempotent
+			for item in batch:
+				self.pending.put(item)
+			raise
+
+	def _insert(self, batch: List[Tuple[str, str, float, str]], last_active: Dict[str, float]) -> None:
+		with self.lock:
+			self.db.executemany(
+				"INSERT OR IGNORE INTO messages (session_id, msg_id, created, data) VALUES (?, ?, ?, ?)",
+				batch,
+			)
+			self.db.executemany(
+				"INSERT INTO sessions (session_id, last_active) VALUES (?, ?) "
+				"ON CONFLICT (session_id) DO UPDATE SET last_active = max(last_active, excluded.last_active)",
+				list(last_active.items()),
+			)
+			self.db.commit()
+
+	def expire(self) -> None:
+		"""
+		Delete sessions idle for more than the TTL, on disk and in memory.
+		"""
+		cutoff = time.time() - self.ttl
+		with self.lock:
+			self.db.execute(
+				"DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_active < ?)",
+				(cutoff,),
+			)
+			self.db.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,))
+			self.db.commit()
+			for session_id in [s for s, h in self.histories.items() if h.last_access < cutoff]:
+				del self.histories[session_id]
+
+	def _write_loop(self) -> None:
+		while not self.stopped.wait(self.flush_interval):
+			try:
+				self.flush()
+				if time.time() - self.last_expiry > min(self.ttl, 3600):
+					self.last_expiry = time.time()
+					self.expire()
+			except sqlite3.Error as e:
+				print(f"session store write failed: {e}")
+
+	def close(self) -> None:
+		self.stopped.set()
+		self.flush()
@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import heapq
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from utils.index_manifest import index_version
+from utils.tracing import span
+
+SHARDS_PATH = "shards.json"
+
+@dataclass(frozen=True)
+class Shard:
+	"""
+	A named corpus with its own dataset and indexes, built and versioned on its own.
+
+	Shards are listed in `shards.json` by name, e.g.
+	`{"mashqa": {"dataset": "mashqa.parquet", "index": "faiss_index", "qa_index": "faiss_qa_index"},
+	"medquad": {"dataset": "medquad.parquet"}}`. Index paths default to
+	`shards/<name>/faiss_index` and `shards/<name>/faiss_qa_index`.
+	"""
+	name: str
+	dataset_path: str
+	index_path: str
+	qa_index_path: str
+
+	def path(self, qa: bool = False) -> str:
+		return self.qa_index_path if qa else self.index_path
+
+def load_shards(names: Optional[Sequence[str]] = None, path: str = SHARDS_PATH) -> List[Shard]:
+	"""
+	Read the shards listed in a shards file.
+
+	Parameters:
+	- names (Optional[Sequence[str]]): Shards to return, in this order, every shard of the file when None.
+	- path (str): The shards file.
+
+	Returns:
+	- List[Shard]: The shards.
+
+	Raises:
+	- ValueError: If a name is not in the file.
+	"""
+	with open(path, "r", encoding="utf-8") as file:
+		config = json.load(file)
+
+	shards = {
+		name: Shard(
+			name=name,
+			dataset_path=entry["dataset"],
+			index_path=entry.get("index", os.path.join("shards", name, "faiss_index")),
+			qa_index_path=entry.get("qa_index", os.path.join("shards", name, "faiss_qa_index")),
+		)
+		for name, entry in config.items()
+	}
+	if names is None:
+		return list(shards.values())
+
+	unknown = [name for name in names if name not in shards]
+	if unknown:
+		raise ValueError(f"Unknown shards {unknown} in {path}, known: {sorted(shards)}")
+	return [shards[name] for name in names]
+
+def shards_version(shards: Iterable[Shard], qa: bool = False) -> Optional[tuple]:
+	"""
+	Fingerprint of the indexes of several shards, changing whenever one is rewritten.
+
+	Parameters:
+	- shards (Iterable[Shard]): The shards served.
+	- qa (bool): Fingerprint the question-keyed indexes.
+
+	Returns:
+	- Optional[tuple]: Name and `index_version` of every shard.
+	"""
+	return tuple((shard.name, index_version(shard.path(qa))) for shard in shards)
+
+class ShardedVectorStore(VectorStore):
+	"""
+	Read-only vector store searching several shard indexes as one.
+
+	The query is embedded once, then every shard is searched for its own top
+	k in parallel on a thread pool (FAISS releases the GIL while searching),
+	so latency follows the slowest shard rather than the sum of all of them.
+	The per-shard results are merged into one ranked list. Scores compare
+	across shards because every shard is embedded with the same model and
+	searched with the same metric. Every returned document carries the name
+	of its shard in `metadata["shard"]`, next to its `source` and `id`.
+	"""
+
+	def __init__(self, shards: Dict[str, FAISS], embedding_function: Embeddings, max_workers: Optional[int] = None):
+		strategies = {store.distance_strategy for store in shards.values()}
+		if len(strategies) > 1:
+			raise ValueError(f"Shards use different distance strategies: {strategies}")
+
+		self.shards = shards
+		self.embedding_function = embedding_function
+		self.higher_is_better = strategies == {DistanceStrategy.MAX_INNER_PRODUCT}
+		self.executor = ThreadPoolExecutor(max_workers or len(shards), thread_name_prefix="shard-search")
+
+	@property
+	def embeddings(self) -> Embeddings:
+		return self.embedding_function
+
+	def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+		raise NotImplementedError("Shards are built one at a time, see `index_data.py --shard`")
+
+	@classmethod
+	def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "ShardedVectorStore":
+		raise NotImplementedError("Shards are built one at a time, see `index_data.py --shard`")
+
+	def _search_shard(self, name: str, embedding: List[float], k: int, kwargs: Dict[str, Any]) -> List[Tuple[Document, float]]:
+		return [
+			(Document(page_content=doc.page_content, metadata={**doc.metadata, "shard": name}), score)
+			for doc, score in self.shards[name].similarity_search_with_score_by_vector(embedding, k, **kwargs)
+		]
+
+	def _fan_out(self, embedding: List[float], k: int, kwargs: Dict[str, Any]) -> List[Future]:
+		# Each search runs in a copy of the caller's context, so its spans land in the current trace
+		return [
+			self.executor.submit(contextvars.copy_context().run, self._search_shard, name, embedding, k, kwargs)
+			for name in self.shards
+		]
+
+	def _merge(self, results: List[List[Tuple[Document, float]]], k: int) -> List[Tuple[Document, float]]:
+		candidates = [pair for shard_results in results for pair in shard_results]
+		if self.higher_is_better:
+			return heapq.nlargest(k, candidates, key=itemgetter(1))
+		return heapq.nsmallest(k, candidates, key=itemgetter(1))
+
+	def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+		with span("shard_search", shards=len(self.shards), k=k):
+			return self._merge([future.result() for future in self._fan_out(embedding, k, kwargs)], k)
+
+	def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+		with span("query_embedding"):
+			embedding = self.embedding_function.embed_query(query)
+		return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+	def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+		return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+	async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+		with span("query_embedding"):
+			embedding = await self.embedding_function.aembed_query(query)
+		with span("shard_search", shards=len(self.shards), k=k):
+			futures = self._fan_out(embedding, k, kwargs)
+			return self._merge(await asyncio.gather(*(asyncio.wrap_future(future) for future in futures)), k)
+
+	async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+		return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)]
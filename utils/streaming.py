@@ -0,0 +1,149 @@
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+_DONE = object()
+
+def res_generator(stream: Iterable[Dict[str, Any]], key: str = "answer") -> Iterator[str]:
+	"""
+	Pick the text chunks for one output key out of a chain stream.
+
+	Parameters:
+	- stream (Iterable[Dict[str, Any]]): Chunks produced by `Runnable.stream`.
+	- key (str): Output key holding the generated text.
+
+	Returns:
+	- Iterator[str]: The non-empty text chunks of that key.
+	"""
+	for chunk in stream:
+		if answer_chunk := chunk.get(key):
+			yield answer_chunk
+
+class StreamTimer:
+	"""
+	Wrap a stream of text chunks and record time-to-first-token and total time.
+
+	The clock starts when the timer is created, so create it right before
+	the request is sent.
+	"""
+
+	def __init__(self, stream: Iterable[str]):
+		self.stream = stream
+		self.start = time.perf_counter()
+		self.ttft: Optional[float] = None
+		self.total: Optional[float] = None
+		self.chunks = 0
+
+	def __iter__(self) -> Iterator[str]:
+		for chunk in self.stream:
+			if self.ttft is None:
+				self.ttft = time.perf_counter() - self.start
+			self.chunks += 1
+			yield chunk
+		self.total = time.perf_counter() - self.start
+
+	def report(self) -> str:
+		"""
+		Format the recorded timings for display.
+
+		Returns:
+		- str: A short human readable summary.
+		"""
+		ttft = f"{self.ttft:.2f}s" if self.ttft is not None else "n/a"
+		total = f"{self.total:.2f}s" if self.total is not None else "n/a"
+		return f"first token {ttft}, total {total}, {self.chunks} chunks"
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+	"""
+	Callback handler forwarding only the tokens after the ReAct
+	"Final Answer:" marker to a queue.
+
+	Every LLM call of the agent resets the buffer, so thoughts and
+	actions of earlier iterations are never forwarded.
+	"""
+
+	# Only puts on a thread safe queue, no need for an executor in async runs
+	run_inline = True
+
+	def __init__(self, out: queue.Queue, answer_prefix: str = "Final Answer:"):
+		self.out = out
+		self.answer_prefix = answer_prefix
+		self.buffer = ""
+		self.streaming = False
+		self.streamed = False
+
+	def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+		self.buffer = ""
+		self.streaming = False
+
+	def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+		if self.streaming:
+			self.out.put(token)
+			return
+
+		self.buffer += token
+		if self.answer_prefix in self.buffer:
+			self.streaming = True
+			self.streamed = True
+			rest = self.buffer.split(self.answer_prefix, 1)[1].lstrip()
+			if rest:
+				self.out.put(rest)
+
+class AgentStream:
+	"""
+	Run an agent runnable in a background thread and expose its final
+	answer tokens as an iterator.
+
+	The full result of the run is available in `result` once the
+	iterator is exhausted. When the model never emitted a streamable
+	final answer (e.g. after a parsing error) the final output is
+	yielded in one piece instead.
+	"""
+
+	def __init__(
+		self,
+		invoke: Callable[..., Dict[str, Any]],
+		inp: Dict[str, Any],
+		config: Optional[Dict[str, Any]] = None,
+		output_key: str = "output",
+	):
+		self.invoke = invoke
+		self.inp = inp
+		self.config = dict(config or {})
+		self.output_key = output_key
+		self.result: Optional[Dict[str, Any]] = None
+		self.error: Optional[BaseException] = None
+
+	def _run(self, out: queue.Queue) -> None:
+		try:
+			self.result = self.invoke(self.inp, config=self.config)
+		except BaseException as e:
+			self.error = e
+		finally:
+			out.put(_DONE)
+
+	def __iter__(self) -> Iterator[str]:
+		out: queue.Queue = queue.Queue()
+		handler = FinalAnswerStreamHandler(out)
+		self.config["callbacks"] = [*self.config.get("callbacks", []), handler]
+
+		# Carry the current trace over to the run
+		context = contextvars.copy_context()
+		thread = threading.Thread(target=context.run, args=(self._run, out), daemon=True)
+		# history lookups go through st.session_state, which needs the script context
+		add_script_run_ctx(thread)
+		thread.start()
+
+		while (token := out.get()) is not _DONE:
+			yield token
+		thread.join()
+
+		if self.error is not None:
+			raise self.error
+		if not handler.streamed and self.result is not None:
+			yield self.result[self.output_key]
@@ -1,19 +1,177 @@
 from streamlit import cache_resource, cache_data
 
 from utils.retriever import create_embedding_function
+from utils.answer_cache import AnswerCache
 from utils.debug import log_time
+from utils.index_spec import IndexSpec
+from utils.session_store import SessionStore, SQLiteSessionStore, MemorySessionStore
+from utils.tracing import traced_vectorstore
+from utils.index_manifest import index_version
+from utils.shards import SHARDS_PATH, Shard, ShardedVectorStore, load_shards, shards_version
 
+from chain_history import SpeculationStats
 from openrouter import ChatOpenRouter
-from runpod import ChatRunpod
-from retriever import create_or_load_vectorstore, create_qa_chain, create_qa_tool, create_prompt_react_agent
+from runpod import ChatRunpod, start_keep_warm
+from router import ChatRouter
+from retriever import INDEX_PATH, QA_INDEX_PATH, PackedRetriever, QAPairRetriever, create_or_load_vectorstore, create_qa_chain, create_qa_tool, create_prompt_react_agent, create_rag_chain
+from utils.history import get_session_history, SummaryBufferHistory
 
 from langchain_openai import ChatOpenAI
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_community.chat_message_histories import ChatMessageHistory
 
 import os
+import time
+from functools import partial
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+if TYPE_CHECKING:
+	# Imported when the agent is used, see get_agent_stats
+	from utils.agent_guard import AgentStats
+
+@cache_resource
+def get_embedding_function() -> Embeddings:
+	"""
+	Create and return the embedding function shared by the retriever and the caches.
+
+	Query embeddings are cached in an LRU of EMBEDDING_CACHE_SIZE entries
+	(default 1024) and, if EMBEDDING_CACHE_PATH is set, in a SQLite file
+	shared by every Streamlit process.
+
+	EMBEDDING_BACKEND selects "torch" (default) or "onnx", which runs the
+	model with onnxruntime, int8-quantized unless EMBEDDING_QUANTIZE is 0,
+	on EMBEDDING_THREADS intra-op threads. EMBEDDING_BATCH_SIZE (default 32)
+	applies to both.
+
+	Concurrent queries of all sessions are embedded together, up to
+	EMBEDDING_MAX_BATCH per forward pass (default 32, 1 disables it), each
+	waiting at most EMBEDDING_BATCH_WINDOW_MS (default 2) for others.
+
+	Returns:
+		embedding_function: The embedding function instance.
+	"""
+	threads = int(os.getenv("EMBEDDING_THREADS", 0))
+	return create_embedding_function(
+		batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 32)),
+		cache_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 1024)),
+		cache_path=os.getenv("EMBEDDING_CACHE_PATH"),
+		backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+		threads=threads or None,
+		quantize=os.getenv("EMBEDDING_QUANTIZE", "1") != "0",
+		max_batch=int(os.getenv("EMBEDDING_MAX_BATCH", 32)),
+		batch_window=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 2)) / 1000,
+	)
+
+@cache_resource
+def get_answer_cache(llm_type: str, model_name: str) -> AnswerCache:
+	"""
+	Create and return the semantic answer cache of one LLM.
+
+	Answers are only shared between sessions using the same provider and model.
+	The cache is configured with ANSWER_CACHE_THRESHOLD (cosine similarity,
+	default 0.95), ANSWER_CACHE_TTL (seconds, default 3600) and
+	ANSWER_CACHE_SIZE (entries, default 1024).
+
+	Args:
+		llm_type (str): The type of language model ('openrouter' or 'runpod').
+		model_name (str): The name of the model.
+
+	Returns:
+		answer_cache: The answer cache instance.
+	"""
+	return AnswerCache(
+		threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+		ttl=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+		max_size=int(os.getenv("ANSWER_CACHE_SIZE", 1024)),
+	)
+
+@cache_resource
+def get_speculation_stats() -> SpeculationStats:
+	"""
+	Create and return the speculative retrieval counters shared by every session.
+
+	Returns:
+		stats: The speculation counters.
+	"""
+	return SpeculationStats()
+
+@cache_resource
+def get_agent_stats() -> "AgentStats":
+	"""
+	Create and return the agent counters shared by every session.
+
+	Returns:
+		stats: The agent counters.
+	"""
+	from utils.agent_guard import AgentStats
+	return AgentStats()
+
+@cache_resource
+def get_session_store() -> SessionStore:
+	"""
+	Create and return the session store shared by every session of the process.
+
+	SESSION_STORE selects the backend: 'sqlite' (default) persists histories
+	to SESSION_DB_PATH (default sessions.db), shared by every replica using
+	the same file, 'memory' keeps them in this process only. SESSION_CACHE_SIZE
+	(default 1000) bounds the hot sessions kept in memory and SESSION_TTL
+	(seconds, default one week) expires idle sessions.
+
+	Returns:
+		store: The session store instance.
+
+	Raises:
+		NotImplementedError: If the specified backend is not supported.
+	"""
+	match os.getenv("SESSION_STORE", "sqlite"):
+		case "sqlite":
+			return SQLiteSessionStore(
+				path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+				max_sessions=int(os.getenv("SESSION_CACHE_SIZE", 1000)),
+				ttl=float(os.getenv("SESSION_TTL", 7 * 24 * 3600)),
+			)
+		case "memory":
+			return MemorySessionStore()
+		case _:
+			raise NotImplementedError
+
+@cache_resource
+def get_shards() -> List[Shard]:
+	"""
+	Return the index shards served, empty to serve the single default index.
+
+	INDEX_SHARDS lists the shard names, comma separated, out of the shards
+	file at SHARDS_PATH (default shards.json).
+
+	Returns:
+		shards: The shards, in the order given.
+	"""
+	names = os.getenv("INDEX_SHARDS")
+	if not names:
+		return []
+	return load_shards([name.strip() for name in names.split(",")], os.getenv("SHARDS_PATH", SHARDS_PATH))
+
+def get_index_version(qa: bool = False) -> Optional[tuple]:
+	"""
+	Return the fingerprint of the index or shards served, see `index_version`.
+
+	Args:
+		qa (bool): The question-keyed index.
+
+	Returns:
+		version: Changes whenever an index served is rewritten.
+	"""
+	shards = get_shards()
+	if shards:
+		return shards_version(shards, qa)
+	return index_version(QA_INDEX_PATH if qa else INDEX_PATH)
 
 @cache_resource
-def get_retriever() -> BaseRetriever:
+def get_retriever(index_spec: Optional[str] = None, mmap: bool = True, qa: bool = False) -> BaseRetriever:
 	"""
 	Create and return a retriever object for information retrieval.
 
@@ -21,12 +179,64 @@ def get_retriever() -> BaseRetriever:
 	It creates an embedding function, loads or creates a vector store using
 	that embedding function, and then converts the vector store into a retriever object.
 
+	Unless CONTEXT_MAX_TOKENS is 0, the retriever searches CONTEXT_FETCH_K
+	candidates (default 20) and packs them into CONTEXT_MAX_TOKENS tokens
+	(default 1000) with `pack_context`, tuned by CONTEXT_LAMBDA (default
+	0.7) and CONTEXT_SCORE_GAP (default 0.25, negative disables the cut-off).
+
+	With INDEX_SHARDS set (see `get_shards`), every shard is loaded and
+	searched in parallel behind a `ShardedVectorStore`.
+
+	Args:
+		index_spec (Optional[str]): FAISS index spec such as "HNSW32;ef_search=64"
+			(see `IndexSpec.parse`), the flat index when None.
+		mmap (bool): Serve the index memory-mapped with an on-disk docstore,
+			shared through the page cache by every process.
+		qa (bool): Search the question-keyed Q/A index instead of the chunk index.
+
 	Returns:
 		retriever: An object that can be used to retrieve information from the vector store.
 	"""
-	embedding_function = create_embedding_function()
-	vectorstore = create_or_load_vectorstore(embedding_function)
+	embedding_function = get_embedding_function()
+	spec = IndexSpec.parse(index_spec) if index_spec else None
+	shards = get_shards()
+	if shards:
+		vectorstore = ShardedVectorStore(
+			{
+				shard.name: traced_vectorstore(create_or_load_vectorstore(
+					embedding_function,
+					index_path=shard.path(qa),
+					index_spec=spec,
+					mmap=mmap,
+					qa=qa,
+					dataset_path=shard.dataset_path,
+				))
+				for shard in shards
+			},
+			embedding_function,
+		)
+	else:
+		vectorstore = traced_vectorstore(create_or_load_vectorstore(
+			embedding_function,
+			index_path=QA_INDEX_PATH if qa else INDEX_PATH,
+			index_spec=spec,
+			mmap=mmap,
+			qa=qa,
+		))
 
+	max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", 1000))
+	if max_tokens > 0:
+		score_gap = float(os.getenv("CONTEXT_SCORE_GAP", 0.25))
+		return PackedRetriever(
+			vectorstore=vectorstore,
+			fetch_k=int(os.getenv("CONTEXT_FETCH_K", 20)),
+			max_tokens=max_tokens,
+			lambda_mult=float(os.getenv("CONTEXT_LAMBDA", 0.7)),
+			max_score_gap=score_gap if score_gap >= 0 else None,
+			qa_pairs=qa,
+		)
+	if qa:
+		return QAPairRetriever(vectorstore=vectorstore)
 	retriever = vectorstore.as_retriever()
 	return retriever
 
@@ -36,13 +246,16 @@ def get_llm(llm_type: str, model_name: str, agent: bool) -> ChatOpenAI:
 	Create and return a language model (LLM) based on the specified type and model name.
 
 	This function uses a cached resource and logs the time taken to execute. 
-	It matches the provided LLM type to instantiate the appropriate model (OpenRouter or Runpod).
-	If the 'agent' parameter is True, it binds an agent to the LLM.
+	It matches the provided LLM type to instantiate the appropriate model (OpenRouter or Runpod),
+	or a router sending each request to the faster of both with hedging.
+	The agent's LLM gets no stop sequence of its own: `create_react_agent`
+	binds "\nObservation", and a "\nFinal Answer" stop would cut the final
+	answer that `FinalAnswerStreamHandler` streams.
 
 	Args:
-		llm_type (str): The type of language model to create ('openrouter' or 'runpod').
-		model_name (str): The name of the model to use.
-		agent (bool): A flag indicating whether to bind an agent to the LLM.
+		llm_type (str): The type of language model to create ('openrouter', 'runpod' or 'router').
+		model_name (str): The name of the model to use, the OpenRouter model for 'router'.
+		agent (bool): Whether the LLM serves the ReAct agent, which gets its own instance.
 
 	Returns:
 		llm: An instantiated language model object.
@@ -63,9 +276,152 @@ def get_llm(llm_type: str, model_name: str, agent: bool) -> ChatOpenAI:
 				model_name=model_name,
 				openai_api_base=f"https://api.runpod.ai/v2/{runpod_endpoint_id}/openai/v1",
 			)
+			start_keep_warm(llm)
+		case "router":
+			runpod_endpoint_id = os.getenv("RUNPOD_ENDPOINT_ID")
+			runpod_llm = ChatRunpod(
+				model_name=os.getenv("RUNPOD_MODEL_NAME"),
+				openai_api_base=f"https://api.runpod.ai/v2/{runpod_endpoint_id}/openai/v1",
+			)
+			start_keep_warm(runpod_llm)
+			llm = ChatRouter(
+				backends={
+					"openrouter": ChatOpenRouter(
+						model_name=model_name,
+						temperature=0,
+					),
+					"runpod": runpod_llm,
+				},
+				hedge_percentile=float(os.getenv("ROUTER_HEDGE_PERCENTILE", 95)),
+			)
 		case _:
 			raise NotImplementedError
 
-	if agent:
-		llm = llm.bind(stop=["\nFinal Answer"])
 	return llm
+
+@cache_resource
+def get_session_history_fn(llm_type: str, model_name: str, agent: bool) -> Callable[[str], BaseChatMessageHistory]:
+	"""
+	Create and return the session history getter used by the runner and the UI.
+
+	Histories come from the process-wide session store, since the runner
+	executes on the shared event loop thread which has no access to
+	st.session_state. They are kept under HISTORY_MAX_TOKENS (default 1000,
+	0 disables summarization).
+
+	Args:
+		llm_type (str): The type of language model ('openrouter', 'runpod' or 'router').
+		model_name (str): The name of the model.
+		agent (bool): Whether the LLM is bound for the ReAct agent.
+
+	Returns:
+		session_history: A function returning the history of a session ID.
+	"""
+	llm = get_llm(llm_type, model_name, agent)
+	history_max_tokens = int(os.getenv("HISTORY_MAX_TOKENS", 1000))
+
+	return partial(
+		get_session_history,
+		store=get_session_store(),
+		history_factory=(
+			partial(SummaryBufferHistory, llm, max_tokens=history_max_tokens)
+			if history_max_tokens > 0 else ChatMessageHistory
+		),
+	)
+
+@cache_resource
+def get_runner(
+	llm_type: str,
+	model_name: str,
+	agent: bool,
+	index_spec: Optional[str] = None,
+	mmap: bool = True,
+	speculative: bool = False,
+	qa: bool = False,
+	answer_cache: bool = True,
+) -> RunnableWithMessageHistory:
+	"""
+	Create and return the runner answering chat messages, built once per configuration.
+
+	The runner holds no per-session state, histories are looked up by the
+	session ID in the config, so a single instance serves every session and
+	Streamlit reruns do not rebuild any chain.
+
+	Args:
+		llm_type (str): The type of language model ('openrouter', 'runpod' or 'router').
+		model_name (str): The name of the model to use.
+		agent (bool): Use the ReAct agent instead of the RAG chain.
+		index_spec (Optional[str]): FAISS index spec, see `get_retriever`.
+		mmap (bool): Serve the index memory-mapped, see `get_retriever`.
+		speculative (bool): Retrieve for the raw question while it is reformulated.
+		qa (bool): Search the question-keyed Q/A index, see `get_retriever`.
+		answer_cache (bool): Put the RAG chain behind the semantic answer cache, see `get_answer_cache`.
+
+	Returns:
+		runner: The chain or agent wrapped with the session history.
+	"""
+	retriever = get_retriever(index_spec, mmap, qa)
+	llm = get_llm(llm_type, model_name, agent)
+
+	if agent:
+		# Only the agent needs these, keep them out of the RAG startup path
+		from langchain.agents import create_react_agent
+		from utils.agent_guard import GuardedAgentExecutor, ToolMemo
+
+		tools = [create_qa_tool(retriever)]
+		max_tokens = int(os.getenv("AGENT_MAX_TOKENS", 4000))
+		executor = GuardedAgentExecutor(
+			agent=create_react_agent(llm, tools, create_prompt_react_agent()),
+			tools=tools,
+			max_iterations=int(os.getenv("AGENT_MAX_ITERATIONS", 10)),
+			verbose=os.getenv("DEBUG") != None,
+			handle_parsing_errors=True,
+			memo=ToolMemo(),
+			stats=get_agent_stats(),
+			fallback=create_qa_chain(llm, retriever),
+			max_turn_seconds=float(os.getenv("AGENT_MAX_SECONDS", 60)),
+			max_turn_tokens=max_tokens or None,
+			max_repeats=int(os.getenv("AGENT_MAX_REPEATS", 2)),
+		)
+		# Tool results are memoized per session, hand the session ID to the executor
+		runner = RunnableLambda(
+			lambda x, config: {**x, "session_id": config.get("configurable", {}).get("session_id")}
+		) | executor
+	else:
+		runner = create_rag_chain(
+			llm,
+			retriever,
+			get_embedding_function(),
+			get_answer_cache(llm_type, model_name) if answer_cache else None,
+			speculation_stats=get_speculation_stats() if speculative else None,
+			speculation_threshold=float(os.getenv("SPECULATION_THRESHOLD", 0.9)),
+		)
+
+	return RunnableWithMessageHistory(
+		runner,
+		get_session_history_fn(llm_type, model_name, agent),
+		input_messages_key="input",
+		history_messages_key="chat_history",
+		output_messages_key="output" if agent else "answer",
+	)
+
+@cache_resource
+def warm_up(index_spec: Optional[str] = None, mmap: bool = True, qa: bool = False) -> float:
+	"""
+	Load the embedding model and the index and run a dummy query, once per process.
+
+	The first forward pass of the model and the first search (which pages in
+	a memory-mapped index) are much slower than the next ones, so they are
+	paid here instead of by the first user question.
+
+	Args:
+		index_spec (Optional[str]): FAISS index spec, see `get_retriever`.
+		mmap (bool): Serve the index memory-mapped, see `get_retriever`.
+		qa (bool): Search the question-keyed Q/A index, see `get_retriever`.
+
+	Returns:
+		seconds: Time the warm-up took.
+	"""
+	start = time.perf_counter()
+	get_retriever(index_spec, mmap, qa).invoke("What are the symptoms of the flu?")
+	return time.perf_counter() - start
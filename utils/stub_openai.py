@@ -0,0 +1,172 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+DEFAULTS = {
+	"delay": 0.0,
+	"jitter": 0.0,
+	"token_delay": 0.0,
+	"error_rate": 0.0,
+	"cold_start": 0.0,
+	"idle_timeout": 5.0,
+	"reply": "Stub answer from a local OpenAI-compatible server.",
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+	"""
+	Minimal OpenAI-compatible chat completions endpoint with configurable
+	latency and failures, for exercising the LLM clients locally.
+
+	With `cold_start` set, a request arriving while no other one is being
+	handled, more than `idle_timeout` seconds after the last one finished,
+	waits that much longer, like a serverless worker being started again.
+	"""
+
+	server: "StubServer"
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+	def _json(self, status: int, body: Dict[str, Any]) -> None:
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self) -> None:
+		self._json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+	def do_POST(self) -> None:
+		with self.server.lock:
+			self.server.in_flight += 1
+		try:
+			self._chat_completion()
+		finally:
+			with self.server.lock:
+				self.server.in_flight -= 1
+				self.server.last_request = time.monotonic()
+
+	def _chat_completion(self) -> None:
+		length = int(self.headers.get("Content-Length", 0))
+		request = json.loads(self.rfile.read(length) or b"{}")
+		options = self.server.options
+
+		with self.server.lock:
+			self.server.requests += 1
+			now = time.monotonic()
+			# Only this request is in flight, the worker idled since the last one finished
+			idle = self.server.in_flight == 1 and (
+				self.server.last_request is None or now - self.server.last_request > options["idle_timeout"]
+			)
+			cold = idle and bool(options["cold_start"])
+			if cold:
+				self.server.cold_starts += 1
+		if cold:
+			time.sleep(options["cold_start"])
+
+		time.sleep(options["delay"] + random.uniform(0, options["jitter"]))
+		if random.random() < options["error_rate"]:
+			self._json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+			return
+
+		model = request.get("model", "stub")
+		words = options["reply"].split(" ")
+		if not request.get("stream"):
+			self._json(200, {
+				"id": "stub",
+				"object": "chat.completion",
+				"created": int(time.time()),
+				"model": model,
+				"choices": [{
+					"index": 0,
+					"message": {"role": "assistant", "content": options["reply"]},
+					"finish_reason": "stop",
+				}],
+				"usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+			})
+			return
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.end_headers()
+		for i, word in enumerate(words):
+			chunk = {
+				"id": "stub",
+				"object": "chat.completion.chunk",
+				"created": int(time.time()),
+				"model": model,
+				"choices": [{
+					"index": 0,
+					"delta": {"role": "assistant", "content": word if i == 0 else " " + word},
+					"finish_reason": None,
+				}],
+			}
+			self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+			self.wfile.flush()
+			time.sleep(options["token_delay"])
+		self.wfile.write(b"data: [DONE]\n\n")
+
+class StubServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, port: int = 0, **options: Any):
+		super().__init__(("127.0.0.1", port), StubHandler)
+		self.options = {**DEFAULTS, **options}
+		self.requests = 0
+		self.cold_starts = 0
+		self.last_request = None
+		self.in_flight = 0
+		self.lock = threading.Lock()
+
+	@property
+	def base_url(self) -> str:
+		return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+def start_stub_server(port: int = 0, **options: Any) -> StubServer:
+	"""
+	Start a stub server in a background thread.
+
+	Parameters:
+	- port (int): Port to listen on, 0 picks a free one.
+	- **options (Any): Overrides of `DEFAULTS`, e.g. delay or error_rate.
+
+	Returns:
+	- StubServer: The running server, use `base_url` as `openai_api_base`.
+	"""
+	server = StubServer(port, **options)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		prog="Stub OpenAI server",
+		description="Local OpenAI-compatible chat completions server with simulated latency",
+	)
+	parser.add_argument("-p", "--port", type=int, default=8001)
+	parser.add_argument("--delay", type=float, default=DEFAULTS["delay"], help="Seconds before the response starts")
+	parser.add_argument("--jitter", type=float, default=DEFAULTS["jitter"], help="Random extra delay, up to this many seconds")
+	parser.add_argument("--token-delay", type=float, default=DEFAULTS["token_delay"], help="Seconds between streamed tokens")
+	parser.add_argument("--error-rate", type=float, default=DEFAULTS["error_rate"], help="Fraction of requests failing with a 500")
+	parser.add_argument("--cold-start", type=float, default=DEFAULTS["cold_start"], help="Extra seconds for the first request after idling")
+	parser.add_argument("--idle-timeout", type=float, default=DEFAULTS["idle_timeout"], help="Seconds without requests before the stub goes cold")
+	parser.add_argument("--reply", type=str, default=DEFAULTS["reply"])
+	args = parser.parse_args()
+
+	server = StubServer(
+		args.port,
+		delay=args.delay,
+		jitter=args.jitter,
+		token_delay=args.token_delay,
+		error_rate=args.error_rate,
+		cold_start=args.cold_start,
+		idle_timeout=args.idle_timeout,
+		reply=args.reply,
+	)
+	print(f"Serving on {server.base_url}")
+	server.serve_forever()
@@ -0,0 +1,378 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+def trace_path() -> Optional[str]:
+	return os.getenv("TRACE_PATH")
+
+def metrics_port() -> int:
+	return int(os.getenv("TRACE_METRICS_PORT", 0))
+
+def tracing_enabled() -> bool:
+	"""
+	Whether TRACE_PATH or TRACE_METRICS_PORT is set. Read on every call, so
+	values loaded from .env after this module was imported are honoured.
+	"""
+	return trace_path() is not None or metrics_port() > 0
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_NULL_SPAN = nullcontext()
+
+class Metrics:
+	"""
+	Span duration histograms and counters in the Prometheus text format.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(BUCKETS))
+		self.sums: Dict[str, float] = defaultdict(float)
+		self.counts: Dict[str, int] = defaultdict(int)
+		self.tokens = 0
+
+	def observe(self, name: str, seconds: float) -> None:
+		with self.lock:
+			counts = self.buckets[name]
+			for i, bound in enumerate(BUCKETS):
+				if seconds <= bound:
+					counts[i] += 1
+			self.sums[name] += seconds
+			self.counts[name] += 1
+
+	def add_tokens(self, tokens: int) -> None:
+		with self.lock:
+			self.tokens += tokens
+
+	def render(self) -> str:
+		lines = [
+			"# HELP doctorllm_span_seconds Duration of the request stages.",
+			"# TYPE doctorllm_span_seconds histogram",
+		]
+		with self.lock:
+			for name in sorted(self.counts):
+				for bound, count in zip(BUCKETS, self.buckets[name]):
+					lines.append(f'doctorllm_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+				lines.append(f'doctorllm_span_seconds_bucket{{span="{name}",le="+Inf"}} {self.counts[name]}')
+				lines.append(f'doctorllm_span_seconds_sum{{span="{name}"}} {self.sums[name]}')
+				lines.append(f'doctorllm_span_seconds_count{{span="{name}"}} {self.counts[name]}')
+			lines += [
+				"# HELP doctorllm_llm_tokens_total Tokens generated by the LLM.",
+				"# TYPE doctorllm_llm_tokens_total counter",
+				f"doctorllm_llm_tokens_total {self.tokens}",
+			]
+		return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+_sink_lock = threading.Lock()
+_server_lock = threading.Lock()
+_server: Optional[ThreadingHTTPServer] = None
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self) -> None:
+		if self.path.split("?")[0] != "/metrics":
+			self.send_error(404)
+			return
+		body = metrics.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+	"""
+	Serve the metrics on http://0.0.0.0:<port>/metrics, once per process.
+
+	Parameters:
+	- port (Optional[int]): Port to listen on, TRACE_METRICS_PORT when None.
+
+	Returns:
+	- Optional[ThreadingHTTPServer]: The running server, None if the port is taken.
+	"""
+	global _server
+	with _server_lock:
+		if _server is None:
+			try:
+				_server = ThreadingHTTPServer(("0.0.0.0", port if port is not None else metrics_port()), _MetricsHandler)
+			except OSError as e:
+				# Another process of the app already serves it
+				print(f"metrics server not started: {e}")
+				return None
+			threading.Thread(target=_server.serve_forever, name="trace-metrics", daemon=True).start()
+	return _server
+
+class Trace:
+	"""
+	Spans of one request, tied together by its session and request ID.
+
+	Spans are kept in memory while the request runs and written to the
+	JSONL sink and the metrics once it is finished.
+	"""
+
+	def __init__(self, session_id: str, request_id: Optional[str] = None):
+		self.session_id = session_id
+		self.request_id = request_id or uuid.uuid4().hex
+		self.start = time.time()
+		self.lock = threading.Lock()
+		self.spans: List[Dict[str, Any]] = []
+		self.handler = TracingCallbackHandler(self)
+
+	def add(self, name: str, start: float, seconds: float, **attrs: Any) -> None:
+		"""
+		Record a finished span.
+
+		Parameters:
+		- name (str): Stage name, e.g. "faiss_search".
+		- start (float): Start as a Unix timestamp.
+		- seconds (float): Duration.
+		- **attrs (Any): Extra JSON serializable fields.
+		"""
+		with self.lock:
+			self.spans.append({"name": name, "start": start, "seconds": seconds, **attrs})
+
+	@contextmanager
+	def span(self, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+		"""
+		Time the body as a span, attributes can be added to the yielded dict.
+		"""
+		start = time.time()
+		t0 = time.perf_counter()
+		try:
+			yield attrs
+		finally:
+			self.add(name, start, time.perf_counter() - t0, **attrs)
+
+	def finish(self) -> None:
+		"""
+		Close the request span and flush every span to the sinks.
+		"""
+		self.add("request", self.start, time.time() - self.start)
+		with self.lock:
+			spans = list(self.spans)
+
+		for span in spans:
+			metrics.observe(span["name"], span["seconds"])
+			metrics.add_tokens(span.get("tokens", 0))
+
+		path = trace_path()
+		if path is not None:
+			lines = "".join(
+				json.dumps({"session_id": self.session_id, "request_id": self.request_id, **span}) + "\n"
+				for span in spans
+			)
+			with _sink_lock, open(path, "a", encoding="utf-8") as file:
+				file.write(lines)
+
+	def summary(self) -> Dict[str, float]:
+		"""
+		Return the total milliseconds spent per stage.
+
+		Returns:
+		- Dict[str, float]: Milliseconds keyed by span name.
+		"""
+		totals: Dict[str, float] = defaultdict(float)
+		with self.lock:
+			for span in self.spans:
+				totals[span["name"]] += span["seconds"] * 1000
+		return dict(totals)
+
+@contextmanager
+def trace_request(session_id: str, request_id: Optional[str] = None) -> Iterator[Optional[Trace]]:
+	"""
+	Trace the request run in the body, None is yielded when tracing is disabled.
+
+	The trace is current for the body and everything it starts on the async
+	runtime or in copied contexts, so `span` calls anywhere below land in it.
+	LangChain runs are traced by passing `trace.handler` as a callback.
+
+	Tracing is enabled by TRACE_PATH (JSONL file, one span per line) and/or
+	TRACE_METRICS_PORT (Prometheus endpoint at /metrics).
+
+	Parameters:
+	- session_id (str): The session ID.
+	- request_id (Optional[str]): The request ID, a random one when None.
+
+	Returns:
+	- Iterator[Optional[Trace]]: The trace of the request.
+	"""
+	if not tracing_enabled():
+		yield None
+		return
+
+	if metrics_port() > 0:
+		start_metrics_server()
+
+	trace = Trace(session_id, request_id)
+	token = _current.set(trace)
+	try:
+		yield trace
+	finally:
+		_current.reset(token)
+		trace.finish()
+
+def span(name: str, **attrs: Any):
+	"""
+	Time a block as a span of the current trace, a no-op outside of a trace.
+
+	Parameters:
+	- name (str): Stage name.
+	- **attrs (Any): Extra JSON serializable fields.
+	"""
+	trace = _current.get()
+	if trace is None:
+		return _NULL_SPAN
+	return trace.span(name, **attrs)
+
+# Names of the runs recorded as a stage by the callback handler
+CHAIN_STAGES = {
+	"rewrite_question": "question_rewrite",
+	"format_inputs": "prompt_assembly",
+	"ChatPromptTemplate": "prompt_assembly",
+	"PromptTemplate": "prompt_assembly",
+}
+
+class TracingCallbackHandler(BaseCallbackHandler):
+	"""
+	Callback handler recording LangChain runs of a request as spans.
+
+	LLM calls get their time to first token, generated tokens and tokens
+	per second, and the stage they belong to. Tool calls of the agent and
+	the stages listed in `CHAIN_STAGES` are recorded with their duration.
+	"""
+
+	# Timestamps must be taken when the event happens, not when an executor gets to it
+	run_inline = True
+
+	def __init__(self, trace: Trace):
+		self.trace = trace
+		self.runs: Dict[UUID, Dict[str, Any]] = {}
+		self.parents: Dict[UUID, Optional[UUID]] = {}
+		self.names: Dict[UUID, str] = {}
+
+	def _begin(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, **attrs: Any) -> None:
+		self.parents[run_id] = parent_run_id
+		self.names[run_id] = name
+		self.runs[run_id] = {"start": time.time(), "t0": time.perf_counter(), **attrs}
+
+	def _end(self, run_id: UUID, span_name: str, **attrs: Any) -> Optional[Dict[str, Any]]:
+		run = self.runs.pop(run_id, None)
+		if run is None:
+			return None
+		seconds = time.perf_counter() - run.pop("t0")
+		self.trace.add(span_name, run.pop("start"), seconds, **run, **attrs)
+		return run
+
+	def _stage(self, run_id: UUID) -> str:
+		parent = self.parents.get(run_id)
+		while parent is not None:
+			if CHAIN_STAGES.get(self.names.get(parent)) == "question_rewrite":
+				return "question_rewrite"
+			parent = self.parents.get(parent)
+		return "answer"
+
+	def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+		name = kwargs.get("name") or (serialized or {}).get("name") or ""
+		self.parents[run_id] = parent_run_id
+		self.names[run_id] = name
+		if name in CHAIN_STAGES:
+			self._begin(run_id, parent_run_id, name)
+
+	def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+		if run_id in self.runs:
+			self._end(run_id, CHAIN_STAGES[self.names[run_id]])
+
+	def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+		if run_id in self.runs:
+			self._end(run_id, CHAIN_STAGES[self.names[run_id]], error=type(error).__name__)
+
+	def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+		self._begin(run_id, parent_run_id, "llm", ttft=None, tokens=0)
+
+	def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+		self._begin(run_id, parent_run_id, "llm", ttft=None, tokens=0)
+
+	def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+		run = self.runs.get(run_id)
+		if run is None:
+			return
+		if run["ttft"] is None:
+			run["ttft"] = time.perf_counter() - run["t0"]
+		run["tokens"] += 1
+
+	def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+		run = self.runs.get(run_id)
+		if run is None:
+			return
+		if run["tokens"] == 0:
+			# Not streamed, fall back to the usage reported by the provider
+			usage = (response.llm_output or {}).get("token_usage") or {}
+			run["tokens"] = usage.get("completion_tokens", 0)
+		seconds = time.perf_counter() - run["t0"]
+		generating = seconds - (run["ttft"] or 0.0)
+		self._end(
+			run_id,
+			"llm",
+			stage=self._stage(run_id),
+			tokens_per_second=run["tokens"] / generating if generating > 0 else None,
+		)
+
+	def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+		self._end(run_id, "llm", stage=self._stage(run_id), error=type(error).__name__)
+
+	def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+		self._begin(run_id, parent_run_id, "tool", tool=kwargs.get("name") or (serialized or {}).get("name"))
+
+	def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+		self._end(run_id, "tool_call")
+
+	def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+		self._end(run_id, "tool_call", error=type(error).__name__)
+
+class TracedFAISS(FAISS):
+	"""
+	FAISS vector store recording query embedding and index search as spans.
+	"""
+
+	def _embed_query(self, text: str) -> List[float]:
+		with span("query_embedding"):
+			return super()._embed_query(text)
+
+	async def _aembed_query(self, text: str) -> List[float]:
+		with span("query_embedding"):
+			return await super()._aembed_query(text)
+
+	def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, *args: Any, **kwargs: Any) -> List[Any]:
+		with span("faiss_search", k=k):
+			return super().similarity_search_with_score_by_vector(embedding, k, *args, **kwargs)
+
+def traced_vectorstore(vectorstore: FAISS) -> FAISS:
+	"""
+	Make a loaded vector store record spans, returned unchanged when tracing is disabled.
+
+	Parameters:
+	- vectorstore (FAISS): The store to trace.
+
+	Returns:
+	- FAISS: The same store.
+	"""
+	if tracing_enabled() and type(vectorstore) is FAISS:
+		vectorstore.__class__ = TracedFAISS
+	return vectorstore